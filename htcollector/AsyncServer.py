@@ -0,0 +1,262 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017130000
+
+"""
+An asyncio based alternative to the threading Interceptor.
+
+Connections are handled by coroutines on a single event loop, with a minimal
+HTTP/1.1 parser. The routes are those of the InterceptorApp, whose methods
+block on the database or the filesystem, so they are run on a bounded pool
+of worker threads.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPException, parse_headers
+from io import BytesIO
+
+from .Server import InterceptorApp, Response, chunkFrame
+
+MAX_HEADER_SIZE = 65536
+MAX_BODY_SIZE = 65536
+
+
+class BadRequest(Exception):
+    pass
+
+
+async def readRequest(reader):
+    """
+    Read and parse a single request.
+
+    Args:
+        reader (StreamReader): the stream to read from
+
+    Returns:
+        tuple: (method, path, version, headers, body) or None if the connection was closed before a new request started
+
+    Raises:
+        BadRequest: if the request is malformed or too large
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip() == b"":
+            return None
+        raise BadRequest("incomplete request")
+    except asyncio.LimitOverrunError:
+        raise BadRequest("request header too large")
+    requestline, _, rest = head.partition(b"\r\n")
+    try:
+        method, path, version = requestline.decode("iso-8859-1").split()
+    except ValueError:
+        raise BadRequest("malformed request line")
+    if version not in ("HTTP/1.0", "HTTP/1.1"):
+        raise BadRequest("unsupported HTTP version")
+    try:
+        headers = parse_headers(BytesIO(rest))
+    except HTTPException as e:
+        # a header line that is too long or too many headers
+        raise BadRequest(f"malformed headers: {e!r}")
+    body = b""
+    length = headers.get("Content-Length")
+    if length is not None:
+        try:
+            length = int(length)
+        except ValueError:
+            raise BadRequest("malformed Content-Length")
+        if length < 0 or length > MAX_BODY_SIZE:
+            raise BadRequest("request body too large")
+        body = await reader.readexactly(length)
+    return method, path, version, headers, body
+
+
+def keepAlive(version, headers):
+    """HTTP/1.1 connections are persistent unless closed, HTTP/1.0 ones only on request"""
+    connection = headers.get("Connection", "").lower()
+    if version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+
+def formatResponse(response, close, chunked=False):
+    """
+    Format the status line, headers and body of a response.
+
+    For a streamed response only the head is returned, with chunked transfer
+    encoding if chunked is True, otherwise the body ends when the connection
+    is closed.
+    """
+    status = HTTPStatus(response.status)
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    if not response.bare:
+        lines.append(f"Date: {formatdate(usegmt=True)}")
+    body = response.body if response.body is not None else b""
+    for name, value in response.headers:
+        lines.append(f"{name}: {value}")
+    if response.chunks is not None:
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+    elif status != HTTPStatus.NOT_MODIFIED:
+        lines.append(f"Content-Length: {len(body)}")
+    if close:
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("iso-8859-1") + body
+
+
+class AsyncInterceptor:
+    """
+    Serves the routes of the InterceptorApp with asyncio.
+
+    Args:
+        server_address (tuple): (host, port) to listen on
+        db (MeasurementDatabase): the database
+        static_directory (str): directory containing static resources
+        ingest (IngestBuffer, optional): if provided, measurements are queued here instead of being stored directly. Defaults to None.
+        workers (int, optional): maximum number of threads for blocking calls. Defaults to 8.
+        timeout (float, optional): seconds an idle connection is kept open. Defaults to 15.
+        maxrequests (int, optional): number of requests after which a connection is closed. Defaults to 100.
+        cache (ResponseCache, optional): cache for the dashboard responses. Defaults to None.
+        compresslevel (int, optional): level for compressing json and html responses, 0 disables compression. Defaults to 6.
+        compressmin (int, optional): responses smaller than this many bytes are not compressed. Defaults to 1024.
+        maxstreams (int, optional): number of /series and /export responses streamed at the same time. Defaults to 2.
+
+    """
+
+    def __init__(
+        self,
+        server_address,
+        db,
+        static_directory,
+        ingest=None,
+        workers=8,
+        timeout=15.0,
+        maxrequests=100,
+        cache=None,
+        compresslevel=6,
+        compressmin=1024,
+        maxstreams=2,
+    ):
+        self.server_address = server_address
+        self.app = InterceptorApp(
+            db, static_directory, ingest, cache, compresslevel, compressmin, maxstreams
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="AsyncInterceptor"
+        )
+        self.timeout = timeout
+        self.maxrequests = maxrequests
+
+    async def handleConnection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        requests = 0
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(readRequest(reader), self.timeout)
+                except BadRequest as e:
+                    logging.info(f"bad request: {e}")
+                    writer.write(
+                        formatResponse(
+                            Response(HTTPStatus.BAD_REQUEST, bare=True), True
+                        )
+                    )
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, version, headers, body = request
+                logging.info(path)
+                response = await loop.run_in_executor(
+                    self.executor, self.app.handle, method, path, headers, body
+                )
+                requests += 1
+                close = requests >= self.maxrequests or not keepAlive(version, headers)
+                if response.chunks is None:
+                    writer.write(formatResponse(response, close))
+                    await writer.drain()
+                else:
+                    chunked = version == "HTTP/1.1"
+                    close = close or not chunked
+                    writer.write(formatResponse(response, close, chunked))
+                    if not await self.stream(response.chunks, writer, chunked):
+                        break
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, chunks, writer, chunked):
+        """
+        Send the pieces of a streamed response, produced on the worker threads.
+
+        Returns:
+            bool: False if the response was broken off
+        """
+        loop = asyncio.get_running_loop()
+        iterator = iter(chunks)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    writer.write(chunkFrame(chunk) if chunked else chunk)
+                    await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+            return True
+        except ConnectionError:
+            raise
+        except Exception as e:
+            logging.exception(e)
+            return False
+        finally:
+            if hasattr(iterator, "close"):
+                await loop.run_in_executor(self.executor, iterator.close)
+
+    async def serve(self):
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self.handleConnection,
+            host or None,
+            port,
+            limit=MAX_HEADER_SIZE,
+            reuse_address=True,
+            backlog=1024,
+        )
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        """
+        Run the server until interrupted.
+        """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
@@ -21,10 +21,27 @@
 
 import logging
 import re
+from contextlib import contextmanager
+from functools import partial
+from itertools import groupby
 import mariadb
 from datetime import datetime, timedelta
 from dateutil import tz
 
+from .Metrics import REGISTRY
+from .Migrations import migrate
+from .Pool import ConnectionPool
+from .Query import QueryCursor, QueryLog
+from .Series import ROLLUP_FIELDS, Series
+from .Utils import formatTimestamp
+from . import Partitions, Utils
+
+QUERY_TIME = REGISTRY.histogram(
+    "htcollector_db_method_duration_seconds",
+    "Time spent in MeasurementDatabase methods, including waiting for a connection.",
+    ("method",),
+)
+
 
 class Measurement:
     """
@@ -34,6 +51,7 @@ class Measurement:
         stationid (str): station identification. Must contain only 1 or more alphnumeric characters or hyphens
         temperature (float): _description_
         humidity (float): _description_
+        timestamp (datetime, optional): time of the measurement or None to let the database add it. Defaults to None.
 
     Raises:
         ValueError: if the stationid argument contains illegal characters or temperature or humidity arguments are not compatible to floats
@@ -42,7 +60,7 @@ class Measurement:
 
     idchars = re.compile(r"^[a-z01-9-]+$", re.IGNORECASE)
 
-    def __init__(self, stationid, temperature, humidity):
+    def __init__(self, stationid, temperature, humidity, timestamp=None):
         if re.match(self.idchars, stationid):
             self.stationid = stationid
         else:
@@ -55,6 +73,7 @@ class Measurement:
                 "temperature and humidity arguments most be floats or convertible to floats",
             )
             raise e
+        self.timestamp = timestamp
 
     def __repr__(self):
         return f'Measurement("{self.stationid}", {self.temperature}, {self.humidity})'
@@ -72,42 +91,325 @@ class MeasurementDatabase:
         port (str): port that the database server is listening on
         user (str): username of a user with access privileges to the database
         password (str): password of the user
+        slowquery (float, optional): seconds after which a statement is logged as slow, 0 disables the log. Defaults to 1.0.
+        poolsize (int, optional): maximum number of connections. Defaults to 5.
+        prewarm (int, optional): number of connections opened right away. Defaults to 1.
+        validate (str, optional): when to ping a connection before it is used, one of Pool.VALIDATION. Defaults to "idle".
+        maxwait (float, optional): seconds to wait for a free connection before Pool.PoolExhausted is raised. Defaults to 5.
 
     """
 
-    def __init__(self, database, host, port, user, password):
-        self.pool = mariadb.ConnectionPool(
-            pool_name="connection_pool_1",
-            user=user,
-            password=password,
-            host=host,
-            database=database,
+    SELECT_RANGE = """SELECT Timestamp, Stationid, Temperature, Humidity
+                                FROM Measurements
+                                WHERE Timestamp >= ? AND Timestamp <= ?"""
+    # statements that filter on Stationid and range or sort on Timestamp,
+    # checkIndexUsage() verifies that they are served by the stationtime index
+    SELECT_STATION_RANGE = """SELECT Timestamp, Stationid, Temperature, Humidity
+                                FROM Measurements
+                                WHERE Stationid = ? AND Timestamp >= ? AND Timestamp <= ?"""
+    SELECT_STATION_BEFORE = """SELECT Timestamp
+                    FROM Measurements
+                    WHERE Stationid = ? AND Timestamp < ? ORDER BY Timestamp DESC LIMIT 1"""
+    COUNT_STATION_RANGE = """SELECT COUNT(*)
+                                FROM Measurements
+                                WHERE Stationid = ? AND Timestamp >= ? AND Timestamp <= ?"""
+
+    # rollup tables from fine to coarse: resolution -> (table, TIMESTAMPDIFF unit, bucket size in seconds)
+    # each rollup is computed from the previous one, the finest from Measurements
+    ROLLUPS = {
+        "minute": ("MeasurementsMinute", "MINUTE", 60),
+        "hour": ("MeasurementsHour", "HOUR", 3600),
+        "day": ("MeasurementsDay", "DAY", 86400),
+    }
+
+    def __init__(
+        self,
+        database,
+        host,
+        port,
+        user,
+        password,
+        slowquery=1.0,
+        poolsize=5,
+        prewarm=1,
+        validate="idle",
+        maxwait=5.0,
+    ):
+        self.pool = ConnectionPool(
+            partial(
+                self._connect,
+                user=user,
+                password=password,
+                host=host,
+                port=int(port),
+                database=database,
+            ),
+            poolsize,
+            prewarm,
+            validate,
+            maxwait,
         )
+        self.storelisteners = []
+        self.querylog = QueryLog(slowquery)
+        # the rollups are complete for measurements before this time, see compactRollups()
+        self.rolledup = None
 
-        with self.pool.get_connection() as connection:
-            connection.auto_reconnect = True
+        # the timestamp is configured for millisecond resolution
+        with self._cursor() as cursor:
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS Measurements(
+                Timestamp DATETIME(3) DEFAULT CURRENT_TIMESTAMP,
+                Stationid VARCHAR(100),
+                Temperature REAL,
+                Humidity REAL);"""
+            )
+            cursor.execute(
+                """CREATE INDEX IF NOT EXISTS ts ON Measurements(Timestamp);"""
+            )
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS StationidToName(
+                Stationid  VARCHAR(100) NOT NULL PRIMARY KEY,
+                Name TEXT NOT NULL);"""
+            )
+            # one row per station with its most recent measurement, kept up to date on every insert
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS LatestMeasurement(
+                Stationid VARCHAR(100) NOT NULL PRIMARY KEY,
+                Timestamp DATETIME(3) NOT NULL,
+                Temperature REAL,
+                Humidity REAL);"""
+            )
 
-            # the timestamp is configured for millisecond resolution
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    """CREATE TABLE IF NOT EXISTS Measurements(
-                    Timestamp DATETIME(3) DEFAULT CURRENT_TIMESTAMP,
-                    Stationid VARCHAR(100),
-                    Temperature REAL,
-                    Humidity REAL);"""
-                )
+            # schema changes after the initial tables are applied as numbered migrations
+            self.schemaversion = migrate(cursor)
+
+            # PERCENTILE_CONT is available from MariaDB 10.3.3 on,
+            # older servers get the percentiles of statistics() computed in python
+            try:
                 cursor.execute(
-                    """CREATE INDEX IF NOT EXISTS ts ON Measurements(Timestamp);"""
+                    "SELECT PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY 1) OVER ()"
                 )
-                cursor.execute(
-                    """CREATE INDEX IF NOT EXISTS si ON Measurements(Stationid);"""
+                cursor.fetchall()
+                self.sqlpercentiles = True
+            except mariadb.Error as e:
+                logging.info(f"computing percentiles in python: {e}")
+                self.sqlpercentiles = False
+
+            cursor.execute("SELECT COUNT(*) FROM LatestMeasurement")
+            if cursor.fetchone()[0] == 0:
+                self._updateLatest(cursor)
+            cursor.commit()
+
+    # existing rows of LatestMeasurement are only replaced by more recent measurements
+    LATEST_UPDATE = """ON DUPLICATE KEY UPDATE
+                    Temperature = IF(VALUES(Timestamp) >= LatestMeasurement.Timestamp,
+                                     VALUES(Temperature), LatestMeasurement.Temperature),
+                    Humidity = IF(VALUES(Timestamp) >= LatestMeasurement.Timestamp,
+                                  VALUES(Humidity), LatestMeasurement.Humidity),
+                    Timestamp = IF(VALUES(Timestamp) >= LatestMeasurement.Timestamp,
+                                   VALUES(Timestamp), LatestMeasurement.Timestamp)"""
+
+    @staticmethod
+    def _updateLatest(cursor):
+        """
+        Copy the most recent measurement of every station to the LatestMeasurement table.
+
+        This reads all of Measurements, so it is only used to fill the table once.
+
+        Args:
+            cursor (Cursor): a cursor on the connection whose transaction the update should be part of
+        """
+        cursor.execute(
+            f"""INSERT INTO LatestMeasurement(Stationid, Timestamp, Temperature, Humidity)
+                SELECT m.Stationid, m.Timestamp, m.Temperature, m.Humidity
+                FROM Measurements m
+                JOIN (SELECT Stationid, MAX(Timestamp) AS Timestamp
+                        FROM Measurements GROUP BY Stationid) last
+                  ON m.Stationid = last.Stationid AND m.Timestamp = last.Timestamp
+                {MeasurementDatabase.LATEST_UPDATE}"""
+        )
+
+    @staticmethod
+    def _upsertLatest(cursor, rows):
+        """
+        Record the most recent of the rows just inserted for every station in the LatestMeasurement table.
+
+        The values are written as they are, so Measurements is neither read nor locked.
+
+        Args:
+            cursor (Cursor): a cursor on the connection whose transaction the update should be part of
+            rows (list): of (timestamp, stationid, temperature, humidity) with naive UTC timestamps
+        """
+        latest = {}
+        for row in rows:
+            if row[1] not in latest or row[0] >= latest[row[1]][0]:
+                latest[row[1]] = row
+        # one statement per batch, with the stations in a fixed order so that
+        # concurrent batches lock the rows of LatestMeasurement in the same order
+        values = [latest[stationid] for stationid in sorted(latest)]
+        cursor.execute(
+            f"""INSERT INTO LatestMeasurement(Timestamp, Stationid, Temperature, Humidity)
+                VALUES {",".join(["(?,?,?,?)"] * len(values))}
+                {MeasurementDatabase.LATEST_UPDATE}""",
+            [value for row in values for value in row],
+        )
+
+    def checkIndexUsage(self, index="stationtime"):
+        """
+        Verify with EXPLAIN that the per-station queries use the given index.
+
+        The queries on a rollup table should use its primary key, which also
+        starts with the station id. Queries over all stations, like those of
+        compactRollups() or for the '*' station id, select a time range and
+        are not checked.
+
+        Args:
+            index (str, optional): name of the index on Measurements. Defaults to "stationtime".
+
+        Returns:
+            dict: for each checked method, the list of indexes used to access the table and whether that includes only the expected index
+        """
+        now = datetime.now(tz=tz.UTC)
+        start = now - timedelta(days=1)
+        measurements = ("Measurements", "m")
+        with self._cursor() as cursor:
+            cursor.execute("SELECT Stationid FROM LatestMeasurement LIMIT 1")
+            row = cursor.fetchone()
+            stationid = row[0] if row else ""
+            windows, ranges = self._timeseriesStatements(1)
+            aggregate, readings = self._statisticsStatements(
+                "NULL", "Timestamp >= ? AND Timestamp <= ? AND Stationid IN (?)"
+            )
+            # method -> (statement, parameters, tables to check, expected index)
+            statements = {
+                "retrieveMeasurements": (
+                    self.SELECT_STATION_RANGE,
+                    (stationid, start, now),
+                    measurements,
+                    index,
+                ),
+                "retrieveDatetimeBefore": (
+                    self.SELECT_STATION_BEFORE,
+                    (stationid, now),
+                    measurements,
+                    index,
+                ),
+                "countMeasurements": (
+                    self.COUNT_STATION_RANGE,
+                    (stationid, start, now),
+                    measurements,
+                    index,
+                ),
+                "retrieveTimeseries(windows)": (
+                    windows,
+                    (stationid, start),
+                    measurements,
+                    index,
+                ),
+                "retrieveTimeseries": (
+                    ranges,
+                    (stationid, start, now),
+                    measurements,
+                    index,
+                ),
+                "statistics": (aggregate, (start, now, stationid), measurements, index),
+                "statistics(readings)": (
+                    readings,
+                    (start, now, stationid),
+                    measurements,
+                    index,
+                ),
+            }
+            if self.sqlpercentiles:
+                statements["statistics(percentiles)"] = (
+                    self._percentileStatement(
+                        "NULL",
+                        "Timestamp >= ? AND Timestamp <= ? AND Stationid IN (?)",
+                        (50,),
+                    ),
+                    (start, now, stationid),
+                    measurements,
+                    index,
                 )
-                cursor.execute(
-                    """CREATE TABLE IF NOT EXISTS StationidToName(
-                    Stationid  VARCHAR(100) NOT NULL PRIMARY KEY,
-                    Name TEXT NOT NULL);"""
+            for resolution, (table, _, _) in self.ROLLUPS.items():
+                statements[f"retrieveMeasurements({resolution})"] = (
+                    self._rollupStatement(table, stationid),
+                    (stationid, start, now),
+                    (table,),
+                    "PRIMARY",
                 )
+            result = {}
+            for method, (statement, params, tables, expected) in statements.items():
+                cursor.execute("EXPLAIN " + statement, params)
+                columns = [d[0] for d in cursor.description]
+                keys = [
+                    row[columns.index("key")]
+                    for row in cursor.fetchall()
+                    if row[columns.index("table")] in tables
+                ]
+                result[method] = (keys, all(key == expected for key in keys))
+                if not result[method][1]:
+                    logging.warning(
+                        f"{method} does not use index {expected} but {keys}"
+                    )
+        return result
+
+    @staticmethod
+    def _connect(**parameters):
+        # auto_reconnect is an option of the client, so it survives the rollback when the connection is returned
+        connection = mariadb.connect(**parameters)
+        connection.auto_reconnect = True
+        return connection
+
+    @contextmanager
+    def _cursor(self, buffered=True, connection=None):
+        """
+        Check out a connection and open a QueryCursor on it, every statement goes through here.
 
+        Args:
+            buffered (bool, optional): False to stream the rows of a large result. Defaults to True.
+            connection (Connection, optional): an already checked out connection to use instead. Defaults to None.
+
+        Yields:
+            QueryCursor: the cursor, its connection is returned to the pool afterwards
+        """
+        if connection is not None:
+            with QueryCursor(
+                connection, connection.cursor(buffered=buffered), self.querylog
+            ) as cursor:
+                yield cursor
+            return
+        with self.pool.connection() as connection:
+            with QueryCursor(
+                connection, connection.cursor(buffered=buffered), self.querylog
+            ) as cursor:
+                yield cursor
+
+    def addQueryHook(self, hook):
+        """
+        Register a callable that is called with the record of every executed statement, see Query.QueryLog.
+        """
+        self.querylog.addHook(hook)
+
+    def removeQueryHook(self, hook):
+        self.querylog.removeHook(hook)
+
+    def addStoreListener(self, listener):
+        """
+        Register a callable that is called with a list of station ids after new data for them was committed.
+
+        Storing a name for a station counts as new data for that station.
+        """
+        self.storelisteners.append(listener)
+
+    def _notifyStore(self, stationids):
+        for listener in self.storelisteners:
+            try:
+                listener(stationids)
+            except Exception as e:
+                logging.exception(e)
+
+    @QUERY_TIME.timed()
     def storeMeasurement(self, measurement):
         """
         Store a measurement into the database.
@@ -115,27 +417,225 @@ class MeasurementDatabase:
         Args:
             measurement (Measurement): the measurement
 
-        Measurements do not contain timestamps, the are added automatically.
+        A measurement without a timestamp gets the current time.
         """
-        with self.pool.get_connection() as connection:
-            connection.auto_reconnect = True
-            with connection.cursor() as cursor:
+        row = (
+            (
+                measurement.timestamp
+                if measurement.timestamp is not None
+                else datetime.now(tz=tz.UTC)
+            )
+            .astimezone(tz.UTC)
+            .replace(tzinfo=None),
+            measurement.stationid,
+            measurement.temperature,
+            measurement.humidity,
+        )
+        with self._cursor() as cursor:
+            cursor.execute(
+                """INSERT INTO Measurements(Timestamp, Stationid, Temperature, Humidity)
+                       VALUES (?,?,?,?)""",
+                row,
+            )
+            n = cursor.rowcount
+            self._upsertLatest(cursor, [row])
+            cursor.commit()
+        self._notifyStore([measurement.stationid])
+        return n
+
+    @QUERY_TIME.timed()
+    def storeMeasurements(self, measurements):
+        """
+        Store a batch of measurements into the database in a single transaction.
+
+        Args:
+            measurements (list): of Measurement objects
+
+        Measurements without a timestamp get the current time.
+
+        Returns:
+            int: the number of measurements stored
+        """
+        if not measurements:
+            return 0
+        now = datetime.now(tz=tz.UTC)
+        rows = [
+            (
+                (m.timestamp if m.timestamp is not None else now)
+                .astimezone(tz.UTC)
+                .replace(tzinfo=None),
+                m.stationid,
+                m.temperature,
+                m.humidity,
+            )
+            for m in measurements
+        ]
+        with self._cursor() as cursor:
+            cursor.executemany(
+                """INSERT INTO Measurements(Timestamp, Stationid, Temperature, Humidity)
+                       VALUES (?,?,?,?)""",
+                rows,
+            )
+            self._upsertLatest(cursor, rows)
+            cursor.commit()
+        self._notifyStore(sorted({m.stationid for m in measurements}))
+        return len(rows)
+
+    @QUERY_TIME.timed()
+    def maintainPartitions(self, ahead=3, keep=0, archive=False):
+        """
+        Partition Measurements by month, create future partitions and apply the retention policy.
+
+        Partitioning an existing table rebuilds it, so the first call may take a while.
+
+        Args:
+            ahead (int, optional): number of future months to create. Defaults to 3.
+            keep (int, optional): number of past months to keep or 0 to keep everything. Defaults to 0.
+            archive (bool, optional): move the rows of removed months to MeasurementsArchiveYYYYMM tables. Defaults to False.
+
+        Returns:
+            list: names of the partitions that were removed
+        """
+        now = datetime.now(tz=tz.UTC)
+        with self._cursor() as cursor:
+            Partitions.partition(cursor, now, ahead)
+            Partitions.createFuturePartitions(cursor, now, ahead)
+            if keep > 0:
+                return Partitions.applyRetention(cursor, now, keep, archive)
+        return []
+
+    def partitionsUsed(self, stationid, starttime: datetime, endtime: datetime):
+        """
+        Return the partitions that retrieveMeasurements() reads for a given period according to EXPLAIN.
+
+        Args:
+            stationid (str): stationid or asterisk '*'
+            starttime (datetime): starttime of the period
+            endtime (datetime): endtime of the period
+
+        Returns:
+            list: partition names or an empty list if Measurements is not partitioned
+        """
+        starttime = starttime.astimezone(tz.UTC)
+        endtime = endtime.astimezone(tz.UTC)
+        with self._cursor() as cursor:
+            if stationid == "*":
                 cursor.execute(
-                    """INSERT INTO Measurements(Stationid, Temperature, Humidity)
-                           VALUES (?,?,?)""",
-                    (
-                        measurement.stationid,
-                        measurement.temperature,
-                        measurement.humidity,
-                    ),
+                    f"EXPLAIN PARTITIONS {self.SELECT_RANGE}", (starttime, endtime)
+                )
+            else:
+                cursor.execute(
+                    f"EXPLAIN PARTITIONS {self.SELECT_STATION_RANGE}",
+                    (stationid, starttime, endtime),
                 )
-                connection.commit()
-                n = cursor.rowcount
-                cursor.close()
-                return n
+            columns = [d[0] for d in cursor.description]
+            partitions = cursor.fetchone()[columns.index("partitions")]
+        return partitions.split(",") if partitions else []
 
+    @staticmethod
+    def _bucket(t: datetime, resolution):
+        """return the naive UTC start of the rollup bucket that contains t"""
+        t = t.astimezone(tz.UTC).replace(tzinfo=None)
+        epoch = datetime(1970, 1, 1)
+        size = MeasurementDatabase.ROLLUPS[resolution][2]
+        return epoch + timedelta(seconds=(t - epoch).total_seconds() // size * size)
+
+    @QUERY_TIME.timed()
+    def compactRollups(self, since: datetime = None):
+        """
+        Recompute all rollup buckets that contain measurements from a given time onward.
+
+        Buckets are recomputed from scratch, so running this more than once
+        for the same period is harmless.
+
+        A run that resumes after the most recent minute bucket, or that starts
+        no later than the previous complete run, completes the rollups up to
+        its own start, which retrieveMeasurements() needs to pick a rollup
+        with resolution 'auto'.
+
+        Args:
+            since (datetime, optional): oldest measurement time to consider or None to resume after the most recent minute bucket. Defaults to None.
+
+        Returns:
+            datetime: the start of the oldest recomputed minute bucket
+        """
+        start = datetime.now(tz=tz.UTC)
+        complete = since is None or (
+            self.rolledup is not None and since <= self.rolledup
+        )
+        with self._cursor() as cursor:
+            if since is None:
+                cursor.execute("SELECT MAX(Timestamp) FROM MeasurementsMinute")
+                since = cursor.fetchone()[0]
+                since = (
+                    since.replace(tzinfo=tz.UTC)
+                    if since is not None
+                    else datetime(1970, 1, 1, tzinfo=tz.UTC)
+                )
+            source = None
+            for resolution, (table, unit, _) in self.ROLLUPS.items():
+                bucket = f"TIMESTAMPADD({unit}, TIMESTAMPDIFF({unit}, '1970-01-01', Timestamp), '1970-01-01')"
+                if source is None:
+                    aggregates = """COUNT(*),
+                        MIN(Temperature), MAX(Temperature), AVG(Temperature),
+                        MIN(Humidity), MAX(Humidity), AVG(Humidity)"""
+                    source = "Measurements"
+                else:
+                    aggregates = """SUM(Count),
+                        MIN(TemperatureMin), MAX(TemperatureMax), SUM(TemperatureMean * Count) / SUM(Count),
+                        MIN(HumidityMin), MAX(HumidityMax), SUM(HumidityMean * Count) / SUM(Count)"""
+                cursor.execute(
+                    f"""INSERT INTO {table}(Stationid, Timestamp, Count,
+                            TemperatureMin, TemperatureMax, TemperatureMean,
+                            HumidityMin, HumidityMax, HumidityMean)
+                        SELECT Stationid, {bucket} AS Bucket, {aggregates}
+                        FROM {source}
+                        WHERE Timestamp >= ?
+                        GROUP BY Stationid, Bucket
+                        ON DUPLICATE KEY UPDATE
+                            {table}.Count = VALUES(Count),
+                            {table}.TemperatureMin = VALUES(TemperatureMin),
+                            {table}.TemperatureMax = VALUES(TemperatureMax),
+                            {table}.TemperatureMean = VALUES(TemperatureMean),
+                            {table}.HumidityMin = VALUES(HumidityMin),
+                            {table}.HumidityMax = VALUES(HumidityMax),
+                            {table}.HumidityMean = VALUES(HumidityMean)""",
+                    (self._bucket(since, resolution),),
+                )
+                source = table
+            cursor.commit()
+        if complete:
+            self.rolledup = start
+        return self._bucket(since, "minute")
+
+    @classmethod
+    def selectResolution(cls, starttime: datetime, endtime: datetime, points):
+        """
+        Pick the coarsest resolution that still yields at least the requested number of points.
+
+        Args:
+            starttime (datetime): start of the period
+            endtime (datetime): end of the period
+            points (int): the number of points wanted
+
+        Returns:
+            str: one of the keys of ROLLUPS, or 'raw' if even the finest rollup is too coarse
+        """
+        span = (endtime - starttime).total_seconds()
+        for resolution, (_, _, size) in reversed(cls.ROLLUPS.items()):
+            if span / size >= points:
+                return resolution
+        return "raw"
+
+    @QUERY_TIME.timed()
     def retrieveMeasurements(
-        self, stationid, starttime: datetime, endtime: datetime = None
+        self,
+        stationid,
+        starttime: datetime,
+        endtime: datetime = None,
+        resolution=None,
+        points=500,
+        asarrays=False,
     ):
         """
         Get measurements inside a given timeframe.
@@ -144,9 +644,13 @@ class MeasurementDatabase:
             stationid (str): stationid or asterisk '*'
             starttime (datetime): starttime of measurement period (inclusive)
             endtime (datetime, optional): endtime of measurement period (inclusive) or None for now. Defaults to None.
+            resolution (str, optional): None or 'raw' for the stored measurements, 'minute', 'hour' or 'day' for a rollup, or 'auto' to let selectResolution() pick one, which falls back to 'raw' if the rollups are not compacted up to less than a point before endtime. Defaults to None.
+            points (int, optional): the number of points wanted if resolution is 'auto'. Defaults to 500.
+            asarrays (bool, optional): return a Series instead of dicts. Defaults to False.
 
         Returns:
-            list: of dict(timestamp:t, stationid:id, temperature:t, humidity:h)
+            list: of dict(timestamp:t, stationid:id, temperature:t, humidity:h), for rollups temperature and humidity are the means and the dicts also contain count and the minimum and maximum values,
+                or with asarrays a Series with the same fields
         """
         # timestamps in MariaDB are stored in UTC
         endtime = (
@@ -158,98 +662,447 @@ class MeasurementDatabase:
         starttime = starttime.replace(
             microsecond=(starttime.microsecond // 1000) * 1000
         )  # round down to millis
+        if resolution == "auto":
+            resolution = self.selectResolution(starttime, endtime, points)
+            # the rollups are only filled by compactRollups(), which may be disabled or still catching up
+            if resolution != "raw" and (
+                self.rolledup is None
+                or endtime - self.rolledup > (endtime - starttime) / points
+            ):
+                resolution = "raw"
+        if resolution is not None and resolution != "raw":
+            series = self._retrieveRollup(stationid, starttime, endtime, resolution)
+            return series if asarrays else series.rows()
         if stationid == "*":
-            with self.pool.get_connection() as connection:
-                connection.auto_reconnect = True
-                with connection.cursor() as cursor:
-                    cursor.execute(
-                        f"""SELECT Timestamp, Stationid, Temperature, Humidity
-                                FROM Measurements
-                                WHERE Timestamp >= ? AND Timestamp <= ?""",
-                        (starttime, endtime),
-                    )
-                    rows = cursor.fetchall()
+            with self._cursor() as cursor:
+                cursor.execute(
+                    self.SELECT_RANGE,
+                    (starttime, endtime),
+                )
+                rows = cursor.fetchall()
         else:
-            with self.pool.get_connection() as connection:
-                connection.auto_reconnect = True
-                with connection.cursor() as cursor:
-                    cursor.execute(
-                        f"""SELECT Timestamp, Stationid, Temperature, Humidity
-                                FROM Measurements
-                                WHERE Stationid = ? AND Timestamp >= ? AND Timestamp <= ?""",
-                        (stationid, starttime, endtime),
-                    )
-                    rows = cursor.fetchall()
+            with self._cursor() as cursor:
+                cursor.execute(
+                    self.SELECT_STATION_RANGE,
+                    (stationid, starttime, endtime),
+                )
+                rows = cursor.fetchall()
+
+        # the timestamps are converted for the whole result at once
+        series = Series.fromRows(rows)
+        return series if asarrays else series.rows()
 
+    @staticmethod
+    def _measurement(row, timeformat=None):
         # mariadb / mysql timestamps are in UTC but returned as 'naive' datetime objects
-        rows = [
-            {
-                "timestamp": row[0].replace(tzinfo=tz.UTC).astimezone(tz.tzlocal()),
-                "stationid": row[1],
-                "temperature": row[2],
-                "humidity": row[3],
-            }
-            for row in rows
-        ]
+        return {
+            "timestamp": formatTimestamp(row[0], timeformat),
+            "stationid": row[1],
+            "temperature": row[2],
+            "humidity": row[3],
+        }
+
+    @staticmethod
+    def _columns(stationid):
+        # the columnar form of a series, the station id is not repeated on every row
+        return {"stationid": stationid, "t": [], "temperature": [], "humidity": []}
+
+    @QUERY_TIME.timed()
+    def iterMeasurements(
+        self,
+        stationid,
+        starttime: datetime,
+        endtime: datetime = None,
+        chunksize=1000,
+        timeformat=None,
+        columns=False,
+    ):
+        """
+        Generate the measurements inside a given timeframe without holding them all in memory.
+
+        The rows are read from an unbuffered cursor with fetchmany(), so memory
+        use does not depend on the size of the range. A pooled connection is
+        held until the generator is exhausted or closed.
+
+        Args:
+            stationid (str): stationid or asterisk '*'
+            starttime (datetime): starttime of measurement period (inclusive)
+            endtime (datetime, optional): endtime of measurement period (inclusive) or None for now. Defaults to None.
+            chunksize (int, optional): number of rows fetched at a time. Defaults to 1000.
+            timeformat (str, optional): format of the timestamps, see Utils.formatTimestamp(). Defaults to None.
+            columns (bool, optional): yield every chunk as columns instead of rows. Defaults to False.
+
+        Yields:
+            list: of at most chunksize dict(timestamp:t, stationid:id, temperature:t, humidity:h),
+                or with columns, dict(t:[t, ...], stationid:[id, ...], temperature:[t, ...], humidity:[h, ...])
+        """
+        endtime = (
+            endtime.astimezone(tz.UTC)
+            if endtime is not None
+            else datetime.now(tz=tz.UTC)
+        )
+        starttime = starttime.astimezone(tz.UTC)
+        if stationid == "*":
+            statement, parameters = self.SELECT_RANGE, (starttime, endtime)
+        else:
+            statement, parameters = self.SELECT_STATION_RANGE, (
+                stationid,
+                starttime,
+                endtime,
+            )
+        with self._cursor(buffered=False) as cursor:
+            cursor.execute(
+                f"{statement} ORDER BY Timestamp",
+                parameters,
+            )
+            while rows := cursor.fetchmany(chunksize):
+                if columns:
+                    t, stationids, temperatures, humidities = zip(*rows)
+                    yield {
+                        "t": [formatTimestamp(v, timeformat) for v in t],
+                        "stationid": stationids,
+                        "temperature": temperatures,
+                        "humidity": humidities,
+                    }
+                else:
+                    yield [self._measurement(row, timeformat) for row in rows]
+
+    @QUERY_TIME.timed()
+    def countMeasurements(self, stationid, starttime: datetime, endtime: datetime):
+        """
+        Count the measurements inside a given timeframe.
+
+        Args:
+            stationid (str): stationid or asterisk '*'
+            starttime (datetime): starttime of measurement period (inclusive)
+            endtime (datetime): endtime of measurement period (inclusive)
+
+        Returns:
+            int: the number of measurements
+        """
+        endtime = endtime.astimezone(tz.UTC)
+        starttime = starttime.astimezone(tz.UTC)
+        with self._cursor() as cursor:
+            if stationid == "*":
+                cursor.execute(
+                    "SELECT COUNT(*) FROM Measurements WHERE Timestamp >= ? AND Timestamp <= ?",
+                    (starttime, endtime),
+                )
+            else:
+                cursor.execute(
+                    self.COUNT_STATION_RANGE,
+                    (stationid, starttime, endtime),
+                )
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def _timeseriesStatements(n):
+        """
+        Return the statements of retrieveTimeseries() for n stations.
+
+        The first finds the last measurement before the window of every
+        station, the second selects the extended windows. Both read a single
+        range per station on the stationtime index.
+        """
+        placeholders = ",".join("?" * n)
+        ranges = " OR ".join(["(Stationid = ? AND Timestamp >= ?)"] * n)
+        return (
+            f"""SELECT Stationid, MAX(Timestamp)
+                FROM Measurements
+                WHERE Stationid IN ({placeholders}) AND Timestamp < ?
+                GROUP BY Stationid""",
+            f"""SELECT Timestamp, Stationid, Temperature, Humidity
+                FROM Measurements
+                WHERE ({ranges}) AND Timestamp <= ?
+                ORDER BY Stationid, Timestamp""",
+        )
+
+    @QUERY_TIME.timed()
+    def retrieveTimeseries(
+        self,
+        stationids,
+        starttime: datetime,
+        endtime=None,
+        timeformat=None,
+        columns=False,
+    ):
+        """
+        Get the measurements of several stations inside a given timeframe in a fixed number of queries.
+
+        For every station the window is extended back to its last measurement
+        before starttime, if there is one, so that a graph of the window
+        starts with a known value.
+
+        Args:
+            stationids (list): the station ids
+            starttime (datetime): start of the window
+            endtime (datetime, optional): end of the window (inclusive) or None for now. Defaults to None.
+            timeformat (str, optional): format of the timestamps, see Utils.formatTimestamp(). Defaults to None.
+            columns (bool, optional): return every series as columns instead of rows. Defaults to False.
+
+        Returns:
+            dict: stationid -> list of dict(timestamp:t, stationid:id, temperature:t, humidity:h), ordered by timestamp,
+                or with columns, stationid -> dict(stationid:id, t:[t, ...], temperature:[t, ...], humidity:[h, ...])
+        """
+        # stationids compare case-insensitively, the rows carry the stored spelling,
+        # so the series are collected per lower-cased id and returned under the ids as passed
+        keys = {}
+        for stationid in stationids:
+            keys.setdefault(stationid.lower(), stationid)
+        if not keys:
+            return {}
+        if columns:
+            series = {key: self._columns(stationid) for key, stationid in keys.items()}
+        else:
+            series = {key: [] for key in keys}
+        endtime = (
+            endtime.astimezone(tz.UTC)
+            if endtime is not None
+            else datetime.now(tz=tz.UTC)
+        )
+        starttime = starttime.astimezone(tz.UTC)
+        windows, ranges = self._timeseriesStatements(len(keys))
+
+        with self._cursor() as cursor:
+            cursor.execute(windows, (*keys.values(), starttime))
+            starts = {row[0].lower(): row[1] for row in cursor.fetchall()}
+            parameters = []
+            for key, stationid in keys.items():
+                parameters.extend((stationid, starts.get(key, starttime)))
+            cursor.execute(ranges, (*parameters, endtime))
+            rows = cursor.fetchall()
+
+        if columns:
+            for row in rows:
+                c = series[row[1].lower()]
+                c["t"].append(formatTimestamp(row[0], timeformat))
+                c["temperature"].append(row[2])
+                c["humidity"].append(row[3])
+        else:
+            for row in rows:
+                series[row[1].lower()].append(self._measurement(row, timeformat))
+        return {stationid: series[stationid.lower()] for stationid in stationids}
+
+    @staticmethod
+    def _statisticsStatements(bucketexpr, where):
+        """
+        Return the statements of statistics(): the aggregates per station and bucket, and the values for the percentiles.
+        """
+        return (
+            f"""SELECT a.*, COALESCE(n.Name, 'Unknown')
+                FROM (SELECT Stationid, {bucketexpr} AS Bucket, COUNT(*),
+                        MIN(Temperature), MAX(Temperature), AVG(Temperature),
+                        MIN(Humidity), MAX(Humidity), AVG(Humidity)
+                    FROM Measurements
+                    WHERE {where}
+                    GROUP BY Stationid, Bucket) a
+                LEFT JOIN StationidToName n ON n.Stationid = a.Stationid
+                ORDER BY a.Stationid, a.Bucket""",
+            f"""SELECT Stationid, {bucketexpr} AS Bucket, Temperature, Humidity
+                FROM Measurements
+                WHERE {where}
+                ORDER BY Stationid, Bucket""",
+        )
 
-        return rows
+    @staticmethod
+    def _percentileStatement(bucketexpr, where, percentiles):
+        """
+        Return the statement that computes the percentiles per station and bucket in the database.
+        """
+        columns = ", ".join(
+            f"PERCENTILE_CONT({p / 100!r}) WITHIN GROUP (ORDER BY {column}) OVER (PARTITION BY Stationid, Bucket)"
+            for column in ("Temperature", "Humidity")
+            for p in percentiles
+        )
+        return f"""SELECT DISTINCT Stationid, Bucket, {columns}
+                FROM (SELECT Stationid, {bucketexpr} AS Bucket, Temperature, Humidity
+                    FROM Measurements
+                    WHERE {where}) r"""
 
-    def retrieveLastMeasurement(
-        self, stationid=None, _names=None, _unique_stations=None
+    @QUERY_TIME.timed()
+    def statistics(
+        self,
+        stationids,
+        starttime: datetime,
+        endtime=None,
+        bucket=None,
+        percentiles=(5, 50, 95),
+        timeformat=None,
     ):
+        """
+        Summarize the temperature and humidity per station inside a given timeframe.
+
+        The count, minimum, maximum and mean are aggregated by the database,
+        and so are the percentiles if the server supports PERCENTILE_CONT.
+        Otherwise they are computed from the readings of one station and bucket
+        at a time, read from an unbuffered cursor.
+
+        Args:
+            stationids (list): the station ids or None for all stations
+            starttime (datetime): start of the window (inclusive)
+            endtime (datetime, optional): end of the window (inclusive) or None for now. Defaults to None.
+            bucket (str, optional): None to summarize the whole window, or 'minute', 'hour' or 'day' to summarize per bucket. Defaults to None.
+            percentiles (tuple, optional): the percentiles to compute, empty to skip them. Defaults to (5, 50, 95).
+            timeformat (str, optional): format of the bucket timestamps, see Utils.formatTimestamp(). Defaults to None.
+
+        Returns:
+            list: of dict(stationid:id, name:n, bucket:t or None, count:c,
+                temperature:dict(min, max, mean, p5, ...), humidity:dict(min, max, mean, p5, ...)),
+                ordered by station and bucket
+        """
+        if bucket is not None and bucket not in self.ROLLUPS:
+            raise ValueError(f"unknown bucket {bucket}")
+        if stationids is not None:
+            stationids = list(dict.fromkeys(stationids))
+            if not stationids:
+                return []
+        endtime = (
+            endtime.astimezone(tz.UTC)
+            if endtime is not None
+            else datetime.now(tz=tz.UTC)
+        )
+        starttime = starttime.astimezone(tz.UTC)
+        if bucket is None:
+            bucketexpr = "NULL"
+        else:
+            unit = self.ROLLUPS[bucket][1]
+            bucketexpr = f"TIMESTAMPADD({unit}, TIMESTAMPDIFF({unit}, '1970-01-01', Timestamp), '1970-01-01')"
+        where = "Timestamp >= ? AND Timestamp <= ?"
+        parameters = [starttime, endtime]
+        if stationids is not None:
+            where += f" AND Stationid IN ({','.join('?' * len(stationids))})"
+            parameters.extend(stationids)
+        aggregate, readings = self._statisticsStatements(bucketexpr, where)
+
+        summaries = {}
+        with self._cursor() as cursor:
+            cursor.execute(aggregate, parameters)
+            # stationids compare case-insensitively, so rows of one group may differ in case
+            for row in cursor.fetchall():
+                summaries[row[0].lower(), row[1]] = {
+                    "stationid": row[0],
+                    "name": row[9],
+                    "bucket": None
+                    if row[1] is None
+                    else formatTimestamp(row[1], timeformat),
+                    "count": row[2],
+                    "temperature": {"min": row[3], "max": row[4], "mean": row[5]},
+                    "humidity": {"min": row[6], "max": row[7], "mean": row[8]},
+                }
+            names = [f"p{p:g}" for p in percentiles]
+            if names and summaries and self.sqlpercentiles:
+                cursor.execute(
+                    self._percentileStatement(bucketexpr, where, percentiles),
+                    parameters,
+                )
+                for row in cursor.fetchall():
+                    summary = summaries.get((row[0].lower(), row[1]))
+                    if summary is not None:
+                        summary["temperature"].update(
+                            zip(names, row[2 : 2 + len(names)])
+                        )
+                        summary["humidity"].update(zip(names, row[2 + len(names) :]))
+            elif names and summaries:
+                with self._cursor(
+                    buffered=False, connection=cursor.connection
+                ) as rowcursor:
+                    rowcursor.execute(readings, parameters)
+                    for key, rows in groupby(
+                        rowcursor, key=lambda row: (row[0].lower(), row[1])
+                    ):
+                        _, _, temperatures, humidities = zip(*rows)
+                        summary = summaries.get(key)
+                        if summary is None:
+                            continue
+                        for name, values in (
+                            ("temperature", temperatures),
+                            ("humidity", humidities),
+                        ):
+                            summary[name].update(
+                                zip(names, Utils.percentiles(values, percentiles))
+                            )
+        return list(summaries.values())
+
+    @staticmethod
+    def _rollupStatement(table, stationid):
+        """the statement that selects a range of a rollup table, for a station or for all stations with '*'"""
+        where = "Timestamp >= ? AND Timestamp <= ?"
+        if stationid != "*":
+            where = f"Stationid = ? AND {where}"
+        return f"""SELECT Timestamp, Stationid, TemperatureMean, HumidityMean, Count,
+                        TemperatureMin, TemperatureMax, HumidityMin, HumidityMax
+                    FROM {table}
+                    WHERE {where}"""
+
+    def _retrieveRollup(self, stationid, starttime, endtime, resolution):
+        if resolution not in self.ROLLUPS:
+            raise ValueError(f"unknown resolution {resolution}")
+        table = self.ROLLUPS[resolution][0]
+        # include the bucket the starttime falls in
+        starttime = self._bucket(starttime, resolution)
+        with self._cursor() as cursor:
+            if stationid == "*":
+                cursor.execute(
+                    self._rollupStatement(table, stationid), (starttime, endtime)
+                )
+            else:
+                cursor.execute(
+                    self._rollupStatement(table, stationid),
+                    (stationid, starttime, endtime),
+                )
+            rows = cursor.fetchall()
+
+        return Series.fromRows(rows, ROLLUP_FIELDS)
+
+    @QUERY_TIME.timed()
+    def retrieveLastMeasurement(self, stationid=None):
         """
         Return the last measurement data for a station or all stations.
 
+        The measurements are read from the LatestMeasurement table that is
+        maintained on every insert, so the cost depends on the number of
+        stations only and not on the number of stored measurements.
+
         Args:
-            stationid (str): the stationid or an asterisk '*'
+            stationid (str): the stationid, an asterisk '*' or None for all stations
 
         Returns:
             list: a list of dict objects, one for each station
         """
-        logging.debug(
-            f"retrieveLastMeasurement {stationid} names={_names} unique_stations{_unique_stations}"
-        )
-        if _names is None:
-            _names = self.names("*")
-
-        if _unique_stations is None:
-            _unique_stations = self.uniqueStations()
-
-        if stationid is None:
-            rows = []
-            for unique_station in _unique_stations:
-                rows.extend(
-                    self.retrieveLastMeasurement(
-                        unique_station, _names=_names, _unique_stations=_unique_stations
-                    )
+        logging.debug(f"retrieveLastMeasurement {stationid}")
+        with self._cursor() as cursor:
+            if stationid is None or stationid == "*":
+                cursor.execute(
+                    """SELECT m.Timestamp, m.Stationid, m.Temperature, m.Humidity, COALESCE(n.Name, 'Unknown')
+                        FROM LatestMeasurement m
+                        LEFT JOIN StationidToName n ON n.Stationid = m.Stationid
+                        ORDER BY m.Stationid"""
                 )
-        else:
-            # get the data
-            with self.pool.get_connection() as connection:
-                connection.auto_reconnect = True
-                with connection.cursor() as cursor:
-                    cursor.execute(
-                        """SELECT Timestamp as 'Timestamp [timestamp]', Stationid, Temperature, Humidity
-                            FROM Measurements
-                            WHERE Stationid = ? ORDER BY timestamp DESC LIMIT 1;""",
-                        (stationid,),
-                    )
-                    rows = cursor.fetchall()
-                    # mariadb / mysql timestamps are in UTC but returned as 'naive' datetime objects
-                    logging.info(f"retrieveLastMeasurement {stationid}, {rows}")
-                    rows = [
-                        {
-                            "time": row[0].replace(tzinfo=tz.UTC),
-                            "deltat": datetime.now() - row[0],
-                            "stationid": row[1],
-                            "name": _names.get(row[1], "unknown"),
-                            "temperature": row[2],
-                            "humidity": row[3],
-                        }
-                        for row in rows
-                    ]
-        return rows
+            else:
+                cursor.execute(
+                    """SELECT m.Timestamp, m.Stationid, m.Temperature, m.Humidity, COALESCE(n.Name, 'Unknown')
+                        FROM LatestMeasurement m
+                        LEFT JOIN StationidToName n ON n.Stationid = m.Stationid
+                        WHERE m.Stationid = ?""",
+                    (stationid,),
+                )
+            rows = cursor.fetchall()
+
+        # mariadb / mysql timestamps are in UTC but returned as 'naive' datetime objects
+        now = datetime.now()
+        return [
+            {
+                "time": row[0].replace(tzinfo=tz.UTC),
+                "deltat": now - row[0],
+                "stationid": row[1],
+                "name": row[4],
+                "temperature": row[2],
+                "humidity": row[3],
+            }
+            for row in rows
+        ]
 
+    @QUERY_TIME.timed()
     def retrieveDatetimeBefore(self, stationid: str, t: datetime):
         """
         Returns the time of the last measurement preceding a given time.
@@ -266,27 +1119,22 @@ class MeasurementDatabase:
 
         logging.debug(f"retrieveDatetimeBefore {stationid} {t}")
 
-        with self.pool.get_connection() as connection:
-            connection.auto_reconnect = True
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    """SELECT Timestamp
-                    FROM Measurements
-                    WHERE Stationid = ? AND Timestamp < ? ORDER BY Timestamp DESC LIMIT 1""",
-                    (stationid, t),
-                )
-                rows = cursor.fetchall()
-                print(t, rows, flush=True)
-                # mariadb / mysql timestamps are in UTC but returned as 'naive' datetime objects
-                return rows[0][0].replace(tzinfo=tz.UTC) if len(rows) else None
+        with self._cursor() as cursor:
+            cursor.execute(
+                self.SELECT_STATION_BEFORE,
+                (stationid, t),
+            )
+            rows = cursor.fetchall()
+            # mariadb / mysql timestamps are in UTC but returned as 'naive' datetime objects
+            return rows[0][0].replace(tzinfo=tz.UTC) if len(rows) else None
 
+    @QUERY_TIME.timed()
     def uniqueStations(self):
-        with self.pool.get_connection() as connection:
-            connection.auto_reconnect = True
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT DISTINCT(Stationid) FROM Measurements")
-                return [row[0] for row in cursor.fetchall()]
+        with self._cursor() as cursor:
+            cursor.execute("SELECT DISTINCT(Stationid) FROM Measurements")
+            return [row[0] for row in cursor.fetchall()]
 
+    @QUERY_TIME.timed()
     def names(self, stationid, name=None):
         """
         Insert or replace a name for a stationid, or return a list of all stations._
@@ -300,24 +1148,20 @@ class MeasurementDatabase:
         """
         if stationid == "*":
             stationids = self.uniqueStations()
-            with self.pool.get_connection() as connection:
-                connection.auto_reconnect = True
-                with connection.cursor() as cursor:
-                    cursor.execute("SELECT * FROM StationidToName")
-                    rows = cursor.fetchall()
-                    print("names>>>", rows)
-                    stationmap = {row[0]: row[1] for row in rows}
-                    for s in stationids:
-                        if s not in stationmap:
-                            stationmap[s] = "Unknown"
-                    return stationmap
+            with self._cursor() as cursor:
+                cursor.execute("SELECT * FROM StationidToName")
+                rows = cursor.fetchall()
+                stationmap = {row[0]: row[1] for row in rows}
+                for s in stationids:
+                    if s not in stationmap:
+                        stationmap[s] = "Unknown"
+                return stationmap
         else:
-            with self.pool.get_connection() as connection:
-                connection.auto_reconnect = True
-                with connection.cursor() as cursor:
-                    cursor.execute(
-                        "REPLACE StationidToName(Stationid, Name) VALUES(?,?)",
-                        (stationid, name),
-                    )
-                    connection.commit()
-                    return self.names("*")
+            with self._cursor() as cursor:
+                cursor.execute(
+                    "REPLACE StationidToName(Stationid, Name) VALUES(?,?)",
+                    (stationid, name),
+                )
+                cursor.commit()
+            self._notifyStore([stationid])
+            return self.names("*")
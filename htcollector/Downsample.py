@@ -0,0 +1,114 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017173000
+
+
+"""
+Shape preserving downsampling of time series.
+
+lttb() implements Largest-Triangle-Three-Buckets (Sveinn Steinarsson, 2013).
+The first and last points are always kept, the points in between are divided
+into equally sized buckets and from every bucket the point is selected that
+forms the largest triangle with the point selected from the previous bucket
+and the average of the next bucket. Peaks and dips survive, unlike with
+averaging or taking every nth point.
+
+The bucket averages and triangle areas are computed with numpy if it is
+installed, and with plain Python otherwise.
+"""
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def _buckets(n, threshold):
+    # the boundaries of the threshold - 2 buckets between the first and last point
+    every = (n - 2) / (threshold - 2)
+    return [int(i * every) + 1 for i in range(threshold - 2)] + [n - 1]
+
+
+def _lttb(x, y, threshold):
+    bounds = _buckets(len(x), threshold)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        # the average of the next bucket, which for the last bucket is the last point
+        nstart, nend = end, bounds[i + 2] if i + 2 < len(bounds) else len(x)
+        avgx = sum(x[nstart:nend]) / (nend - nstart)
+        avgy = sum(y[nstart:nend]) / (nend - nstart)
+        ax, ay = x[a], y[a]
+        dx, dy = ax - avgx, avgy - ay
+        best, maxarea = start, -1.0
+        for j in range(start, end):
+            # twice the area of the triangle, which does not change the comparison
+            area = abs(dx * (y[j] - ay) - (ax - x[j]) * dy)
+            if area > maxarea:
+                best, maxarea = j, area
+        selected.append(best)
+        a = best
+    selected.append(len(x) - 1)
+    return selected
+
+
+def _lttb_numpy(x, y, threshold):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = np.array(_buckets(len(x), threshold) + [len(x)])
+    # the averages of all buckets at once, the last bucket being the last point
+    sizes = np.diff(bounds)
+    avgx = np.add.reduceat(x, bounds[:-1]) / sizes
+    avgy = np.add.reduceat(y, bounds[:-1]) / sizes
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        ax, ay = x[a], y[a]
+        area = np.abs(
+            (ax - avgx[i + 1]) * (y[start:end] - ay)
+            - (ax - x[start:end]) * (avgy[i + 1] - ay)
+        )
+        a = start + int(np.argmax(area))
+        selected.append(a)
+    selected.append(len(x) - 1)
+    return selected
+
+
+def lttb(x, y, threshold):
+    """
+    Select the points of a series that best preserve its shape.
+
+    Args:
+        x (sequence): the x values, for example timestamps in seconds, in ascending order
+        y (sequence): the y values
+        threshold (int): the maximum number of points to keep, at least 3
+
+    Returns:
+        list: the indices of the selected points, in ascending order
+    """
+    if threshold < 3:
+        raise ValueError("the threshold should be at least 3")
+    if len(x) <= threshold:
+        return list(range(len(x)))
+    if np is not None:
+        return _lttb_numpy(x, y, threshold)
+    return _lttb(x, y, threshold)
@@ -0,0 +1,173 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017170000
+
+
+"""
+Encoders for bulk exports of measurements.
+
+Each encoder turns chunks of measurements in columnar form, as generated by
+MeasurementDatabase.iterMeasurements(columns=True), into pieces of a
+document that can be streamed. Nothing but the current chunk is ever held
+in memory. The formats are:
+
+    csv   a header line and a line per measurement, timestamps in ISO 8601 local time
+    bin   the magic b"HTC\\x01", a byte with the length of the station id and the
+          station id, followed by blocks of a little-endian uint32 count n, n int64
+          timestamps in milliseconds since the epoch, n float32 temperatures and
+          n float32 humidities. A block with a count of 0 ends the stream.
+    npy   a numpy array file with a record per measurement, with fields
+          t (datetime64[ms]), temperature (float32) and humidity (float32).
+          The header holds the number of records, so it must be known up front.
+
+The binary formats hold the measurements of a single station.
+"""
+
+import csv
+import io
+import struct
+
+MAGIC = b"HTC\x01"
+
+NPY_DTYPE = "[('t', '<M8[ms]'), ('temperature', '<f4'), ('humidity', '<f4')]"
+NPY_RECORD = struct.Struct("<qff")
+# NaT and NaN, used to pad an npy file if rows disappeared after they were counted
+NPY_PADDING = NPY_RECORD.pack(-(2**63), float("nan"), float("nan"))
+
+# format -> (content type, file extension, needs a single station, needs the row count)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv", False, False),
+    "bin": ("application/octet-stream", "bin", True, False),
+    "npy": ("application/octet-stream", "npy", True, True),
+}
+
+
+def _close(chunks):
+    # close the chunks as well if the consumer stops early, that releases the database connection
+    if hasattr(chunks, "close"):
+        chunks.close()
+
+
+def csvChunks(chunks):
+    """
+    Encode measurements as csv.
+
+    Args:
+        chunks (iterable): of columnar chunks, with timestamps formatted as "iso"
+
+    Yields:
+        bytes: pieces of the csv document
+    """
+    try:
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(("timestamp", "stationid", "temperature", "humidity"))
+        yield out.getvalue().encode()
+        for chunk in chunks:
+            out.seek(0)
+            out.truncate()
+            writer.writerows(
+                zip(
+                    chunk["t"],
+                    chunk["stationid"],
+                    chunk["temperature"],
+                    chunk["humidity"],
+                )
+            )
+            yield out.getvalue().encode()
+    finally:
+        _close(chunks)
+
+
+def binaryChunks(chunks, stationid):
+    """
+    Encode measurements as blocks of packed columns.
+
+    Args:
+        chunks (iterable): of columnar chunks, with timestamps formatted as "epochms"
+        stationid (str): the station the measurements belong to
+
+    Yields:
+        bytes: the header and a block per chunk, and the end marker
+    """
+    try:
+        station = stationid.encode()
+        yield MAGIC + struct.pack("<B", len(station)) + station
+        for chunk in chunks:
+            n = len(chunk["t"])
+            if n:
+                yield struct.pack(
+                    f"<I{n}q{n}f{n}f",
+                    n,
+                    *chunk["t"],
+                    *chunk["temperature"],
+                    *chunk["humidity"],
+                )
+        yield struct.pack("<I", 0)
+    finally:
+        _close(chunks)
+
+
+def npyHeader(count):
+    """
+    Return the header of an npy file (format version 1.0) with count records.
+    """
+    header = f"{{'descr': {NPY_DTYPE}, 'fortran_order': False, 'shape': ({count},), }}"
+    # the header, including magic, version and length, is padded to a multiple of 64 bytes
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = header + " " * (padding % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+def npyChunks(chunks, count):
+    """
+    Encode measurements as an npy file with exactly count records.
+
+    Measurements beyond count are dropped, and if there are fewer the file
+    is padded with records of NaT and NaN, so the file is always valid.
+
+    Args:
+        chunks (iterable): of columnar chunks, with timestamps formatted as "epochms"
+        count (int): the number of records
+
+    Yields:
+        bytes: the header and the records of each chunk
+    """
+    try:
+        yield npyHeader(count)
+        remaining = count
+        for chunk in chunks:
+            n = min(len(chunk["t"]), remaining)
+            if n:
+                yield b"".join(
+                    map(
+                        NPY_RECORD.pack,
+                        chunk["t"][:n],
+                        chunk["temperature"][:n],
+                        chunk["humidity"][:n],
+                    )
+                )
+                remaining -= n
+            if remaining == 0:
+                break
+        if remaining:
+            yield NPY_PADDING * remaining
+    finally:
+        _close(chunks)
@@ -0,0 +1,191 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017101500
+
+import logging
+import threading
+from datetime import datetime
+from time import monotonic, perf_counter
+
+from dateutil import tz
+
+
+class IngestBuffer:
+    """
+    Write-behind buffer that batches measurements before they are stored.
+
+    Measurements are stamped with the time of arrival and queued. The queue is
+    flushed to the database in a single transaction when it holds maxsize
+    measurements or when the oldest measurement is older than maxage seconds.
+
+    The buffer has the same storeMeasurement() interface as a MeasurementDatabase
+    so it can be used in its place wherever measurements are ingested.
+
+    Args:
+        db (MeasurementDatabase): the database to flush measurements to
+        maxsize (int): number of queued measurements that triggers a flush
+        maxage (float): maximum time in seconds a measurement stays queued
+
+    """
+
+    def __init__(self, db, maxsize=100, maxage=5.0):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if maxage <= 0:
+            raise ValueError("maxage must be positive")
+        self.db = db
+        self.maxsize = maxsize
+        self.maxage = maxage
+
+        self.queue = []
+        self.oldest = None  # monotonic arrival time of queue[0]
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.flushlock = threading.Lock()  # serializes flushes
+        self.closed = False
+
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.lastflushlatency = 0.0
+        self.maxflushlatency = 0.0
+        self.totalflushlatency = 0.0
+
+        self.flusher = threading.Thread(
+            target=self._run, name="IngestBuffer", daemon=True
+        )
+        self.flusher.start()
+
+    def storeMeasurement(self, measurement):
+        """
+        Queue a measurement for storage.
+
+        Args:
+            measurement (Measurement): the measurement
+
+        Returns:
+            int: the number of measurements accepted (always 1)
+
+        Raises:
+            RuntimeError: if the buffer is already closed
+        """
+        measurement.timestamp = datetime.now(tz=tz.UTC)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("ingest buffer is closed")
+            if not self.queue:
+                self.oldest = monotonic()
+                self.wakeup.notify()  # start the maxage timer
+            self.queue.append(measurement)
+            if len(self.queue) >= self.maxsize:
+                self.wakeup.notify()
+        return 1
+
+    @property
+    def depth(self):
+        """The number of measurements waiting to be flushed."""
+        return len(self.queue)
+
+    def stats(self):
+        """
+        Return counters that can be used to tune maxsize and maxage.
+
+        Returns:
+            dict: queue depth, number of flushes, measurements flushed, failed flushes and flush latencies in seconds
+        """
+        return {
+            "depth": self.depth,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failures": self.failures,
+            "lastflushlatency": self.lastflushlatency,
+            "maxflushlatency": self.maxflushlatency,
+            "meanflushlatency": self.totalflushlatency / self.flushes
+            if self.flushes
+            else 0.0,
+        }
+
+    def flush(self):
+        """
+        Store all queued measurements in a single transaction.
+
+        If storing fails, the measurements are put back in front of the queue
+        so they will be retried on the next flush.
+
+        Returns:
+            int: the number of measurements stored
+        """
+        with self.flushlock:
+            with self.lock:
+                batch, self.queue = self.queue, []
+                oldest, self.oldest = self.oldest, None
+            if not batch:
+                return 0
+            start = perf_counter()
+            try:
+                self.db.storeMeasurements(batch)
+            except Exception as e:
+                logging.exception(e)
+                with self.lock:
+                    self.queue[:0] = batch
+                    self.oldest = oldest
+                    self.failures += 1
+                return 0
+            latency = perf_counter() - start
+            self.flushes += 1
+            self.flushed += len(batch)
+            self.lastflushlatency = latency
+            self.maxflushlatency = max(self.maxflushlatency, latency)
+            self.totalflushlatency += latency
+            logging.debug(f"ingest flushed {len(batch)} measurements in {latency:.4f}s")
+            return len(batch)
+
+    def close(self):
+        """
+        Stop the background flusher and flush any remaining measurements.
+        """
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self.flusher.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.closed:
+                    if len(self.queue) >= self.maxsize:
+                        break
+                    if self.queue:
+                        remaining = self.oldest + self.maxage - monotonic()
+                        if remaining <= 0:
+                            break
+                        self.wakeup.wait(remaining)
+                    else:
+                        self.wakeup.wait()
+                if self.closed:
+                    return
+            failures = self.failures
+            self.flush()
+            if self.failures != failures:
+                # back off a little instead of retrying a failing database in a tight loop
+                with self.lock:
+                    if not self.closed:
+                        self.wakeup.wait(self.maxage)
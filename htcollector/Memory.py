@@ -0,0 +1,202 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017140000
+
+"""
+Garbage collection policies and memory instrumentation.
+
+The available policies are:
+
+    none       leave the automatic collector of the interpreter alone
+    periodic   additionally run a full collection every interval seconds from a background thread
+    threshold  tune the allocation thresholds of the automatic collector
+    freeze     move everything allocated during startup to the permanent generation,
+               so later collections don't have to traverse it
+
+Collection pauses are timed with gc.callbacks, and if tracing is enabled the
+allocations that grew since startup are logged with tracemalloc every interval
+seconds.
+"""
+
+import gc
+import logging
+import threading
+import tracemalloc
+from time import perf_counter
+
+POLICIES = ("none", "periodic", "threshold", "freeze")
+
+
+class GCMonitor:
+    """
+    Collect the number and duration of garbage collections per generation.
+    """
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.pausetime = [0.0, 0.0, 0.0]
+        self.maxpause = 0.0
+        self.collected = 0
+        self._start = None
+        gc.callbacks.append(self._callback)
+
+    def _callback(self, phase, info):
+        # the interpreter never runs two collections at the same time
+        if phase == "start":
+            self._start = perf_counter()
+        elif self._start is not None:
+            pause = perf_counter() - self._start
+            self._start = None
+            generation = info["generation"]
+            self.collections[generation] += 1
+            self.pausetime[generation] += pause
+            self.maxpause = max(self.maxpause, pause)
+            self.collected += info["collected"]
+
+    def close(self):
+        if self._callback in gc.callbacks:
+            gc.callbacks.remove(self._callback)
+
+    def stats(self):
+        """
+        Return the collection statistics.
+
+        Returns:
+            dict: collections and pausetime (seconds) per generation, maxpause (seconds) and the number of objects collected
+        """
+        return {
+            "collections": list(self.collections),
+            "pausetime": list(self.pausetime),
+            "maxpause": self.maxpause,
+            "collected": self.collected,
+        }
+
+
+class MemoryManager:
+    """
+    Apply a garbage collection policy and report on memory usage.
+
+    With the freeze policy everything that exists when the manager is created
+    is frozen, so create it once startup is complete.
+
+    Args:
+        policy (str, optional): one of POLICIES. Defaults to "none".
+        interval (float, optional): seconds between periodic collections and memory reports. Defaults to 60.
+        thresholds (tuple, optional): gc thresholds for the threshold policy. Defaults to None.
+        trace (bool, optional): log the top allocations that grew since startup every interval. Defaults to False.
+        top (int, optional): number of allocation sites to log. Defaults to 10.
+
+    """
+
+    def __init__(
+        self, policy="none", interval=60.0, thresholds=None, trace=False, top=10
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown gc policy {policy}, use one of {POLICIES}")
+        if policy == "threshold" and not thresholds:
+            raise ValueError("the threshold policy needs thresholds")
+        self.policy = policy
+        self.interval = interval
+        self.top = top
+        self.monitor = GCMonitor()
+        self.previousthresholds = gc.get_threshold()
+        self.baseline = None
+        if policy == "threshold":
+            gc.set_threshold(*thresholds)
+        elif policy == "freeze":
+            gc.collect()
+            gc.freeze()
+        if trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.baseline = tracemalloc.take_snapshot()
+        self.stopped = threading.Event()
+        self.reporter = None
+        if policy == "periodic" or trace:
+            self.reporter = threading.Thread(
+                target=self._run, name="MemoryManager", daemon=True
+            )
+            self.reporter.start()
+        logging.info(f"gc policy {policy}, thresholds {gc.get_threshold()}")
+
+    def collect(self):
+        """
+        Run a full collection.
+
+        Returns:
+            int: the number of unreachable objects found
+        """
+        return gc.collect()
+
+    def growth(self):
+        """
+        Compare the current allocations with those at startup.
+
+        Returns:
+            list: of tracemalloc.StatisticDiff for the top allocation sites, empty if tracing is off
+        """
+        if self.baseline is None:
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        return snapshot.compare_to(self.baseline, "lineno")[: self.top]
+
+    def report(self):
+        """
+        Log the collection statistics and, if tracing, the allocation sites that grew the most.
+        """
+        stats = self.monitor.stats()
+        logging.info(
+            f"gc collections {stats['collections']}, pause time {['%.3f' % t for t in stats['pausetime']]}s, max pause {stats['maxpause'] * 1000:.1f}ms, collected {stats['collected']}"
+        )
+        if self.baseline is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            logging.info(
+                f"traced memory {current / 1024:.0f}KiB, peak {peak / 1024:.0f}KiB"
+            )
+            for diff in self.growth():
+                logging.info(f"memory growth {diff}")
+
+    def close(self):
+        """
+        Stop the background thread and restore the collector settings.
+        """
+        self.stopped.set()
+        if self.reporter is not None:
+            self.reporter.join()
+        self.monitor.close()
+        gc.set_threshold(*self.previousthresholds)
+        if self.policy == "freeze":
+            gc.unfreeze()
+        if self.baseline is not None:
+            tracemalloc.stop()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if self.policy == "periodic":
+                self.collect()
+            try:
+                self.report()
+            except Exception as e:
+                logging.exception(e)
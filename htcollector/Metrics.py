@@ -0,0 +1,418 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017190000
+
+
+"""
+Counters and histograms exposed in the Prometheus text format.
+
+Updating a metric takes no lock: every thread updates its own shard of the
+values and a scrape adds up the shards. The shards of threads that have
+finished, like those of the connection threads of the threading server, are
+folded into a common total from time to time.
+
+Values that already exist elsewhere, like the statistics of the caches or
+the ingest buffer, are not copied into metrics but read when scraped, by
+collectors. A collector is a callable that returns a list of
+(name, type, help, samples), where samples is a list of (labels, value).
+"""
+
+import gc
+import os
+import threading
+from bisect import bisect_left
+from functools import wraps
+from inspect import isgeneratorfunction
+from math import inf
+from time import perf_counter
+
+# seconds, from a cached response to a slow database query
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Registry:
+    """
+    A set of metrics and collectors.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.local = threading.local()
+        self.shards = []  # (thread, shard) for every thread that updated a metric
+        self.folded = {}  # the values of finished threads
+        self.lock = threading.Lock()
+
+    def shard(self):
+        """
+        Return the values of the current thread, key -> value.
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append((threading.current_thread(), shard))
+                if len(self.shards) % 64 == 0:
+                    self._fold()
+            return shard
+
+    def _fold(self):
+        # called with the lock held, a finished thread no longer updates its shard
+        alive = []
+        for thread, shard in self.shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    _merge(self.folded, key, value)
+        self.shards = alive
+
+    def values(self):
+        """
+        Add up the shards.
+
+        Returns:
+            dict: (name, labels) -> value, a number or a list of bucket counts followed by the sum
+        """
+        with self.lock:
+            self._fold()
+            total = {}
+            for key, value in self.folded.items():
+                _merge(total, key, value)
+            for _, shard in self.shards:
+                # a copy is made while holding the GIL, so the owner can keep updating it
+                for key, value in shard.copy().items():
+                    _merge(total, key, value)
+        return total
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def addCollector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self, collectors=()):
+        """
+        Return all metrics in the Prometheus text exposition format.
+
+        Args:
+            collectors (iterable, optional): collectors to include besides the registered ones. Defaults to ().
+
+        Returns:
+            str: the metrics
+        """
+        values = self.values()
+        lines = []
+        for metric in self.metrics:
+            metric.render(lines, values)
+        for collector in (*self.collectors, *collectors):
+            for name, type, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _merge(total, key, value):
+    if isinstance(value, list):
+        current = total.get(key)
+        if current is None:
+            total[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                current[i] += v
+    else:
+        total[key] = total.get(key, 0) + value
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value in (inf, -inf):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(int(value))
+
+
+class Metric:
+    """
+    A metric with a value per combination of labels.
+
+    Args:
+        registry (Registry): the registry that holds the values
+        name (str): the metric name
+        help (str): the help text
+        labelnames (tuple, optional): the label names. Defaults to ().
+
+    """
+
+    type = "untyped"
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.local = registry.local
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def samples(self, values):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return lines, sorted(
+            (labels, value)
+            for (name, labels), value in values.items()
+            if name == self.name
+        )
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing value per combination of labels.
+    """
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        """
+        Increase the counter.
+
+        Args:
+            labels: a value for every label name
+            amount (int, optional): the increment. Defaults to 1.
+        """
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.registry.shard()
+        key = (self.name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, lines, values):
+        header, samples = self.samples(values)
+        lines.extend(header)
+        for labels, value in samples:
+            labels = dict(zip(self.labelnames, labels))
+            lines.append(f"{self.name}{_labels(labels)} {_number(value)}")
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, like durations, per combination of labels.
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        """
+        Record a value.
+
+        Args:
+            value (float): the value
+            labels: a value for every label name
+        """
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.registry.shard()
+        key = (self.name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # a count per bucket, one for values beyond the last bucket, and the sum
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def timed(self, *labels):
+        """
+        Decorate a function to observe the duration of every call, by default labeled with its name.
+
+        For a generator function the time spent producing items is observed,
+        when the generator is exhausted or closed.
+        """
+
+        def decorator(function):
+            observed = labels or (function.__name__,)
+
+            if isgeneratorfunction(function):
+
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    elapsed = 0.0
+                    generator = function(*args, **kwargs)
+                    try:
+                        while True:
+                            start = perf_counter()
+                            try:
+                                item = next(generator)
+                            finally:
+                                elapsed += perf_counter() - start
+                            yield item
+                    except StopIteration:
+                        pass
+                    finally:
+                        generator.close()
+                        self.observe(elapsed, *observed)
+
+            else:
+
+                @wraps(function)
+                def wrapper(*args, **kwargs):
+                    start = perf_counter()
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        self.observe(perf_counter() - start, *observed)
+
+            return wrapper
+
+        return decorator
+
+    def render(self, lines, values):
+        header, samples = self.samples(values)
+        lines.extend(header)
+        bounds = [repr(float(b)) for b in self.buckets] + ["+Inf"]
+        name = self.name
+        for labels, counts in samples:
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{_labels({**labels, 'le': bound})} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(labels)} {_number(counts[-1])}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+
+def statsCollector(prefix, stats, help, labelname="generation"):
+    """
+    Return a collector that exposes a stats() dict as gauges.
+
+    Every numeric value becomes a gauge named prefix_key, a list becomes a
+    gauge with a label per position. Other values are skipped.
+
+    Args:
+        prefix (str): the prefix of the metric names
+        stats (callable): returns the dict
+        help (str): the help text, the key is appended
+        labelname (str, optional): the label for the positions in a list. Defaults to "generation".
+
+    Returns:
+        callable: the collector
+    """
+
+    def collect():
+        metrics = []
+        for key, value in stats().items():
+            if isinstance(value, (list, tuple)):
+                samples = [({labelname: i}, v) for i, v in enumerate(value)]
+            elif isinstance(value, (int, float)):
+                samples = [({}, value)]
+            else:
+                continue
+            metrics.append((f"{prefix}_{key}", "gauge", f"{help} {key}", samples))
+        return metrics
+
+    return collect
+
+
+def processCollector():
+    """
+    Collect the resident memory, cpu time, thread count and garbage collections of the process.
+    """
+    metrics = []
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        metrics.append(
+            (
+                "process_resident_memory_bytes",
+                "gauge",
+                "Resident memory size in bytes.",
+                [({}, rss)],
+            )
+        )
+    except (OSError, ValueError, IndexError):
+        pass
+    times = os.times()
+    metrics.append(
+        (
+            "process_cpu_seconds_total",
+            "counter",
+            "Total user and system CPU time spent in seconds.",
+            [({}, times.user + times.system)],
+        )
+    )
+    metrics.append(
+        (
+            "python_threads",
+            "gauge",
+            "Number of running threads.",
+            [({}, threading.active_count())],
+        )
+    )
+    stats = gc.get_stats()
+    metrics.append(
+        (
+            "python_gc_collections_total",
+            "counter",
+            "Number of times this generation was collected.",
+            [({"generation": i}, s["collections"]) for i, s in enumerate(stats)],
+        )
+    )
+    metrics.append(
+        (
+            "python_gc_objects_collected_total",
+            "counter",
+            "Objects collected during gc.",
+            [({"generation": i}, s["collected"]) for i, s in enumerate(stats)],
+        )
+    )
+    return metrics
+
+
+REGISTRY = Registry()
+REGISTRY.addCollector(processCollector)
@@ -0,0 +1,133 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017113000
+
+import logging
+
+
+class Migration:
+    """
+    A numbered schema change.
+
+    DDL statements are not transactional in MariaDB, so every step must be
+    idempotent: if a migration is interrupted it is simply run again in full
+    at the next startup.
+
+    Args:
+        version (int): schema version after this migration has been applied
+        description (str): short description, recorded in the SchemaVersion table
+        steps (list): SQL statements or callables that take a cursor
+
+    """
+
+    def __init__(self, version, description, steps):
+        self.version = version
+        self.description = description
+        self.steps = steps
+
+    def apply(self, cursor):
+        for step in self.steps:
+            if callable(step):
+                step(cursor)
+            else:
+                cursor.execute(step)
+
+    def __repr__(self):
+        return f'Migration({self.version}, "{self.description}")'
+
+
+# migrations must be appended in order and never changed once released
+MIGRATIONS = [
+    Migration(
+        1,
+        "composite index on Measurements(Stationid, Timestamp)",
+        [
+            "CREATE INDEX IF NOT EXISTS stationtime ON Measurements(Stationid, Timestamp)",
+        ],
+    ),
+    Migration(
+        2,
+        "rollup tables at minute, hour and day resolution",
+        [
+            f"""CREATE TABLE IF NOT EXISTS {table}(
+            Stationid VARCHAR(100) NOT NULL,
+            Timestamp DATETIME NOT NULL,
+            Count INT NOT NULL,
+            TemperatureMin REAL,
+            TemperatureMax REAL,
+            TemperatureMean REAL,
+            HumidityMin REAL,
+            HumidityMax REAL,
+            HumidityMean REAL,
+            PRIMARY KEY (Stationid, Timestamp),
+            INDEX (Timestamp));"""
+            for table in ("MeasurementsMinute", "MeasurementsHour", "MeasurementsDay")
+        ],
+    ),
+    Migration(
+        3,
+        "drop index si, a left prefix of stationtime",
+        [
+            "DROP INDEX IF EXISTS si ON Measurements",
+        ],
+    ),
+]
+
+
+def migrate(cursor, migrations=MIGRATIONS):
+    """
+    Bring the schema up to date by applying all pending migrations in order.
+
+    A named lock makes sure that only one process migrates at the same time.
+
+    Args:
+        cursor (QueryCursor): a cursor on an open database connection, every applied migration is committed on it
+        migrations (list, optional): the migrations to consider. Defaults to MIGRATIONS.
+
+    Returns:
+        int: the schema version after migrating
+    """
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS SchemaVersion(
+        Version INT NOT NULL PRIMARY KEY,
+        Description TEXT NOT NULL,
+        Applied DATETIME(3) DEFAULT CURRENT_TIMESTAMP(3));"""
+    )
+    cursor.execute("SELECT GET_LOCK('htcollector_migrate', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise RuntimeError("could not acquire the schema migration lock")
+    try:
+        cursor.execute("SELECT COALESCE(MAX(Version), 0) FROM SchemaVersion")
+        version = cursor.fetchone()[0]
+        for migration in sorted(migrations, key=lambda m: m.version):
+            if migration.version <= version:
+                continue
+            logging.info(f"applying schema migration {migration}")
+            migration.apply(cursor)
+            cursor.execute(
+                "INSERT INTO SchemaVersion(Version, Description) VALUES (?,?)",
+                (migration.version, migration.description),
+            )
+            cursor.commit()
+            version = migration.version
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('htcollector_migrate')")
+        cursor.fetchone()
+    return version
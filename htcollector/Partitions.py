@@ -0,0 +1,219 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017123000
+
+"""
+Monthly RANGE partitioning of the Measurements table.
+
+Every month gets its own partition named pYYYYMM, and a catch-all partition
+pfuture holds anything beyond the last month so inserts never fail. Because
+the partitions are defined on the Timestamp column itself, MariaDB prunes
+partitions that fall outside the time range of a query.
+
+Old months are removed by dropping their partition, optionally after moving
+its rows to an archive table, which is far cheaper than deleting rows.
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+FUTURE = "pfuture"
+
+
+def addMonths(year, month, n):
+    """return the (year, month) n months after the given one (n may be negative)"""
+    months = year * 12 + month - 1 + n
+    return months // 12, months % 12 + 1
+
+
+def partitionName(year, month):
+    return f"p{year:04d}{month:02d}"
+
+
+def partitionMonth(name):
+    """return the (year, month) of a partition name or None for pfuture"""
+    if name == FUTURE:
+        return None
+    return int(name[1:5]), int(name[5:7])
+
+
+def partitionDefinition(year, month):
+    year, month = int(year), int(month)
+    nextyear, nextmonth = addMonths(year, month, 1)
+    return f"PARTITION {partitionName(year, month)} VALUES LESS THAN ('{nextyear:04d}-{nextmonth:02d}-01')"
+
+
+def futureDefinition():
+    return f"PARTITION {FUTURE} VALUES LESS THAN (MAXVALUE)"
+
+
+def listPartitions(cursor, table="Measurements"):
+    """
+    Return the names of the partitions of a table in order.
+
+    Returns:
+        list: of partition names, empty if the table is not partitioned
+    """
+    cursor.execute(
+        """SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION""",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def partition(cursor, now: datetime, ahead=3):
+    """
+    Partition the Measurements table by month if it isn't already.
+
+    This rebuilds the table, which may take a while on large tables.
+
+    Args:
+        cursor (Cursor): a database cursor
+        now (datetime): the current time (UTC)
+        ahead (int, optional): number of future months to create. Defaults to 3.
+
+    Returns:
+        bool: True if the table was partitioned by this call
+    """
+    if listPartitions(cursor):
+        return False
+    cursor.execute("SELECT MIN(Timestamp) FROM Measurements")
+    first = cursor.fetchone()[0] or now
+    months = []
+    year, month = first.year, first.month
+    last = addMonths(now.year, now.month, ahead)
+    while (year, month) <= last:
+        months.append(partitionDefinition(year, month))
+        year, month = addMonths(year, month, 1)
+    logging.info(f"partitioning Measurements into {len(months)} monthly partitions")
+    cursor.execute(
+        f"""ALTER TABLE Measurements PARTITION BY RANGE COLUMNS(Timestamp) (
+            {", ".join(months + [futureDefinition()])})"""
+    )
+    return True
+
+
+def createFuturePartitions(cursor, now: datetime, ahead=3):
+    """
+    Split new monthly partitions off the pfuture partition up to a number of months ahead.
+
+    Returns:
+        list: names of the partitions that were created
+    """
+    existing = [partitionMonth(p) for p in listPartitions(cursor)]
+    existing = [m for m in existing if m is not None]
+    if not existing:
+        return []
+    year, month = addMonths(*max(existing), 1)
+    last = addMonths(now.year, now.month, ahead)
+    months = []
+    while (year, month) <= last:
+        months.append((year, month))
+        year, month = addMonths(year, month, 1)
+    if months:
+        cursor.execute(
+            f"""ALTER TABLE Measurements REORGANIZE PARTITION {FUTURE} INTO (
+                {", ".join([partitionDefinition(*m) for m in months] + [futureDefinition()])})"""
+        )
+    return [partitionName(*m) for m in months]
+
+
+def applyRetention(cursor, now: datetime, keep, archive=False):
+    """
+    Remove the partitions of months that lie completely before the retention period.
+
+    Args:
+        cursor (Cursor): a database cursor
+        now (datetime): the current time (UTC)
+        keep (int): number of months to keep before the current month
+        archive (bool, optional): move the rows of each removed partition to a table MeasurementsArchiveYYYYMM first. Defaults to False.
+
+    Returns:
+        list: names of the partitions that were removed
+    """
+    cutoff = addMonths(now.year, now.month, -keep)
+    removed = []
+    for name in listPartitions(cursor):
+        month = partitionMonth(name)
+        if month is None or month >= cutoff:
+            continue
+        if archive:
+            archivetable = f"MeasurementsArchive{name[1:]}"
+            # fails if the archive table exists, exchanging with a non-empty table would lose its rows
+            cursor.execute(f"CREATE TABLE {archivetable} LIKE Measurements")
+            cursor.execute(f"ALTER TABLE {archivetable} REMOVE PARTITIONING")
+            cursor.execute(
+                f"ALTER TABLE Measurements EXCHANGE PARTITION {name} WITH TABLE {archivetable}"
+            )
+            logging.info(f"archived partition {name} to {archivetable}")
+        cursor.execute(f"ALTER TABLE Measurements DROP PARTITION {name}")
+        logging.info(f"dropped partition {name}")
+        removed.append(name)
+    return removed
+
+
+class PartitionMaintainer:
+    """
+    Background thread that creates future partitions and applies the retention policy once a day.
+
+    Args:
+        db (MeasurementDatabase): the database to maintain
+        ahead (int): number of future months to create
+        keep (int): number of past months to keep or 0 to keep everything
+        archive (bool): archive partitions before dropping them
+        interval (float): seconds between runs
+
+    """
+
+    def __init__(self, db, ahead=3, keep=0, archive=False, interval=86400.0):
+        self.db = db
+        self.ahead = ahead
+        self.keep = keep
+        self.archive = archive
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.maintainer = threading.Thread(
+            target=self._run, name="PartitionMaintainer", daemon=True
+        )
+        self.maintainer.start()
+
+    def maintain(self):
+        """
+        Run maintenance once.
+        """
+        try:
+            self.db.maintainPartitions(self.ahead, self.keep, self.archive)
+        except Exception as e:
+            logging.exception(e)
+
+    def close(self):
+        """
+        Stop the background thread.
+        """
+        self.stopped.set()
+        self.maintainer.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.maintain()
+            self.stopped.wait(self.interval)
@@ -0,0 +1,273 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017200000
+
+"""
+A pool of database connections.
+
+Connections are opened on demand, up to a maximum, and a number of them can
+be opened up front so the first requests don't pay for the handshake. A
+borrower waits for a connection to be returned for at most maxwait seconds
+before PoolExhausted is raised, so callers can tell an overloaded database
+from a broken one. A returned connection is rolled back, so it never carries
+an open transaction, and with it a stale snapshot, over to the next borrower.
+
+The validation policies for borrowed connections are:
+
+    always  ping every connection before it is handed out
+    idle    ping connections that were idle for longer than idletime seconds
+    never   hand out connections as is, and rely on auto_reconnect
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from itertools import count
+from time import monotonic, perf_counter
+
+from .Metrics import REGISTRY
+
+VALIDATION = ("always", "idle", "never")
+
+BORROW_WAIT = REGISTRY.histogram(
+    "htcollector_db_pool_wait_seconds",
+    "Time to check out a connection from the pool, the count is the number of checkouts.",
+    ("pool",),
+)
+
+
+class PoolExhausted(Exception):
+    """
+    No connection became available within the maximum wait time.
+    """
+
+
+class ConnectionPool:
+    """
+    A thread safe pool of connections.
+
+    Args:
+        connect (callable): opens and returns a new connection
+        size (int, optional): maximum number of open connections. Defaults to 5.
+        prewarm (int, optional): number of connections to open right away. Defaults to 1.
+        validate (str, optional): one of VALIDATION. Defaults to "idle".
+        maxwait (float, optional): seconds to wait for a connection before PoolExhausted is raised. Defaults to 5.
+        idletime (float, optional): idle seconds after which the idle policy validates a connection. Defaults to 30.
+        name (str, optional): name in the logs and metrics or None for a unique one. Defaults to None.
+
+    Raises:
+        ValueError: for an unknown validation policy or a size less than 1
+
+    """
+
+    counter = count(1)
+
+    def __init__(
+        self,
+        connect,
+        size=5,
+        prewarm=1,
+        validate="idle",
+        maxwait=5.0,
+        idletime=30.0,
+        name=None,
+    ):
+        if validate not in VALIDATION:
+            raise ValueError(
+                f"unknown validation policy {validate}, use one of {VALIDATION}"
+            )
+        if size < 1:
+            raise ValueError("the pool size must be at least 1")
+        self.connect = connect
+        self.size = size
+        self.validate = validate
+        self.maxwait = maxwait
+        self.idletime = idletime
+        self.name = name if name is not None else f"pool-{next(self.counter)}"
+        self.condition = threading.Condition()
+        # (connection, time it was returned), the most recently returned is reused first
+        self.idle = []
+        self.open = 0
+        self.borrows = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.waittime = 0.0
+        self.maxwaittime = 0.0
+        self.opened = 0
+        self.discarded = 0
+        self.validationfailures = 0
+        for _ in range(min(prewarm, size)):
+            self.idle.append((self._open(), monotonic()))
+            self.open += 1
+
+    def _open(self):
+        connection = self.connect()
+        with self.condition:
+            self.opened += 1
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self.condition:
+            self.open -= 1
+            self.discarded += 1
+            self.condition.notify()
+
+    def _valid(self, connection, since):
+        if self.validate == "never" or (
+            self.validate == "idle" and monotonic() - since < self.idletime
+        ):
+            return True
+        try:
+            connection.ping()
+            return True
+        except Exception as e:
+            logging.warning(
+                f"{self.name}: discarding a connection that failed a ping, {e}"
+            )
+            with self.condition:
+                self.validationfailures += 1
+            return False
+
+    def borrow(self):
+        """
+        Take a connection from the pool, opening one if none is idle and the pool is not full.
+
+        Returns:
+            Connection: the connection, hand it back with release()
+
+        Raises:
+            PoolExhausted: if no connection became available within maxwait seconds
+        """
+        start = perf_counter()
+        while True:
+            connection = None
+            with self.condition:
+                deadline = None
+                while not self.idle and self.open >= self.size:
+                    if deadline is None:
+                        deadline = start + self.maxwait
+                        self.waits += 1
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolExhausted(
+                            f"{self.name}: all {self.size} connections in use for {self.maxwait}s"
+                        )
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, since = self.idle.pop()
+                else:
+                    # reserve the slot, the connection is opened outside the lock
+                    self.open += 1
+            if connection is None:
+                try:
+                    connection = self._open()
+                except Exception:
+                    with self.condition:
+                        self.open -= 1
+                        self.condition.notify()
+                    raise
+            elif not self._valid(connection, since):
+                self._discard(connection)
+                continue
+            break
+        wait = perf_counter() - start
+        BORROW_WAIT.observe(wait, self.name)
+        with self.condition:
+            self.borrows += 1
+            self.waittime += wait
+            self.maxwaittime = max(self.maxwaittime, wait)
+        return connection
+
+    def release(self, connection):
+        """
+        Return a borrowed connection to the pool, a connection that cannot be rolled back is closed instead.
+        """
+        try:
+            connection.rollback()
+        except Exception as e:
+            logging.warning(
+                f"{self.name}: discarding a connection that failed a rollback, {e}"
+            )
+            self._discard(connection)
+            return
+        with self.condition:
+            # after close() the size is 0 and returned connections are closed
+            if self.open <= self.size:
+                self.idle.append((connection, monotonic()))
+                self.condition.notify()
+                return
+        self._discard(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with block.
+
+        Yields:
+            Connection: the connection
+
+        Raises:
+            PoolExhausted: if no connection became available within maxwait seconds
+        """
+        connection = self.borrow()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """
+        Close the idle connections, borrowed connections are closed when they are returned.
+        """
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.size = 0
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Return the pool statistics.
+
+        Returns:
+            dict: size, open, idle and borrowed connections, the number of borrows, of those that had to wait
+                and that timed out, total and maximum wait in seconds, and the connections opened, discarded
+                and failing validation
+        """
+        with self.condition:
+            return {
+                "size": self.size,
+                "open": self.open,
+                "idle": len(self.idle),
+                "borrowed": self.open - len(self.idle),
+                "borrows": self.borrows,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "waittime": self.waittime,
+                "maxwaittime": self.maxwaittime,
+                "opened": self.opened,
+                "discarded": self.discarded,
+                "validationfailures": self.validationfailures,
+            }
@@ -0,0 +1,215 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017193000
+
+"""
+The query execution layer of MeasurementDatabase.
+
+Every statement is executed through a QueryCursor, which wraps a cursor of
+the database driver and times the calls into the driver. When the cursor
+moves on to the next statement or is closed, a record of the finished
+statement is passed to a QueryLog. The log calls the registered hooks and
+logs statements that took longer than a threshold.
+
+A record is a dict with
+
+    statement  the sql text
+    parameters the number of parameters, or (rows, parameters per row) for executemany
+    rows       the number of rows fetched, or affected for statements without a result set
+    elapsed    seconds spent in the driver executing the statement and fetching its rows
+    error      the name of the exception raised by the driver or None
+
+Only the time spent in the driver is counted, so a result that is streamed
+from an unbuffered cursor is not charged for the time its consumer takes.
+"""
+
+import logging
+from time import perf_counter
+
+from .Metrics import REGISTRY
+
+QUERIES = REGISTRY.histogram(
+    "htcollector_db_query_duration_seconds",
+    "Time spent in the database driver per statement.",
+)
+SLOW_QUERIES = REGISTRY.counter(
+    "htcollector_db_slow_queries_total",
+    "Number of statements that took longer than the slow query threshold.",
+)
+
+
+def shape(parameters, many=False):
+    """
+    Describe the parameters of a statement without their values.
+
+    Args:
+        parameters (sequence): the parameters, or for executemany a sequence of them
+        many (bool, optional): the parameters are for executemany. Defaults to False.
+
+    Returns:
+        int or tuple: the number of parameters, or (rows, parameters per row)
+    """
+    if many:
+        return (len(parameters), len(parameters[0]) if len(parameters) else 0)
+    return len(parameters)
+
+
+def condense(statement, width=200):
+    """collapse the whitespace of a statement and truncate it for a log line"""
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= width else statement[: width - 3] + "..."
+
+
+class QueryLog:
+    """
+    Hand the records of finished statements to hooks and log the slow ones.
+
+    Args:
+        slowquery (float, optional): seconds after which a statement is logged as slow, 0 disables the log. Defaults to 1.0.
+
+    """
+
+    def __init__(self, slowquery=1.0):
+        self.slowquery = slowquery
+        self.hooks = []
+
+    def addHook(self, hook):
+        """
+        Register a callable that is called with the record of every finished statement.
+
+        Hooks are called on the thread that executed the statement, so they should be quick.
+        """
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, query):
+        QUERIES.observe(query["elapsed"])
+        if self.slowquery > 0 and query["elapsed"] >= self.slowquery:
+            SLOW_QUERIES.inc()
+            logging.warning(
+                f"slow query elapsed={query['elapsed']:.3f}s rows={query['rows']} parameters={query['parameters']} error={query['error']} statement=\"{condense(query['statement'])}\"",
+                extra={"query": query},
+            )
+        for hook in self.hooks:
+            try:
+                hook(query)
+            except Exception as e:
+                logging.exception(e)
+
+
+class QueryCursor:
+    """
+    A cursor that times every statement and reports it to a QueryLog.
+
+    Attributes that are not wrapped, like description and rowcount, are
+    those of the driver's cursor.
+
+    Args:
+        connection (Connection): the connection the cursor belongs to
+        cursor (Cursor): a cursor of the database driver
+        log (QueryLog): receives the record of every finished statement
+
+    """
+
+    def __init__(self, connection, cursor, log):
+        self.connection = connection
+        self.cursor = cursor
+        self.log = log
+        self.query = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self, statement, parameters):
+        self._finish()
+        self.query = {
+            "statement": statement,
+            "parameters": parameters,
+            "rows": 0,
+            "elapsed": 0.0,
+            "error": None,
+        }
+
+    def _finish(self):
+        query, self.query = self.query, None
+        if query is not None:
+            if query["error"] is None and self.cursor.description is None:
+                query["rows"] = max(self.cursor.rowcount, 0)
+            self.log.record(query)
+
+    def _call(self, function, *args):
+        start = perf_counter()
+        try:
+            return function(*args)
+        except Exception as e:
+            if self.query is not None:
+                self.query["error"] = type(e).__name__
+            raise
+        finally:
+            if self.query is not None:
+                self.query["elapsed"] += perf_counter() - start
+
+    def execute(self, statement, parameters=()):
+        self._start(statement, shape(parameters))
+        self._call(self.cursor.execute, statement, parameters)
+
+    def executemany(self, statement, parameters):
+        self._start(statement, shape(parameters, many=True))
+        self._call(self.cursor.executemany, statement, parameters)
+
+    def fetchone(self):
+        row = self._call(self.cursor.fetchone)
+        if row is not None and self.query is not None:
+            self.query["rows"] += 1
+        return row
+
+    def fetchmany(self, size):
+        rows = self._call(self.cursor.fetchmany, size)
+        if self.query is not None:
+            self.query["rows"] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._call(self.cursor.fetchall)
+        if self.query is not None:
+            self.query["rows"] += len(rows)
+        return rows
+
+    def __iter__(self):
+        # in chunks, so that timing the driver does not cost a call per row
+        while rows := self.fetchmany(1000):
+            yield from rows
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        try:
+            self._finish()
+        finally:
+            self.cursor.close()
@@ -0,0 +1,120 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017153000
+
+import threading
+from time import monotonic
+
+
+class ResponseCache:
+    """
+    Cache of rendered responses, keyed by route and station id.
+
+    Entries are invalidated when new data for their station is stored, see
+    MeasurementDatabase.addStoreListener(). Entries for all stations, with
+    a station id of None, are invalidated by a store for any station. The
+    time to live is only a safety net, for example for data written to the
+    database by another process. Station ids are compared case-insensitively,
+    like the database does, so they are lower-cased in the keys.
+
+    Args:
+        ttl (float, optional): seconds an entry stays valid. Defaults to 60.
+        maxentries (int, optional): the cache is cleared when it grows beyond this. Defaults to 1000.
+
+    """
+
+    def __init__(self, ttl=60.0, maxentries=1000):
+        self.ttl = ttl
+        self.maxentries = maxentries
+        self.entries = {}
+        self.lock = threading.Lock()
+        # bumped by every invalidation, a value computed while it changed is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, compute):
+        """
+        Return the cached value for a key, computing and caching it on a miss.
+
+        Args:
+            key (tuple): (route, stationid) where stationid may be None for all stations
+            compute (callable): returns the value, and a bool that is True if it may be cached
+
+        Returns:
+            the value
+        """
+        key = self.normalize(key)
+        now = monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        value, cacheable = compute()
+        if cacheable:
+            with self.lock:
+                if self.generation == generation:
+                    if len(self.entries) >= self.maxentries:
+                        self.entries.clear()
+                    self.entries[key] = (now + self.ttl, value)
+        return value
+
+    @staticmethod
+    def normalize(key):
+        route, stationid = key
+        return (route, stationid.lower() if stationid is not None else None)
+
+    def invalidate(self, stationids):
+        """
+        Remove the entries of the given stations and those for all stations.
+
+        Args:
+            stationids (list): the station ids with new data
+        """
+        stationids = {stationid.lower() for stationid in stationids}
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            for key in [k for k in self.entries if k[1] is None or k[1] in stationids]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Return the cache statistics.
+
+        Returns:
+            dict: hits, misses, invalidations and the current number of entries
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self.entries),
+            }
@@ -0,0 +1,85 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017120000
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from dateutil import tz
+
+
+class RollupCompactor:
+    """
+    Background thread that keeps the rollup tables of a MeasurementDatabase up to date.
+
+    Every interval seconds it recomputes the rollup buckets that may have
+    received new measurements since the previous run. Because buffered
+    measurements may be written some time after they were stamped, each run
+    looks back lag seconds further than the start of the previous run.
+
+    The first run resumes after the most recent minute bucket, so after a
+    restart (or on a new installation) the rollups are caught up first.
+
+    Args:
+        db (MeasurementDatabase): the database to compact
+        interval (float): seconds between runs
+        lag (float): seconds to look back before the start of the previous run
+
+    """
+
+    def __init__(self, db, interval=60.0, lag=300.0):
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.db = db
+        self.interval = interval
+        self.lag = timedelta(seconds=lag)
+        self.since = None
+        self.runs = 0
+        self.stopped = threading.Event()
+        self.compactor = threading.Thread(
+            target=self._run, name="RollupCompactor", daemon=True
+        )
+        self.compactor.start()
+
+    def compact(self):
+        """
+        Run a single compaction.
+        """
+        start = datetime.now(tz=tz.UTC)
+        try:
+            self.db.compactRollups(self.since)
+        except Exception as e:
+            logging.exception(e)
+            return
+        self.since = start - self.lag
+        self.runs += 1
+
+    def close(self):
+        """
+        Stop the background thread.
+        """
+        self.stopped.set()
+        self.compactor.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.compact()
+            self.stopped.wait(self.interval)
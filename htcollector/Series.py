@@ -0,0 +1,217 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017180000
+
+
+"""
+Array backed measurement series.
+
+A Series keeps the timestamps of a query result as int64 milliseconds since
+the epoch and the readings as arrays, numpy arrays if numpy is installed and
+arrays from the array module otherwise. The conversion to local time is done
+once per batch: the utc offset is looked up once for every distinct quarter of
+an hour in the series, instead of passing every timestamp through dateutil's
+tzlocal. Dicts are only built when the legacy row format is asked for.
+"""
+
+from array import array
+from datetime import datetime
+from math import nan
+
+from .Utils import EPOCH, MILLISECOND, QUARTER_MS, localZone
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# (name, typecode) of the readings in the rows of the Measurements table and of a rollup table
+FIELDS = (("temperature", "d"), ("humidity", "d"))
+ROLLUP_FIELDS = FIELDS + (
+    ("count", "q"),
+    ("temperature_min", "d"),
+    ("temperature_max", "d"),
+    ("humidity_min", "d"),
+    ("humidity_max", "d"),
+)
+
+
+def _array(values, typecode):
+    # NULL readings are kept as NaN
+    if np is not None:
+        return np.array(values, dtype=np.int64 if typecode == "q" else np.float64)
+    try:
+        return array(typecode, values)
+    except TypeError:
+        return array(typecode, [nan if v is None else v for v in values])
+
+
+def _list(values):
+    # the readings as a list, with None for NaN like the database returns NULL
+    result = values.tolist()
+    if np is not None:
+        if values.dtype.kind == "f" and np.isnan(values).any():
+            return [None if v != v else v for v in result]
+    elif values.typecode == "d" and any(v != v for v in result):
+        return [None if v != v else v for v in result]
+    return result
+
+
+class Series:
+    """
+    Measurements as columns.
+
+    Args:
+        t (array): int64 timestamps in milliseconds since the epoch
+        stationid (list): the station id of every measurement
+        values (dict): name -> array of readings, in the order of the fields
+
+    """
+
+    def __init__(self, t, stationid, values):
+        self.t = t
+        self.stationid = stationid
+        self.values = values
+
+    @classmethod
+    def fromRows(cls, rows, fields=FIELDS):
+        """
+        Create a series from database rows.
+
+        Args:
+            rows (list): of tuples (timestamp, stationid, reading, ...), with naive timestamps in UTC
+            fields (tuple, optional): (name, typecode) for every reading. Defaults to FIELDS.
+
+        Returns:
+            Series: the measurements
+        """
+        columns = list(zip(*rows)) if rows else [()] * (2 + len(fields))
+        if np is not None:
+            t = np.array(columns[0], dtype="datetime64[ms]").astype(np.int64)
+        else:
+            t = array("q", [(v - EPOCH) // MILLISECOND for v in columns[0]])
+        values = {
+            name: _array(column, typecode)
+            for (name, typecode), column in zip(fields, columns[2:])
+        }
+        return cls(t, list(columns[1]), values)
+
+    def __len__(self):
+        return len(self.t)
+
+    def take(self, indices):
+        """
+        Select measurements.
+
+        Args:
+            indices (sequence): the positions of the measurements
+
+        Returns:
+            Series: the selected measurements
+        """
+        indices = list(indices)
+        if np is not None:
+            return Series(
+                self.t[indices],
+                [self.stationid[i] for i in indices],
+                {name: v[indices] for name, v in self.values.items()},
+            )
+        return Series(
+            array("q", [self.t[i] for i in indices]),
+            [self.stationid[i] for i in indices],
+            {
+                name: array(v.typecode, [v[i] for i in indices])
+                for name, v in self.values.items()
+            },
+        )
+
+    def sorted(self):
+        """
+        Return the series ordered by timestamp, the order of equal timestamps is kept.
+        """
+        if np is not None:
+            if np.all(self.t[1:] >= self.t[:-1]):
+                return self
+            return self.take(np.argsort(self.t, kind="stable").tolist())
+        t = self.t
+        if all(t[i] <= t[i + 1] for i in range(len(t) - 1)):
+            return self
+        return self.take(sorted(range(len(t)), key=t.__getitem__))
+
+    def zones(self):
+        """
+        Return the local timezone, as a fixed utc offset, of every measurement.
+        """
+        if np is not None:
+            quarters, inverse = np.unique(self.t // QUARTER_MS, return_inverse=True)
+            zones = [localZone(q) for q in quarters.tolist()]
+            return [zones[i] for i in inverse.tolist()]
+        return [localZone(ms // QUARTER_MS) for ms in self.t]
+
+    def timestamps(self, timeformat=None):
+        """
+        Return the timestamps.
+
+        Args:
+            timeformat (str, optional): None for datetimes in local time, "iso" for ISO 8601 strings in local time or "epochms" for milliseconds since the epoch. Defaults to None.
+
+        Returns:
+            list: the timestamps
+        """
+        t = self.t.tolist()
+        if timeformat == "epochms":
+            return t
+        seconds = [ms / 1000 for ms in t]
+        local = list(map(datetime.fromtimestamp, seconds, self.zones()))
+        if timeformat == "iso":
+            return [v.isoformat() for v in local]
+        return local
+
+    def rows(self, timeformat=None):
+        """
+        Return the measurements in the legacy format.
+
+        Args:
+            timeformat (str, optional): format of the timestamps, see timestamps(). Defaults to None.
+
+        Returns:
+            list: of dict(timestamp:t, stationid:id, temperature:t, humidity:h, ...)
+        """
+        names = ["timestamp", "stationid", *self.values]
+        columns = [
+            self.timestamps(timeformat),
+            self.stationid,
+            *(_list(v) for v in self.values.values()),
+        ]
+        return [dict(zip(names, row)) for row in zip(*columns)]
+
+    def columns(self, timeformat="epochms"):
+        """
+        Return the measurements as lists.
+
+        Args:
+            timeformat (str, optional): format of the timestamps, see timestamps(). Defaults to "epochms".
+
+        Returns:
+            dict: t:[t, ...], stationid:[id, ...], temperature:[t, ...], humidity:[h, ...], ...
+        """
+        columns = {"t": self.timestamps(timeformat), "stationid": self.stationid}
+        columns.update((name, _list(v)) for name, v in self.values.items())
+        return columns
@@ -19,66 +19,815 @@
 #
 #  version: 20230227132937
 
-from json import dumps
-import mimetypes
+import gzip
+import zlib
 from pathlib import Path
 import re
 from io import BytesIO as IO
 from datetime import datetime, timedelta
 from dateutil import tz
+from dateutil.parser import isoparse
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 from urllib.parse import urlparse, quote, unquote_plus, parse_qs
 import cgi
 import logging
+import threading
+from html import escape
+from time import perf_counter
 
 from .Database import Measurement
-from .Utils import DatetimeEncoder, sanitize_braces
+from .Downsample import lttb
+from .Export import FORMATS, binaryChunks, csvChunks, npyChunks
+from .Metrics import REGISTRY, statsCollector
+from .Pool import PoolExhausted
+from .StaticCache import StaticCache
+from .Template import FileTemplate, Template
+from .Utils import chooseEncoding, dumpb
 
-# from memory_profiler import profile
-# memprofile = open("/tmp/memory_profiler.log", "w+")
-import gc
+REQUESTS = REGISTRY.counter(
+    "htcollector_http_requests_total",
+    "HTTP requests by method, route and status.",
+    ("method", "route", "status"),
+)
+LATENCY = REGISTRY.histogram(
+    "htcollector_http_request_duration_seconds",
+    "Time to handle a request by route, excluding sending the response.",
+    ("route",),
+)
+MEASUREMENTS = REGISTRY.counter(
+    "htcollector_measurements_received_total",
+    "Measurements received by station.",
+    ("stationid",),
+)
 
 
-class InterceptorHandlerFactory:
+class Response:
     """
-    Provides a single handler that returns an InterceptorHandler(BaseHTTPRequestHandler)
-    that writes measurements to the provided MeasurementDatabase.
+    An HTTP response, independent of the server that sends it.
+
+    Args:
+        status (HTTPStatus): the status code
+        body (bytes, optional): the body or None. Defaults to None.
+        headers (list, optional): of (name, value) tuples. Defaults to None.
+        bare (bool, optional): send just the status line, without a Date header or logging. Defaults to False.
+        compressible (bool, optional): the body may be sent with a content coding. Defaults to False.
+        chunks (iterable, optional): bytes objects that are streamed instead of a body, with chunked transfer encoding if the client supports it. Defaults to None.
+
+    """
+
+    def __init__(
+        self,
+        status,
+        body=None,
+        headers=None,
+        bare=False,
+        compressible=False,
+        chunks=None,
+    ):
+        self.status = status
+        self.body = body
+        self.chunks = chunks
+        self.headers = headers if headers is not None else []
+        self.bare = bare
+        self.compressible = compressible
+        # content coding -> compressed body, kept with the response so a cached response is compressed only once
+        self.encoded = {}
+
+    def encode(self, encoding, level):
+        """
+        Return a copy of the response with a compressed body.
+
+        Args:
+            encoding (str): gzip or deflate
+            level (int): the compression level
+
+        Returns:
+            Response: the compressed response
+        """
+        body = self.encoded.get(encoding)
+        if body is None:
+            if encoding == "gzip":
+                body = gzip.compress(self.body, level, mtime=0)
+            else:
+                body = zlib.compress(self.body, level)
+            self.encoded[encoding] = body
+        return Response(
+            self.status,
+            body,
+            self.headers
+            + [("Content-Encoding", encoding), ("Vary", "Accept-Encoding")],
+            self.bare,
+        )
+
+
+class Stream:
     """
+    The chunks of a streamed response, started before the response is sent.
+
+    The first chunk is taken right away, so for a database query the
+    connection is checked out and the query executed while the handler can
+    still answer with an error. The release callable is called once, when
+    the chunks are exhausted or the stream is closed.
+
+    Args:
+        chunks (iterator): the chunks
+        release (callable): called when the stream is done
+
+    """
+
+    def __init__(self, chunks, release):
+        self.release = release
+        try:
+            self.chunks = iter(chunks)
+            self.first = [next(self.chunks)]
+        except StopIteration:
+            self.first = []
+        except BaseException:
+            release()
+            self.release = None
+            raise
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.first:
+            return self.first.pop()
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        release, self.release = self.release, None
+        if release is not None:
+            try:
+                if hasattr(self.chunks, "close"):
+                    self.chunks.close()
+            finally:
+                release()
+
+    # a response that is dropped unsent must not keep its stream slot
+    __del__ = close
+
+
+def chunkFrame(data):
+    """frame a piece of a response body for chunked transfer encoding"""
+    return b"%X\r\n%s\r\n" % (len(data), data)
+
+
+class InterceptorApp:
+    """
+    Implements the routes of the collector.
+
+    The app maps a request to a Response, so the same routes can be served by
+    the threading Interceptor as well as by the AsyncInterceptor. All methods
+    may block on the database or the filesystem.
+
+    Args:
+        db (MeasurementDatabase): the database
+        static_directory (str): directory containing static resources
+        ingest (IngestBuffer, optional): if provided, measurements are queued here instead of being stored directly. Defaults to None.
+        cache (ResponseCache, optional): if provided, the /json, /json/24 and /all responses are cached here. Defaults to None.
+        compresslevel (int, optional): level for compressing json and html responses, 0 disables compression. Defaults to 6.
+        compressmin (int, optional): responses smaller than this many bytes are not compressed. Defaults to 1024.
+        maxstreams (int, optional): number of /series and /export responses streamed at the same time, each holds a database connection. Defaults to 2.
+
+    """
+
+    # query strings are only parsed once a route has been found
+    sensorlogquery = re.compile(
+        r"^hum=(?P<humidity>\d+(\.\d+)?)\&temp=(?P<temperature>-?\d+(\.\d+)?)\&id=(?P<stationid>[a-z01-9-]+)$",
+        re.IGNORECASE,
+    )
+    seriesparameters = {"id", "from", "to"}
+    exportparameters = {"id", "from", "to", "format"}
+    rangeparameters = {"id", "from", "to", "points"}
+    statsparameters = {"id", "from", "to", "bucket"}
+    maxpoints = 10000
+    stationidpattern = re.compile(r"^([a-z01-9-]+|\*)$", re.IGNORECASE)
+    idquery = re.compile(
+        r"^(id=(?P<stationid>[a-z01-9-]+))?((?(stationid)&)format=(?P<format>rows|columns))?$",
+        re.IGNORECASE,
+    )
+
+    # we only allow external scripts from jsdelivr
+    common_headers = [
+        (
+            "Content-Security-Policy",
+            "default-src 'self'; script-src 'self' https://cdn.jsdelivr.net/npm/ 'unsafe-inline'; object-src 'none'; base-uri 'self'; frame-ancestors 'self';",
+        ),
+        ("X-Content-Type-Options", "nosniff"),
+    ]
+
+    namespage = Template(
+        """<html><body>
+        <table>{rows}</table>
+        </body></html>
+        """
+    )
+    namesrow = Template(
+        '<tr><td>{stationid}</td><td>{name}</td><td><a href="/static/updatename.html?id={qstationid}&name={qname}">Change</a></td></tr>'
+    )
+
+    def __init__(
+        self,
+        db,
+        static_directory,
+        ingest=None,
+        cache=None,
+        compresslevel=6,
+        compressmin=1024,
+        maxstreams=2,
+    ):
+        self.db = db
+        self.cache = cache
+        self.compresslevel = compresslevel
+        self.compressmin = compressmin
+        self.maxstreams = maxstreams
+        self.streams = threading.BoundedSemaphore(maxstreams)
+        self.static_directory = static_directory
+        self.ingest = ingest
+        self.store = db if ingest is None else ingest
+        self.static = StaticCache(static_directory)
+        self.static.preload()
+        self.allpage = FileTemplate(Path(static_directory) / "all.html")
+        self.routes = {}
+        self.prefixroutes = {}
+        self.addRoute("GET", "/sensorlog", self.sensorlogRoute, query=True)
+        self.addRoute("GET", "/favicon.ico", self.faviconRoute)
+        self.addRoute("GET", "/json", self.jsonRoute, query=True)
+        self.addRoute("GET", "/json/24", self.jsonRoute, query=True)
+        self.addRoute("GET", "/series", self.seriesRoute, query=True)
+        self.addRoute("GET", "/export", self.exportRoute, query=True)
+        self.addRoute("GET", "/stats", self.statsRoute, query=True)
+        self.addRoute("GET", "/all", self.allRoute)
+        self.addRoute("GET", "/names", self.namesRoute)
+        self.addRoute("GET", "/", self.staticRoute)
+        self.addRoute("GET", "/static/", self.staticRoute, query=True, prefix=True)
+        self.addRoute("POST", "/name", self.updatenameRoute)
+        self.addRoute("GET", "/metrics", self.metricsRoute)
+
+    def addRoute(self, method, path, handler, query=False, prefix=False):
+        """
+        Register a handler for a method and path.
+
+        Paths are matched case insensitively. A prefix route is a single first
+        path segment like /static/ and matches every path below it, unless an
+        exact route exists for that path.
+
+        Args:
+            method (str): the request method
+            path (str): the path, without query string
+            handler (callable): called with (path, query, headers, body), returns a Response
+            query (bool, optional): if False, requests with a query string are forbidden. Defaults to False.
+            prefix (bool, optional): match all paths below this path. Defaults to False.
+        """
+        if prefix and (path.count("/") != 2 or not path.endswith("/")):
+            raise ValueError("a prefix route must be a single segment like /static/")
+        routes = self.prefixroutes if prefix else self.routes
+        routes[(method, path.lower())] = (handler, query, path.lower())
+
+    def route(self, method, path):
+        """
+        Find the handler for a request.
+
+        Exact paths are looked up first, then the first path segment as a prefix.
+
+        Returns:
+            tuple: (handler, query) or None if no route matches or a query string is not allowed
+        """
+        match = self.match(method, path)
+        return None if match is None else match[:2]
+
+    def match(self, method, path):
+        """
+        Find the handler for a request, like route().
+
+        Returns:
+            tuple: (handler, query, the path the route was registered with) or None
+        """
+        routepath, q, query = path.partition("?")
+        routepath = routepath.lower()
+        route = self.routes.get((method, routepath))
+        if route is None:
+            slash = routepath.find("/", 1)
+            if slash < 0:
+                return None
+            route = self.prefixroutes.get((method, routepath[: slash + 1]))
+            if route is None:
+                return None
+        handler, allowquery, registered = route
+        if q and not allowquery:
+            return None
+        return handler, query, registered
 
     @staticmethod
-    def getHandler(db, static_directory):
-        class InterceptorHandler(BaseHTTPRequestHandler):
-            querypattern = re.compile(
-                r"^/sensorlog\?hum=(?P<humidity>\d+(\.\d+)?)\&temp=(?P<temperature>-?\d+(\.\d+)?)\&id=(?P<stationid>[a-z01-9-]+)$",
-                re.IGNORECASE,
+    def checkPath(path: Path):
+        for p in path.parts:
+            if p in {".", ".."}:
+                raise ValueError("relative paths are forbidden")
+
+    @staticmethod
+    def getTimeseries(db, stationid, timeformat=None, columns=False):
+        mark = datetime.now() - timedelta(days=1)
+        return db.retrieveTimeseries(
+            [stationid], mark, timeformat=timeformat, columns=columns
+        )[stationid]
+
+    def ok(self, body, content_type, common=True, compressible=False):
+        headers = [("Content-type", content_type)]
+        if common:
+            headers.extend(self.common_headers)
+        return Response(HTTPStatus.OK, body, headers, compressible=compressible)
+
+    def handle(self, method, path, headers, body=b""):
+        """
+        Map a request to a response.
+
+        Args:
+            method (str): the request method
+            path (str): the request path, including the query string
+            headers (Message): the request headers
+            body (bytes, optional): the request body. Defaults to b"".
+
+        Returns:
+            Response: the response
+        """
+        start = perf_counter()
+        label = "none"
+        try:
+            match = self.match(method, path)
+            if match is None:
+                response = Response(HTTPStatus.FORBIDDEN, bare=True)
+            else:
+                handler, query, label = match
+                response = self.negotiate(handler(path, query, headers, body), headers)
+        except PoolExhausted as e:
+            # overload rather than failure, the client may try again shortly
+            logging.warning(e)
+            response = Response(
+                HTTPStatus.SERVICE_UNAVAILABLE,
+                headers=[("Retry-After", "1")],
+                bare=True,
+            )
+        except Exception as e:
+            logging.exception(e)
+            response = Response(HTTPStatus.INTERNAL_SERVER_ERROR, bare=True)
+        REQUESTS.inc(method, label, int(response.status))
+        LATENCY.observe(perf_counter() - start, label)
+        return response
+
+    def negotiate(self, response, headers):
+        """
+        Compress a compressible response with the content coding the client prefers.
+        """
+        if (
+            not response.compressible
+            or self.compresslevel == 0
+            or len(response.body) < self.compressmin
+        ):
+            return response
+        encoding = chooseEncoding(headers.get("Accept-Encoding"))
+        if encoding is None:
+            return Response(
+                response.status,
+                response.body,
+                response.headers + [("Vary", "Accept-Encoding")],
+                response.bare,
             )
-            htmlpattern = re.compile(
-                r"^/html(\?id=(?P<stationid>[a-z01-9-]+))?$",
-                re.IGNORECASE,
+        return response.encode(encoding, self.compresslevel)
+
+    def sensorlogRoute(self, path, query, headers, body):
+        if m := re.match(self.sensorlogquery, query):
+            measurement = Measurement(
+                m.group("stationid"),
+                m.group("temperature"),
+                m.group("humidity"),
             )
-            allpattern = re.compile(
-                r"^/all$",
-                re.IGNORECASE,
+            self.store.storeMeasurement(measurement)
+            MEASUREMENTS.inc(measurement.stationid)
+            return Response(HTTPStatus.OK)
+        return Response(HTTPStatus.FORBIDDEN, bare=True)
+
+    def metricsRoute(self, path, query, headers, body):
+        """
+        Return the metrics in the Prometheus text format.
+
+        Besides the registered metrics these include the statistics of the
+        static file cache and, if present, of the response cache and the
+        ingest buffer.
+        """
+        collectors = [
+            statsCollector(
+                "htcollector_static_cache",
+                lambda: {
+                    "hits": self.static.hits,
+                    "loads": self.static.loads,
+                    "entries": len(self.static.entries),
+                },
+                "Static file cache",
+            )
+        ]
+        if self.cache is not None:
+            collectors.append(
+                statsCollector(
+                    "htcollector_response_cache", self.cache.stats, "Response cache"
+                )
             )
+        if self.ingest is not None:
+            collectors.append(
+                statsCollector("htcollector_ingest", self.ingest.stats, "Ingest buffer")
+            )
+        return self.ok(
+            REGISTRY.render(collectors).encode(),
+            "text/plain; version=0.0.4; charset=utf-8",
+            common=False,
+            compressible=True,
+        )
+
+    def faviconRoute(self, path, query, headers, body):
+        return self.staticFile(
+            Path(self.static_directory) / "favicon.ico", False, headers
+        )
+
+    def jsonRoute(self, path, query, headers, body):
+        p24 = path.partition("?")[0].lower() == "/json/24"
+        if m := re.match(self.idquery, query):
+            stationid = m.group("stationid")
+            columns = m.group("format") == "columns"
+            if columns and not p24:
+                # the last measurements of all stations are not a series
+                return Response(HTTPStatus.FORBIDDEN, bare=True)
+            return self.cached(
+                (
+                    "json/24/columns" if columns else "json/24" if p24 else "json",
+                    stationid,
+                ),
+                lambda: self.json(stationid, p24, columns),
+            )
+        if not p24:
+            parameters = self.seriesParameters(query, self.rangeparameters)
+            if parameters is not None:
+                return self.rangeJson(parameters)
+        return Response(HTTPStatus.FORBIDDEN, bare=True)
+
+    def rangeJson(self, parameters):
+        """
+        Return the measurements of a station in a time range, reduced to at most points measurements.
+
+        /json?id=<stationid>&from=<iso datetime>[&to=<iso datetime>][&points=<n>]
+
+        The measurements come from the coarsest rollup that still has enough
+        points, and are then reduced with LTTB on the temperature, so the size
+        of the response does not depend on the length of the range.
+        """
+        try:
+            points = int(parameters.get("points", "500"))
+        except ValueError:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        if parameters["id"] == "*" or not 3 <= points <= self.maxpoints:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        series = self.db.retrieveMeasurements(
+            parameters["id"],
+            parameters["from"],
+            parameters.get("to"),
+            resolution="auto",
+            points=points,
+            asarrays=True,
+        ).sorted()
+        selected = lttb(series.t, series.values["temperature"], points)
+        # only the selected measurements are converted to dicts
+        json = dumpb(series.take(selected).rows(timeformat="iso"))
+        return self.ok(json, "application/json", compressible=True)
+
+    def seriesParameters(self, query, allowed=None):
+        """
+        Parse and validate the query string of a series request.
+
+        Args:
+            query (str): the query string
+            allowed (set, optional): the allowed parameters. Defaults to None for seriesparameters.
 
-            jsonpattern = re.compile(
-                r"^/json(?P<p24>/24)?(\?id=(?P<stationid>[a-z01-9-]+))?$",
-                re.IGNORECASE,
+        Returns:
+            dict: the parameters, with from and to as datetimes, or None if the query is invalid
+        """
+        try:
+            parameters = parse_qs(query, strict_parsing=True, max_num_fields=10)
+        except ValueError:
+            return None
+        if not set(parameters) <= (allowed or self.seriesparameters) or any(
+            len(v) != 1 for v in parameters.values()
+        ):
+            return None
+        parameters = {k: v[0] for k, v in parameters.items()}
+        if "id" not in parameters or "from" not in parameters:
+            return None
+        if not re.match(self.stationidpattern, parameters["id"]):
+            return None
+        try:
+            for p in ("from", "to"):
+                if p in parameters:
+                    t = isoparse(parameters[p])
+                    # without a timezone a time is local, like elsewhere
+                    parameters[p] = t if t.tzinfo is not None else t.astimezone()
+        except ValueError:
+            return None
+        return parameters
+
+    def stream(self, chunks):
+        """
+        Start streaming chunks from the database.
+
+        A stream holds a pooled connection until the client has received
+        everything, so a few slow downloads could starve ingest. At most
+        maxstreams streams are served at a time, beyond that requests get
+        a 503 right away.
+
+        Args:
+            chunks (generator): chunks from MeasurementDatabase.iterMeasurements()
+
+        Returns:
+            Stream: the started stream
+
+        Raises:
+            PoolExhausted: if maxstreams streams are in progress
+        """
+        if not self.streams.acquire(blocking=False):
+            if hasattr(chunks, "close"):
+                chunks.close()
+            raise PoolExhausted(f"all {self.maxstreams} streams in use")
+        return Stream(chunks, self.streams.release)
+
+    def seriesRoute(self, path, query, headers, body):
+        """
+        Stream the measurements of a station (or * for all stations) in a time range as a json array.
+
+        /series?id=<stationid>&from=<iso datetime>[&to=<iso datetime>]
+        """
+        parameters = self.seriesParameters(query)
+        if parameters is None:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        chunks = self.stream(
+            self.db.iterMeasurements(
+                parameters["id"],
+                parameters["from"],
+                parameters.get("to"),
+                timeformat="iso",
             )
-            namespattern = re.compile(
-                r"^/names$",
-                re.IGNORECASE,
+        )
+        headers = [("Content-type", "application/json")] + self.common_headers
+        return Response(HTTPStatus.OK, None, headers, chunks=self.jsonArray(chunks))
+
+    def exportRoute(self, path, query, headers, body):
+        """
+        Stream the measurements of a station (or * for all stations) in a time range as a file.
+
+        /export?id=<stationid>&from=<iso datetime>[&to=<iso datetime>][&format=csv|bin|npy]
+
+        See Export for the formats. The binary formats need a single station.
+        """
+        parameters = self.seriesParameters(query, self.exportparameters)
+        if parameters is None:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        fmt = parameters.get("format", "csv")
+        if fmt not in FORMATS:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        stationid, starttime = parameters["id"], parameters["from"]
+        # fixed, so the count and the rows of an npy file cover the same range
+        endtime = parameters.get("to") or datetime.now(tz=tz.UTC)
+        content_type, extension, single, counted = FORMATS[fmt]
+        if single and stationid == "*":
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        if counted:
+            count = self.db.countMeasurements(stationid, starttime, endtime)
+        chunks = self.stream(
+            self.db.iterMeasurements(
+                stationid,
+                starttime,
+                endtime,
+                timeformat="iso" if fmt == "csv" else "epochms",
+                columns=True,
             )
-            updatenamepattern = re.compile(
-                r"^/name$",
-                re.IGNORECASE,
+        )
+        if fmt == "csv":
+            chunks = csvChunks(chunks)
+        elif fmt == "bin":
+            chunks = binaryChunks(chunks, stationid)
+        else:
+            chunks = npyChunks(chunks, count)
+        filename = "all" if stationid == "*" else stationid
+        headers = [
+            ("Content-type", content_type),
+            ("Content-Disposition", f'attachment; filename="{filename}.{extension}"'),
+        ] + self.common_headers
+        return Response(HTTPStatus.OK, None, headers, chunks=chunks)
+
+    def statsRoute(self, path, query, headers, body):
+        """
+        Return the statistics of a station (or * for all stations) in a time range.
+
+        /stats?id=<stationid>&from=<iso datetime>[&to=<iso datetime>][&bucket=minute|hour|day]
+
+        See MeasurementDatabase.statistics(), only the summaries are sent.
+        """
+        parameters = self.seriesParameters(query, self.statsparameters)
+        if parameters is None:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        bucket = parameters.get("bucket")
+        if bucket is not None and bucket not in self.db.ROLLUPS:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        stationid = parameters["id"]
+        statistics = self.db.statistics(
+            None if stationid == "*" else [stationid],
+            parameters["from"],
+            parameters.get("to"),
+            bucket=bucket,
+            timeformat="iso",
+        )
+        return self.ok(dumpb(statistics), "application/json", compressible=True)
+
+    @staticmethod
+    def jsonArray(chunks):
+        """
+        Serialize lists of objects as a single json array, one piece per list.
+        """
+        separator = b"["
+        try:
+            for chunk in chunks:
+                if chunk:
+                    # strip the brackets of each list, they are added once around the whole
+                    yield separator + dumpb(chunk)[1:-1]
+                    separator = b","
+            yield b"[]" if separator == b"[" else b"]"
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    def allRoute(self, path, query, headers, body):
+        return self.cached(("all", None), self.allPage)
+
+    def namesRoute(self, path, query, headers, body):
+        return self.namesPage(self.db.names("*"))
+
+    def staticRoute(self, path, query, headers, body):
+        resource = path.partition("?")[0][len("/static/") :]
+        filepath = Path(self.static_directory) / resource
+        try:
+            self.checkPath(filepath)
+        except ValueError:
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        # an absolute resource, as in /static//etc/passwd, replaces the directory,
+        # cached files were checked when they were loaded
+        if filepath not in self.static.entries and not self.static.contains(filepath):
+            return Response(HTTPStatus.FORBIDDEN, bare=True)
+        if filepath.is_dir():
+            filepath /= "index.html"
+        return self.staticFile(filepath, True, headers)
+
+    def updatenameRoute(self, path, query, headers, body):
+        try:
+            keyvalues = parse_qs(
+                body, max_num_fields=2
+            )  # encoding is assumed to be UTF-8
+        except ValueError:
+            return Response(HTTPStatus.BAD_REQUEST, bare=True)
+        stationid = keyvalues.get(b"id", [b""])[0].decode("UTF-8")
+        name = keyvalues.get(b"name", [b""])[0].decode("UTF-8")
+        if stationid == "" or name == "":
+            return Response(HTTPStatus.BAD_REQUEST, bare=True)
+        return self.namesPage(self.db.names(stationid, name))
+
+    def cached(self, key, render):
+        """
+        Return a rendered response from the response cache, if there is one.
+
+        Args:
+            key (tuple): (route, stationid) with a stationid of None for responses that cover all stations
+            render (callable): returns the Response, only 200 OK responses are cached
+        """
+        if self.cache is None:
+            return render()
+
+        def compute():
+            response = render()
+            return response, response.status == HTTPStatus.OK
+
+        return self.cache.get(key, compute)
+
+    def staticFile(self, filepath, common=True, headers=None):
+        """
+        Serve a file from the static cache.
+
+        Conditional requests are answered with 304 Not Modified and clients
+        that accept gzip get the compressed variant.
+        """
+        entry = self.static.get(filepath)
+        if entry is None:
+            return Response(HTTPStatus.NOT_FOUND)
+        headers = headers if headers is not None else {}
+        body, etag, encoding = entry.variant(headers.get("Accept-Encoding"))
+        validators = [
+            ("ETag", etag),
+            ("Last-Modified", entry.lastmodified),
+            ("Cache-Control", "no-cache"),
+        ]
+        if entry.gzipped is not None:
+            validators.append(("Vary", "Accept-Encoding"))
+        if entry.notModified(headers):
+            return Response(HTTPStatus.NOT_MODIFIED, None, validators)
+        response = self.ok(body, entry.mime_type, common)
+        response.headers.extend(validators)
+        if encoding is not None:
+            response.headers.append(("Content-Encoding", encoding))
+        return response
+
+    def allPage(self):
+        last_measurements = self.db.retrieveLastMeasurement()
+        station_data = dumpb(last_measurements).decode()
+        time_series = self.db.retrieveTimeseries(
+            [s["stationid"] for s in last_measurements],
+            datetime.now() - timedelta(days=1),
+            timeformat="epochms",
+            columns=True,
+        )
+        temperature_data_map = dumpb(time_series).decode()
+
+        try:
+            html = self.allpage.render(
+                station_data=station_data,
+                temperature_data_map=temperature_data_map,
+                timestamp=str(datetime.now()),
             )
-            staticpattern = re.compile(
-                r"^(/static/(?P<resource>.*))|/$",
-                re.IGNORECASE,
+        except FileNotFoundError:
+            return Response(HTTPStatus.NOT_FOUND)
+        return self.ok(bytes(html, "UTF-8"), "text/html", compressible=True)
+
+    def json(self, stationid, p24, columns=False):
+        if columns:
+            json = dumpb(self.getTimeseries(self.db, stationid, "epochms", True))
+        elif p24:
+            json = dumpb(self.getTimeseries(self.db, stationid, "iso"))
+        else:
+            json = dumpb(self.db.retrieveLastMeasurement(stationid))
+        return self.ok(json, "application/json", compressible=True)
+
+    def namesPage(self, names):
+        rows = "\n".join(
+            self.namesrow.render(
+                stationid=escape(s),
+                name=escape(n),
+                qstationid=quote(s),
+                qname=quote(n),
             )
-            faviconpattern = re.compile(r"^/favicon.ico$")
+            for s, n in names.items()
+        )
+        html = self.namespage.render(rows=rows)
+        return self.ok(bytes(html, "UTF-8"), "text/html", compressible=True)
+
+
+class InterceptorHandlerFactory:
+    """
+    Provides a single handler that returns an InterceptorHandler(BaseHTTPRequestHandler)
+    that writes measurements to the provided MeasurementDatabase.
+
+    If an ingest buffer is provided, measurements are queued there instead of
+    being stored directly, and if a response cache is provided the dashboard
+    responses are cached there.
+
+    The handler speaks HTTP/1.1, so a browser can load the dashboard, its
+    static resources and the json data over a single persistent connection.
+    A connection is closed after it has been idle for timeout seconds or after
+    maxrequests requests.
+    """
+
+    @staticmethod
+    def getHandler(
+        db,
+        static_directory,
+        ingest=None,
+        timeout=15.0,
+        maxrequests=100,
+        cache=None,
+        compresslevel=6,
+        compressmin=1024,
+        maxstreams=2,
+    ):
+        app = InterceptorApp(
+            db, static_directory, ingest, cache, compresslevel, compressmin, maxstreams
+        )
+
+        class InterceptorHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                self.timeout = (
+                    timeout  # applied to the socket by StreamRequestHandler.setup()
+                )
+                self.requests = 0
+                super().setup()
 
             def send_response(self, code, message=None):
                 """Add the response header to the headers buffer and log the
@@ -91,206 +840,70 @@ class InterceptorHandlerFactory:
                 # self.send_header('Server', self.version_string())
                 self.send_header("Date", self.date_time_string())
 
-            @staticmethod
-            def checkPath(path: Path):
-                for p in path.parts:
-                    if p in {".", ".."}:
-                        raise ValueError("relative paths are forbidden")
-
-            @staticmethod
-            def getTimeseries(db, stationid):
-                mark = datetime.now() - timedelta(days=1)
-                mtime = db.retrieveDatetimeBefore(stationid, mark)
-                return db.retrieveMeasurements(
-                    stationid,
-                    mtime if mtime is not None else mark,
-                )
-
-            def common_headers(self):
-                """we only allow external scripts from jsdelivr"""
-                self.send_header(
-                    "Content-Security-Policy",
-                    "default-src 'self'; script-src 'self' https://cdn.jsdelivr.net/npm/ 'unsafe-inline'; object-src 'none'; base-uri 'self'; frame-ancestors 'self';",
+            def write_response(self, response):
+                """
+                Send a response, always with a Content-Length or chunked so the connection can be reused.
+                """
+                body = response.body if response.body is not None else b""
+                if response.bare:
+                    self.send_response_only(response.status)
+                else:
+                    self.send_response(response.status)
+                for name, value in response.headers:
+                    self.send_header(name, value)
+                chunked = (
+                    response.chunks is not None and self.request_version == "HTTP/1.1"
                 )
-                self.send_header("X-Content-Type-Options", "nosniff")
-
-            # @profile(stream=memprofile)
-            def do_GET(self):
-                logging.info(self.path)
+                if chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                elif response.chunks is not None:
+                    # an HTTP/1.0 client reads the body until the connection is closed
+                    self.close_connection = True
+                elif response.status != HTTPStatus.NOT_MODIFIED:
+                    self.send_header("Content-Length", str(len(body)))
+                self.requests += 1
+                if self.requests >= maxrequests and not self.close_connection:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                if response.chunks is None:
+                    self.wfile.write(body)
+                    return
                 try:
-                    if re.match(self.faviconpattern, self.path):
-                        filepath = Path(static_directory) / "favicon.ico"
-                        mime_type = mimetypes.guess_type(filepath)[0]
-                        try:
-                            with open(filepath, "rb") as f:
-                                b = f.read()
-                                self.send_response(HTTPStatus.OK)
-                                self.send_header("Content-type", mime_type)
-                                self.send_header("Content-Length", str(len(b)))
-                                self.end_headers()
-                                self.wfile.write(b)
-                                return
-                        except FileNotFoundError:
-                            self.send_response(HTTPStatus.NOT_FOUND)
-                    if m := re.match(self.querypattern, self.path):
-                        measurement = Measurement(
-                            m.group("stationid"),
-                            m.group("temperature"),
-                            m.group("humidity"),
-                        )
-                        db.storeMeasurement(measurement)
-                        self.send_response(HTTPStatus.OK)
-                    elif m := re.match(self.allpattern, self.path):
-                        last_measurements = db.retrieveLastMeasurement()
-                        station_data = dumps(
-                            last_measurements,
-                            cls=DatetimeEncoder,
-                        )
-                        time_series = {
-                            s["stationid"]: InterceptorHandler.getTimeseries(
-                                db, s["stationid"]
-                            )
-                            for s in last_measurements
-                        }
-                        temperature_data_map = dumps(time_series, cls=DatetimeEncoder)
-
-                        filepath = Path(static_directory) / "all.html"
-                        try:
-                            with open(filepath, "rb") as f:
-                                html = f.read().decode()
-                                html = sanitize_braces(html)
-                                logging.info(html)
-                            html = html.format(
-                                station_data=station_data,
-                                temperature_data_map=temperature_data_map,
-                                timestamp=str(datetime.now()),
-                            )
-                        except FileNotFoundError:
-                            self.send_response(HTTPStatus.NOT_FOUND)
-
-                        html = bytes(html, "UTF-8")
-                        self.send_response(HTTPStatus.OK)
-                        self.send_header("Content-type", "text/html")
-                        self.send_header("Content-Length", str(len(html)))
-                        self.common_headers()
-                        self.end_headers()
-                        self.wfile.write(html)
-                        return
-                    elif m := re.match(self.jsonpattern, self.path):
-                        if m.group("p24") is not None:
-                            mark = datetime.now() - timedelta(days=1)
-                            mtime = db.retrieveDatetimeBefore(
-                                m.group("stationid"), mark
-                            )
-                            json = bytes(
-                                dumps(
-                                    db.retrieveMeasurements(
-                                        m.group("stationid"),
-                                        mtime if mtime is not None else mark,
-                                    ),
-                                    cls=DatetimeEncoder,
-                                ),
-                                encoding="UTF-8",
-                            )
-                        else:
-                            json = bytes(
-                                dumps(
-                                    db.retrieveLastMeasurement(m.group("stationid")),
-                                    cls=DatetimeEncoder,
-                                ),
-                                encoding="UTF-8",
-                            )
-                        self.send_response(HTTPStatus.OK)
-                        self.send_header("Content-type", "application/json")
-                        self.send_header("Content-Length", str(len(json)))
-                        self.common_headers()
-                        self.end_headers()
-                        self.wfile.write(json)
-                        return
-                    elif m := re.match(self.namespattern, self.path):
-                        names = db.names("*")
-                        names = "\n".join(
-                            f'<tr><td>{s}</td><td>{n}</td><td><a href="/static/updatename.html?id={quote(s)}&name={quote(n)}">Change</a></td></tr>'
-                            for s, n in names.items()
-                        )
-                        self.send_response(HTTPStatus.OK)
-                        html = f"""<html><body>
-                        <table>{names}</table>
-                        </body></html>
-                        """
-                        self.send_header("Content-type", "text/html")
-                        self.send_header("Content-Length", str(len(html)))
-                        self.common_headers()
-                        self.end_headers()
-                        self.wfile.write(bytes(html, "UTF-8"))
-                        return
-                    elif m := re.match(self.staticpattern, self.path):
-                        path = urlparse(m.group("resource")).path
-                        filepath = Path(static_directory) / (
-                            path.decode() if type(path) is bytes else path
-                        )  # TODO check encoding URLs are not UTF-8?
-                        try:
-                            InterceptorHandler.checkPath(filepath)
-                        except ValueError:
-                            self.send_response_only(HTTPStatus.FORBIDDEN)
-                        if filepath.is_dir():
-                            filepath /= "index.html"
-                        mime_type = mimetypes.guess_type(filepath)[0]
-                        try:
-                            with open(filepath, "rb") as f:
-                                b = f.read()
-                                self.send_response(HTTPStatus.OK)
-                                self.send_header("Content-type", mime_type)
-                                self.send_header("Content-Length", str(len(b)))
-                                self.common_headers()
-                                self.end_headers()
-                                self.wfile.write(b)
-                                return
-                        except FileNotFoundError:
-                            self.send_response(HTTPStatus.NOT_FOUND)
-                    else:
-                        self.send_response_only(HTTPStatus.FORBIDDEN)
+                    for chunk in response.chunks:
+                        if chunk:
+                            self.wfile.write(chunkFrame(chunk) if chunked else chunk)
+                    if chunked:
+                        self.wfile.write(b"0\r\n\r\n")
                 except Exception as e:
+                    # the status line is gone already, all we can do is break off the response
                     logging.exception(e)
-                    self.send_response_only(HTTPStatus.INTERNAL_SERVER_ERROR)
-                self.end_headers()
-                gc.collect()
+                    self.close_connection = True
+                finally:
+                    if hasattr(response.chunks, "close"):
+                        response.chunks.close()
+
+            def do_GET(self):
+                logging.info(self.path)
+                self.write_response(app.handle("GET", self.path, self.headers))
 
             def do_POST(self):
                 logging.info(self.path)
-                if m := re.match(self.updatenamepattern, self.path):
-                    file_length = int(self.headers.get("Content-Length", -1))
+                length = self.headers.get("Content-Length")
+                if length is None:
+                    # without a length the body can only end with the connection
+                    body = self.rfile.read() if self.close_connection else b""
+                else:
                     try:
-                        keyvalues = parse_qs(
-                            self.rfile.read(file_length), max_num_fields=2
-                        )  # encoding is assumed to be UTF-8
+                        length = int(length)
                     except ValueError:
-                        self.send_response_only(HTTPStatus.BAD_REQUEST)
-                        self.end_headers()
+                        length = -1
+                    # a negative length would read until the client disconnects
+                    if length < 0:
+                        self.close_connection = True
+                        self.write_response(Response(HTTPStatus.BAD_REQUEST, bare=True))
                         return
-                    stationid = keyvalues.get(b"id", [b""])[0].decode("UTF-8")
-                    name = keyvalues.get(b"name", [b""])[0].decode("UTF-8")
-                    if stationid == "" or name == "":
-                        self.send_response_only(HTTPStatus.BAD_REQUEST)
-                        self.end_headers()
-                        return
-                    names = db.names(stationid, name)
-                    # TODO refactor duplicate code
-                    names = "\n".join(
-                        f'<tr><td>{s}</td><td>{n}</td><td><a href="/static/updatename.html?id={quote(s)}&name={quote(n)}">Change</a></td></tr>'
-                        for s, n in names.items()
-                    )
-                    self.send_response(HTTPStatus.OK)
-                    html = f"""<html><body>
-                    <table>{names}</table>
-                    </body></html>
-                    """
-                    self.send_header("Content-type", "text/html")
-                    self.send_header("Content-Length", str(len(html)))
-                    self.common_headers()
-                    self.end_headers()
-                    self.wfile.write(bytes(html, "UTF-8"))
-                    return
+                    body = self.rfile.read(length)
+                self.write_response(app.handle("POST", self.path, self.headers, body))
 
         return InterceptorHandler
 
@@ -298,7 +911,30 @@ class InterceptorHandlerFactory:
 class Interceptor(ThreadingHTTPServer):
     allow_reuse_address = True
 
-    def __init__(self, server_address, db, static_directory):
+    def __init__(
+        self,
+        server_address,
+        db,
+        static_directory,
+        ingest=None,
+        timeout=15.0,
+        maxrequests=100,
+        cache=None,
+        compresslevel=6,
+        compressmin=1024,
+        maxstreams=2,
+    ):
         super().__init__(
-            server_address, InterceptorHandlerFactory.getHandler(db, static_directory)
+            server_address,
+            InterceptorHandlerFactory.getHandler(
+                db,
+                static_directory,
+                ingest,
+                timeout,
+                maxrequests,
+                cache,
+                compresslevel,
+                compressmin,
+                maxstreams,
+            ),
         )
@@ -0,0 +1,198 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017143000
+
+"""
+An in-memory cache of the static resources.
+
+Files are read once and kept together with their mime type, validators and a
+gzip compressed variant. Every access compares the modification time and size
+of the file with those of the cached copy, so edited files are picked up
+without a restart.
+"""
+
+import gzip
+import logging
+import mimetypes
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+
+from .Utils import acceptsEncoding
+
+
+class StaticEntry:
+    """
+    A cached file.
+
+    Args:
+        body (bytes): the content of the file
+        gzipped (bytes): gzip compressed content or None if compression does not pay off
+        mime_type (str): the content type
+        mtime_ns (int): modification time of the file in nanoseconds
+        size (int): size of the file
+
+    """
+
+    def __init__(self, body, gzipped, mime_type, mtime_ns, size):
+        self.body = body
+        self.gzipped = gzipped
+        self.mime_type = mime_type
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.mtime = mtime_ns // 1_000_000_000
+        self.etag = f'"{size:x}-{mtime_ns:x}"'
+        self.lastmodified = formatdate(self.mtime, usegmt=True)
+
+    def variant(self, accept_encoding):
+        """
+        Choose the representation for a request.
+
+        Args:
+            accept_encoding (str): the Accept-Encoding header of the request or None
+
+        Returns:
+            tuple: (body, etag, content-encoding) where the content-encoding is None for the plain file
+        """
+        if self.gzipped is not None and acceptsEncoding(accept_encoding, "gzip"):
+            return self.gzipped, self.etag[:-1] + '-gz"', "gzip"
+        return self.body, self.etag, None
+
+    def notModified(self, headers):
+        """
+        Check the conditional request headers.
+
+        If-None-Match takes precedence over If-Modified-Since, as required by RFC 7232.
+
+        Returns:
+            bool: True if the client's copy is still valid
+        """
+        inm = headers.get("If-None-Match")
+        if inm is not None:
+            if inm.strip() == "*":
+                return True
+            # weak comparison, and a gzip variant validates the plain file too
+            tags = {tag.strip() for tag in inm.split(",")}
+            tags |= {tag[2:] for tag in tags if tag.startswith("W/")}
+            return self.etag in tags or self.etag[:-1] + '-gz"' in tags
+        ims = headers.get("If-Modified-Since")
+        if ims is not None:
+            try:
+                return self.mtime <= parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class StaticCache:
+    """
+    Cache of the files in a directory.
+
+    Args:
+        directory (str): the directory with static resources
+        compresslevel (int, optional): gzip level for the compressed variants. Defaults to 9.
+        minsize (int, optional): files smaller than this are not compressed. Defaults to 256.
+
+    """
+
+    def __init__(self, directory, compresslevel=9, minsize=256):
+        self.directory = Path(directory)
+        self.root = self.directory.resolve()
+        self.compresslevel = compresslevel
+        self.minsize = minsize
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+
+    def preload(self):
+        """
+        Load all files below the directory.
+
+        Returns:
+            int: the number of files loaded
+        """
+        n = 0
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".gz") and self.get(Path(root) / name):
+                    n += 1
+        return n
+
+    def contains(self, filepath):
+        """
+        Check that a path, with symbolic links and .. components resolved, lies inside the directory.
+        """
+        resolved = Path(filepath).resolve()
+        return resolved == self.root or self.root in resolved.parents
+
+    def get(self, filepath):
+        """
+        Return the cached file, (re)loading it if it is new or has changed.
+
+        Args:
+            filepath (Path): path of the file
+
+        Returns:
+            StaticEntry: the file or None if it does not exist or lies outside the directory
+        """
+        if filepath not in self.entries and not self.contains(filepath):
+            return None
+        try:
+            st = os.stat(filepath)
+        except (FileNotFoundError, NotADirectoryError):
+            self.entries.pop(filepath, None)
+            return None
+        entry = self.entries.get(filepath)
+        if entry is not None and (entry.mtime_ns, entry.size) == (
+            st.st_mtime_ns,
+            st.st_size,
+        ):
+            self.hits += 1
+            return entry
+        try:
+            entry = self.load(filepath, st)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.entries[filepath] = entry
+            self.loads += 1
+        return entry
+
+    def load(self, filepath, st):
+        with open(filepath, "rb") as f:
+            body = f.read()
+        gzipped = None
+        try:
+            # a precompressed variant is used if it is at least as recent as the file
+            gzpath = Path(str(filepath) + ".gz")
+            if os.stat(gzpath).st_mtime_ns >= st.st_mtime_ns:
+                with open(gzpath, "rb") as f:
+                    gzipped = f.read()
+        except FileNotFoundError:
+            pass
+        if gzipped is None and len(body) >= self.minsize:
+            gzipped = gzip.compress(body, self.compresslevel, mtime=0)
+        if gzipped is not None and len(gzipped) >= len(body):
+            gzipped = None
+        mime_type = mimetypes.guess_type(filepath)[0] or "application/octet-stream"
+        logging.debug(f"cached {filepath} ({len(body)} bytes)")
+        return StaticEntry(body, gzipped, mime_type, st.st_mtime_ns, st.st_size)
@@ -0,0 +1,104 @@
+#  shellyhtcollector, a python module to process sensor readings from Shelly H&T devices
+#
+# (C) 2022 Michel Anders (varkenvarken)
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#  version: 20261017150000
+
+"""
+Minimal templates with named slots.
+
+A slot is a name between braces, optionally padded with whitespace, like
+{timestamp} or { station_data }. Any other braces, for example those of
+inline css or javascript, are left alone. A template is split into literal
+text and slots once, so rendering is a single join.
+"""
+
+import os
+import re
+import threading
+
+slotpattern = re.compile(r"\{\s*([A-Za-z_]\w*)\s*\}")
+
+
+class Template:
+    """
+    A compiled template.
+
+    Args:
+        text (str): the template text
+
+    """
+
+    def __init__(self, text):
+        parts = slotpattern.split(text)
+        self.literals = parts[0::2]
+        self.slots = parts[1::2]
+
+    def render(self, **values):
+        """
+        Fill in the slots.
+
+        Args:
+            values: a str value for every slot
+
+        Returns:
+            str: the rendered text
+
+        Raises:
+            KeyError: if a value for a slot is missing
+        """
+        out = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            out.append(values[slot])
+            out.append(literal)
+        return "".join(out)
+
+
+class FileTemplate:
+    """
+    A template read from a file, recompiled only when the file changes.
+
+    Args:
+        filepath (Path): the template file, read as UTF-8
+
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.template = None
+        self.mtime_ns = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the compiled template, recompiling it if the file was modified.
+
+        Raises:
+            FileNotFoundError: if the file does not exist
+        """
+        mtime_ns = os.stat(self.filepath).st_mtime_ns
+        if mtime_ns != self.mtime_ns:
+            with self.lock:
+                if mtime_ns != self.mtime_ns:
+                    with open(self.filepath, "rb") as f:
+                        self.template = Template(f.read().decode())
+                    self.mtime_ns = mtime_ns
+        return self.template
+
+    def render(self, **values):
+        return self.get().render(**values)
@@ -20,9 +20,31 @@
 #  version: 20220805094810
 
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from re import sub
 
+from dateutil import tz
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# constructing a tzlocal is not free, and it is needed for every row
+LOCALTIME = tz.tzlocal()
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+# timezone transitions fall on a quarter of an hour
+QUARTER = timedelta(minutes=15)
+QUARTER_MS = 15 * 60 * 1000
+# fixed utc offsets of the local timezone by quarter, converting with those avoids dateutil's python code
+_localzones = {}
+
 
 class DatetimeEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -34,5 +56,166 @@ class DatetimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumpb(obj):
+    """
+    Serialize to compact json, as UTF-8 bytes.
+
+    Uses orjson if it is installed and the standard json module otherwise.
+    Both give the same output, with datetimes and timedeltas formatted like
+    DatetimeEncoder does, but rows whose timestamps were already formatted
+    with formatTimestamp() are serialized without any Python callbacks.
+
+    Args:
+        obj: the object to serialize
+
+    Returns:
+        bytes: the json document
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(
+        obj, default=_default, separators=(",", ":"), ensure_ascii=False
+    ).encode()
+
+
+def localZone(quarter):
+    """
+    Return the local timezone as a fixed utc offset.
+
+    Args:
+        quarter (int): the number of quarters of an hour since the epoch
+
+    Returns:
+        timezone: the utc offset of the local timezone during that quarter
+    """
+    zone = _localzones.get(quarter)
+    if zone is None:
+        t = datetime.fromtimestamp(quarter * 900, tz.UTC)
+        zone = timezone(t.astimezone(LOCALTIME).utcoffset())
+        if len(_localzones) > 100000:
+            _localzones.clear()
+        _localzones[quarter] = zone
+    return zone
+
+
+def formatTimestamp(t, timeformat=None):
+    """
+    Convert a timestamp as returned by the database, in UTC but naive, for local use.
+
+    Args:
+        t (datetime): the timestamp
+        timeformat (str, optional): None for a datetime in local time, "iso" for an ISO 8601 string in local time or "epochms" for milliseconds since the epoch. Defaults to None.
+
+    Returns:
+        datetime, str or int: the converted timestamp
+    """
+    if timeformat == "epochms":
+        return (t - EPOCH) // MILLISECOND
+    if timeformat == "iso":
+        zone = localZone((t - EPOCH) // QUARTER)
+        return t.replace(tzinfo=timezone.utc).astimezone(zone).isoformat()
+    return t.replace(tzinfo=tz.UTC).astimezone(LOCALTIME)
+
+
+def percentiles(values, ps):
+    """
+    Compute percentiles with linear interpolation, like PERCENTILE_CONT in SQL.
+
+    Uses numpy if it is installed. None values, NULL in the database, are ignored.
+
+    Args:
+        values (iterable): the values
+        ps (sequence): the percentiles, between 0 and 100
+
+    Returns:
+        list: a value for every percentile, all None if there are no values
+    """
+    values = [v for v in values if v is not None]
+    if not values:
+        return [None] * len(ps)
+    if np is not None:
+        return np.percentile(values, ps).tolist()
+    values.sort()
+    result = []
+    for p in ps:
+        k = (len(values) - 1) * p / 100
+        f = int(k)
+        c = min(f + 1, len(values) - 1)
+        result.append(values[f] + (values[c] - values[f]) * (k - f))
+    return result
+
+
 def sanitize_braces(s):
     return sub(r"(\{)\s*(\S+)\s*(\})", r"\1\2\3", s)
+
+
+def parseAcceptEncoding(accept_encoding):
+    """
+    Parse an Accept-Encoding header.
+
+    Args:
+        accept_encoding (str): the header value or None
+
+    Returns:
+        dict: content coding (lowercase) -> quality
+    """
+    codings = {}
+    if not accept_encoding:
+        return codings
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.strip().lower()] = q
+    return codings
+
+
+def acceptsEncoding(accept_encoding, encoding):
+    """
+    Check whether an Accept-Encoding header allows a content coding.
+
+    Args:
+        accept_encoding (str): the header value or None
+        encoding (str): the content coding, e.g. gzip
+
+    Returns:
+        bool: True if the coding is listed (or covered by *) with a non-zero quality
+    """
+    codings = parseAcceptEncoding(accept_encoding)
+    return codings.get(encoding, codings.get("*", 0.0)) > 0
+
+
+def chooseEncoding(accept_encoding, encodings=("gzip", "deflate")):
+    """
+    Pick the content coding the client prefers.
+
+    Args:
+        accept_encoding (str): the header value or None
+        encodings (tuple, optional): the codings the server offers, ties are resolved in this order. Defaults to ("gzip", "deflate").
+
+    Returns:
+        str: the chosen coding or None if the client accepts none of them
+    """
+    codings = parseAcceptEncoding(accept_encoding)
+    best, bestq = None, 0.0
+    for encoding in encodings:
+        q = codings.get(encoding, codings.get("*", 0.0))
+        if q > bestq:
+            best, bestq = encoding, q
+    return best
@@ -20,18 +20,33 @@
 #  version: 20220828124631
 
 import argparse
+import atexit
+import signal
 from sys import stderr, exit
 from os import environ
 import logging
 
 from .Server import Interceptor
+from .AsyncServer import AsyncInterceptor
 from .Database import MeasurementDatabase
+from .Ingest import IngestBuffer
+from .Rollup import RollupCompactor
+from .Partitions import PartitionMaintainer
+from .Memory import MemoryManager, POLICIES
+from .Pool import VALIDATION
+from .Metrics import REGISTRY, statsCollector
+from .ResponseCache import ResponseCache
 
 
 # all arguments/options can be set using environment variables or command line options
 # if both are present, command line options take precedence
 
 
+def flag(name):
+    """a boolean environment variable is only set by an explicit 1, true, yes or on"""
+    return environ.get(name, "").strip().lower() in ("1", "true", "yes", "on")
+
+
 def get_args(arguments=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -58,6 +73,37 @@ def get_args(arguments=None):
         default=environ.get("DBPORT", "3306"),
         help="database port",
     )
+    parser.add_argument(
+        "--poolsize",
+        type=int,
+        default=int(environ.get("POOLSIZE", 5)),
+        help="maximum number of database connections",
+    )
+    parser.add_argument(
+        "--poolprewarm",
+        type=int,
+        default=int(environ.get("POOLPREWARM", 1)),
+        help="number of database connections opened at startup",
+    )
+    parser.add_argument(
+        "--poolvalidate",
+        type=str,
+        choices=VALIDATION,
+        default=environ.get("POOLVALIDATE", "idle"),
+        help="when to ping a database connection before it is used",
+    )
+    parser.add_argument(
+        "--poolmaxwait",
+        type=float,
+        default=float(environ.get("POOLMAXWAIT", 5.0)),
+        help="seconds a request waits for a free database connection before it gets a 503",
+    )
+    parser.add_argument(
+        "--slowquery",
+        type=float,
+        default=float(environ.get("SLOWQUERY", 1.0)),
+        help="seconds after which a database statement is logged as slow (0 disables the log)",
+    )
     parser.add_argument(
         "-p",
         "--port",
@@ -86,10 +132,124 @@ def get_args(arguments=None):
         default=environ.get("RESOURCEDIR", "./static"),
         help="directory containing static resources",
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        choices=["threading", "asyncio"],
+        default=environ.get("SERVER", "threading"),
+        help="serve requests with a thread per connection or with asyncio",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(environ["WORKERS"]) if "WORKERS" in environ else None,
+        help="number of worker threads for database access in asyncio mode, defaults to the pool size",
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        default=float(environ.get("KEEPALIVE", 15.0)),
+        help="seconds an idle persistent connection is kept open",
+    )
+    parser.add_argument(
+        "--maxrequests",
+        type=int,
+        default=int(environ.get("MAXREQUESTS", 100)),
+        help="number of requests after which a persistent connection is closed",
+    )
+    parser.add_argument(
+        "--cachettl",
+        type=float,
+        default=float(environ.get("CACHETTL", 60.0)),
+        help="seconds a cached /json, /json/24 or /all response stays valid (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--compresslevel",
+        type=int,
+        default=int(environ.get("COMPRESSLEVEL", 6)),
+        help="gzip/deflate level for json and html responses (0 disables compression)",
+    )
+    parser.add_argument(
+        "--compressmin",
+        type=int,
+        default=int(environ.get("COMPRESSMIN", 1024)),
+        help="minimum size in bytes of a response before it is compressed",
+    )
+    parser.add_argument(
+        "--maxstreams",
+        type=int,
+        default=int(environ.get("MAXSTREAMS", 2)),
+        help="number of /series and /export downloads served at the same time, each holds a database connection until it is complete",
+    )
+    parser.add_argument(
+        "--ingestbatch",
+        type=int,
+        default=int(environ.get("INGESTBATCH", 0)),
+        help="number of measurements to buffer before writing them in a single transaction (0 disables buffering)",
+    )
+    parser.add_argument(
+        "--ingestmaxage",
+        type=float,
+        default=float(environ.get("INGESTMAXAGE", 5.0)),
+        help="maximum number of seconds a buffered measurement waits before it is written",
+    )
+    parser.add_argument(
+        "--rollupinterval",
+        type=float,
+        default=float(environ.get("ROLLUPINTERVAL", 60.0)),
+        help="seconds between updates of the minute, hour and day rollup tables (0 disables updates)",
+    )
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        default=flag("PARTITION"),
+        help="partition the measurements table by month (the first time this rebuilds the table)",
+    )
+    parser.add_argument(
+        "--retention",
+        type=int,
+        default=int(environ.get("RETENTION", 0)),
+        help="number of months of measurements to keep in a partitioned table (0 keeps everything)",
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        default=flag("ARCHIVE"),
+        help="move expired months to archive tables instead of dropping them",
+    )
+    parser.add_argument(
+        "--gc",
+        type=str,
+        choices=POLICIES,
+        default=environ.get("GC", "none"),
+        help="garbage collection policy",
+    )
+    parser.add_argument(
+        "--gcinterval",
+        type=float,
+        default=float(environ.get("GCINTERVAL", 60.0)),
+        help="seconds between periodic collections and memory reports",
+    )
+    parser.add_argument(
+        "--gcthreshold",
+        type=str,
+        default=environ.get("GCTHRESHOLD", "700,10,10"),
+        help="comma separated gc thresholds for the threshold policy",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        default=flag("TRACEMALLOC"),
+        help="log the allocations that grew since startup every gcinterval seconds",
+    )
     parser.add_argument(
         "-x", "--ping", action="store_true", help="ping database end exit"
     )
-    return parser.parse_args(arguments)
+    args = parser.parse_args(arguments)
+    # a worker more than there are connections would only wait for one
+    if args.workers is None:
+        args.workers = args.poolsize
+    return args
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -98,18 +258,100 @@ if __name__ == "__main__":  # pragma: no cover
     logging.basicConfig(format="%(asctime)s %(message)s", level=args.loglevel)
 
     db = MeasurementDatabase(
-        args.database, args.dbhost, args.dbport, args.dbuser, args.dbpassword
+        args.database,
+        args.dbhost,
+        args.dbport,
+        args.dbuser,
+        args.dbpassword,
+        args.slowquery,
+        args.poolsize,
+        args.poolprewarm,
+        args.poolvalidate,
+        args.poolmaxwait,
+    )
+    atexit.register(db.pool.close)
+    REGISTRY.addCollector(
+        statsCollector("htcollector_db_pool", db.pool.stats, "Database connection pool")
     )
 
     logging.info(
         f"OK: database {args.database} can be reached on {args.dbhost}:{args.dbport} by {args.dbuser}"
     )
+    logging.info(f"schema version {db.schemaversion}")
+    db.checkIndexUsage()  # logs a warning for queries that do not use the composite index
     if args.ping:
         exit()
 
-    logging.info(f"starting server, listening on {args.bind}:{args.port}")
+    ingest = None
+    if args.ingestbatch > 0:
+        ingest = IngestBuffer(db, args.ingestbatch, args.ingestmaxage)
+        atexit.register(ingest.close)
+        # docker stop sends SIGTERM: exit normally so that the buffer is flushed
+        signal.signal(signal.SIGTERM, lambda signum, frame: exit())
+        logging.info(
+            f"buffering up to {args.ingestbatch} measurements for at most {args.ingestmaxage}s"
+        )
+
+    cache = None
+    if args.cachettl > 0:
+        cache = ResponseCache(args.cachettl)
+        # the listeners are also called when buffered measurements are flushed
+        db.addStoreListener(cache.invalidate)
+
+    if args.rollupinterval > 0:
+        compactor = RollupCompactor(db, args.rollupinterval)
+        atexit.register(compactor.close)
+
+    if args.partition:
+        maintainer = PartitionMaintainer(db, keep=args.retention, archive=args.archive)
+        atexit.register(maintainer.close)
+
+    # created last, the freeze policy freezes everything allocated during startup
+    memory = MemoryManager(
+        args.gc,
+        args.gcinterval,
+        tuple(int(t) for t in args.gcthreshold.split(",")),
+        args.tracemalloc,
+    )
+    atexit.register(memory.close)
+    REGISTRY.addCollector(
+        statsCollector("htcollector_gc", memory.monitor.stats, "Garbage collection")
+    )
+
+    logging.info(f"starting {args.server} server, listening on {args.bind}:{args.port}")
+    if args.server == "asyncio" and args.workers > args.poolsize:
+        logging.warning(
+            f"{args.workers} workers share {args.poolsize} database connections, requests may wait for one"
+        )
 
-    while True:  # apparently serve_forever() does return on a 104 error
-        server = Interceptor((args.bind, args.port), db, args.resourcedir)
+    if args.server == "asyncio":
+        server = AsyncInterceptor(
+            (args.bind, args.port),
+            db,
+            args.resourcedir,
+            ingest,
+            args.workers,
+            args.keepalive,
+            args.maxrequests,
+            cache,
+            args.compresslevel,
+            args.compressmin,
+            args.maxstreams,
+        )
         server.serve_forever()
-        logging.warning("restarting server on a 104 error")
+    else:
+        while True:  # apparently serve_forever() does return on a 104 error
+            server = Interceptor(
+                (args.bind, args.port),
+                db,
+                args.resourcedir,
+                ingest,
+                args.keepalive,
+                args.maxrequests,
+                cache,
+                args.compresslevel,
+                args.compressmin,
+                args.maxstreams,
+            )
+            server.serve_forever()
+            logging.warning("restarting server on a 104 error")
@@ -38,17 +38,18 @@ function getGradient(ctx, chartArea) {
 };
 
 function sparkline(ctx, stationid) {
+    // the series is columnar: {stationid, t:[epoch ms, ...], temperature:[...], humidity:[...]}
     // extend the last measurement to now
-    temperature_data = temperature_data_map[stationid];
-    last_point = structuredClone(temperature_data.slice(-1))[0]; // a slice returns an shallow array
-    last_point.timestamp = new Date().toISOString();
-    temperature_data.push(last_point);
+    series = temperature_data_map[stationid];
+    series.t.push(Date.now());
+    series.temperature.push(series.temperature[series.temperature.length - 1]);
 
     const myChart = new Chart(ctx, {
         type: 'line',
         data: {
+            labels: series.t,
             datasets: [{
-                data: temperature_data,
+                data: series.temperature,
                 fill: false,
                 pointRadius: 0,
                 spanGaps: true,
@@ -57,10 +58,6 @@ function sparkline(ctx, stationid) {
         },
         plugins: [chartAreaBorder],
         options: {
-            parsing: {
-                xAxisKey: 'timestamp',
-                yAxisKey: 'temperature'
-            },
             scales: {
                 x: {
                     type: 'time',
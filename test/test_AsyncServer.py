@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from htcollector.AsyncServer import BadRequest, formatResponse, keepAlive, readRequest
+from htcollector.Server import Response
+
+
+def read(data):
+    async def go():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await readRequest(reader)
+
+    return asyncio.run(go())
+
+
+class TestAsyncServer:
+    def test_readRequest(self):
+        method, path, version, headers, body = read(
+            b"POST /name HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nid=ab"
+        )
+        assert (method, path, version, body) == ("POST", "/name", "HTTP/1.1", b"id=ab")
+        assert headers["Host"] == "x"
+
+    def test_readRequest_closed(self):
+        assert read(b"") is None
+
+    def test_readRequest_bad(self):
+        with pytest.raises(BadRequest):
+            read(b"GET /\r\n\r\n")
+        with pytest.raises(BadRequest):
+            read(b"GET / HTTP/2.0\r\n\r\n")
+        with pytest.raises(BadRequest):
+            read(b"POST / HTTP/1.1\r\nContent-Length: 10000000\r\n\r\n")
+        with pytest.raises(BadRequest):
+            read(b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * 101 + b"\r\n")
+
+    def test_keepAlive(self):
+        assert keepAlive("HTTP/1.1", {})
+        assert not keepAlive("HTTP/1.1", {"Connection": "close"})
+        assert not keepAlive("HTTP/1.0", {})
+        assert keepAlive("HTTP/1.0", {"Connection": "Keep-Alive"})
+
+    def test_formatResponse(self):
+        response = formatResponse(Response(403, bare=True), True)
+        assert (
+            response
+            == b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+        )
+        response = formatResponse(
+            Response(200, b"abc", [("Content-type", "text/plain")]), False
+        )
+        assert response.startswith(b"HTTP/1.1 200 OK\r\nDate: ")
+        assert response.endswith(b"Content-Length: 3\r\n\r\nabc")
+
+    def test_formatResponse_streamed(self):
+        response = Response(200, chunks=iter([b"abc"]))
+        head = formatResponse(response, False, True)
+        assert head.endswith(b"Transfer-Encoding: chunked\r\n\r\n")
+        assert b"Content-Length" not in head
+        head = formatResponse(response, True, False)
+        assert head.endswith(b"Connection: close\r\n\r\n")
+        assert b"Content-Length" not in head
@@ -1,4 +1,4 @@
-from datetime import datetime, tzinfo
+from datetime import datetime, timedelta, tzinfo
 from time import sleep
 from dateutil import tz
 
@@ -8,6 +8,7 @@ from fixtures import database
 
 from htcollector import Database
 
+
 @pytest.fixture(scope="class")
 def measurement(stationid):
     return Database.Measurement(stationid, 30, 65)
@@ -94,6 +95,9 @@ class TestMeasurements:
         assert len(r) == 1
         m1 = [m for m in r if m["stationid"] == "test-100001"]
         assert len(m1) == 1
+        series = database.retrieveMeasurements("test-100001", start, asarrays=True)
+        assert len(series) == 1
+        assert series.rows()[0]["temperature"] == approx(10)
 
     def test_retrieveDatetimeBefore(self, database):
         stationid = "mark-121212"
@@ -106,3 +110,312 @@ class TestMeasurements:
         r = database.retrieveDatetimeBefore(stationid, dt1)
         assert type(r) is datetime
         assert r.timestamp() == approx(start.timestamp(), abs=0.1)
+
+    def test_retrieveTimeseries(self, database):
+        database.storeMeasurement(Database.Measurement("series-1", 10, 40))
+        database.storeMeasurement(Database.Measurement("series-1", 11, 41))
+        sleep(1)
+        mark = datetime.now()
+        sleep(1)
+        database.storeMeasurement(Database.Measurement("series-1", 12, 42))
+        database.storeMeasurement(Database.Measurement("series-2", 20, 50))
+        r = database.retrieveTimeseries(["series-1", "series-2", "series-3"], mark)
+        assert set(r) == {"series-1", "series-2", "series-3"}
+        # the window starts with the last measurement before it
+        assert [m["temperature"] for m in r["series-1"]] == approx([11, 12])
+        assert [m["temperature"] for m in r["series-2"]] == approx([20])
+        assert r["series-3"] == []
+        assert database.retrieveTimeseries([], mark) == {}
+        # the ids are returned as passed, whatever their stored spelling
+        r = database.retrieveTimeseries(["Series-1"], mark)
+        assert set(r) == {"Series-1"}
+        assert [m["temperature"] for m in r["Series-1"]] == approx([11, 12])
+        c = database.retrieveTimeseries(
+            ["series-1", "series-3"], mark, timeformat="epochms", columns=True
+        )
+        assert c["series-1"]["stationid"] == "series-1"
+        assert c["series-1"]["temperature"] == approx([11, 12])
+        assert c["series-1"]["humidity"] == approx([41, 42])
+        assert all(isinstance(t, int) for t in c["series-1"]["t"])
+        assert c["series-1"]["t"] == sorted(c["series-1"]["t"])
+        assert c["series-3"] == {
+            "stationid": "series-3",
+            "t": [],
+            "temperature": [],
+            "humidity": [],
+        }
+
+    def test_statistics(self, database):
+        now = datetime.now(tz=tz.UTC).replace(minute=30)
+        database.storeMeasurements(
+            [
+                Database.Measurement("stats-1", t, 50 + t, now + timedelta(seconds=t))
+                for t in (10, 20, 30, 40)
+            ]
+            + [Database.Measurement("stats-2", 15, 45, now)]
+        )
+        database.names("stats-1", "statsroom")
+        r = database.statistics(["stats-1", "stats-2"], now - timedelta(minutes=1))
+        assert [s["stationid"] for s in r] == ["stats-1", "stats-2"]
+        s1 = r[0]
+        assert s1["name"] == "statsroom"
+        assert s1["bucket"] is None
+        assert s1["count"] == 4
+        assert s1["temperature"]["min"] == approx(10)
+        assert s1["temperature"]["max"] == approx(40)
+        assert s1["temperature"]["mean"] == approx(25)
+        assert s1["temperature"]["p50"] == approx(25)
+        assert s1["humidity"]["p95"] == approx(88.5)
+        assert r[1]["name"] == "Unknown"
+        r = database.statistics(
+            ["stats-1"], now - timedelta(minutes=1), bucket="hour", percentiles=()
+        )
+        assert len(r) == 1
+        assert r[0]["bucket"].minute == 0
+        assert "p50" not in r[0]["temperature"]
+        assert database.statistics([], now) == []
+
+    @pytest.mark.parametrize("sqlpercentiles", [True, False])
+    def test_statistics_percentiles(self, database, monkeypatch, sqlpercentiles):
+        if sqlpercentiles and not database.sqlpercentiles:
+            pytest.skip("the server has no PERCENTILE_CONT")
+        monkeypatch.setattr(database, "sqlpercentiles", sqlpercentiles)
+        stationid = f"pct-{int(sqlpercentiles)}"
+        now = datetime.now(tz=tz.UTC).replace(minute=30)
+        # the stationid is compared case-insensitively, its rows may differ in case
+        database.storeMeasurements(
+            [
+                Database.Measurement(
+                    stationid.upper() if t % 20 else stationid,
+                    t,
+                    50 + t,
+                    now + timedelta(seconds=t),
+                )
+                for t in (10, 20, 30, 40)
+            ]
+        )
+        r = database.statistics([stationid], now - timedelta(minutes=1))
+        assert len(r) == 1
+        assert r[0]["count"] == 4
+        assert r[0]["temperature"]["p50"] == approx(25)
+        assert r[0]["temperature"]["p5"] == approx(11.5)
+        assert r[0]["humidity"]["p95"] == approx(88.5)
+
+    def test_iterMeasurements(self, database):
+        stationid = "stream-100001"
+        start = datetime.now()
+        sleep(1)
+        for i in range(5):
+            database.storeMeasurement(Database.Measurement(stationid, 10 + i, 40))
+        chunks = list(database.iterMeasurements(stationid, start, chunksize=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        rows = [row for chunk in chunks for row in chunk]
+        assert [r["temperature"] for r in rows] == approx([10, 11, 12, 13, 14])
+        assert rows[0].keys() == {"timestamp", "stationid", "temperature", "humidity"}
+        columns = list(
+            database.iterMeasurements(
+                stationid, start, timeformat="epochms", columns=True
+            )
+        )
+        assert columns[0]["temperature"] == approx([10, 11, 12, 13, 14])
+        assert all(isinstance(t, int) for t in columns[0]["t"])
+        assert database.countMeasurements(stationid, start, datetime.now()) == 5
+        # closing the generator early returns the connection to the pool
+        stream = database.iterMeasurements("*", start, chunksize=1)
+        next(stream)
+        stream.close()
+        assert database.pool.stats()["borrowed"] == 0
+
+    def test_queryHook(self, database):
+        records = []
+        database.addQueryHook(records.append)
+        try:
+            database.names("test-100001", "testroom1")
+            database.retrieveDatetimeBefore("test-100001", datetime.now(tz=tz.UTC))
+        finally:
+            database.removeQueryHook(records.append)
+        statements = [r["statement"] for r in records]
+        assert statements[0].startswith("REPLACE StationidToName")
+        assert records[0]["parameters"] == 2
+        assert records[0]["rows"] in (1, 2)  # a replaced row counts twice
+        assert records[-1]["statement"] == database.SELECT_STATION_BEFORE
+        assert records[-1]["rows"] <= 1
+        assert all(r["elapsed"] >= 0 and r["error"] is None for r in records)
+
+    def test_pool(self, database):
+        # a second instance gets its own pool
+        other = Database.MeasurementDatabase(
+            "shellyht", "127.0.0.1", "3306", "test-user", "test_secret", poolsize=2
+        )
+        assert other.pool.name != database.pool.name
+        assert other.names("*") == database.names("*")
+        stats = other.pool.stats()
+        assert stats["size"] == 2
+        assert stats["borrowed"] == 0
+        assert stats["borrows"] >= 1
+        other.pool.close()
+
+    def test_storeListener(self, database):
+        stored = []
+        database.addStoreListener(stored.append)
+        database.storeMeasurement(Database.Measurement("listen-1", 10, 40))
+        database.storeMeasurements(
+            [
+                Database.Measurement("listen-2", 10, 40),
+                Database.Measurement("listen-1", 11, 41),
+            ]
+        )
+        database.names("listen-1", "listenroom")
+        database.storelisteners.remove(stored.append)
+        assert stored == [["listen-1"], ["listen-1", "listen-2"], ["listen-1"]]
+
+    def test_storeMeasurements(self, database):
+        stationid = "batch-100001"
+        database.names(
+            stationid, "batchroom"
+        )  # without a stationid mapping we never get anything back
+        start = datetime.now()
+        sleep(1)
+        t1 = datetime.now(tz=tz.UTC)
+        n = database.storeMeasurements(
+            [
+                Database.Measurement(stationid, 10, 40, t1),
+                Database.Measurement(stationid, 11, 41),
+            ]
+        )
+        assert n == 2
+        r = database.retrieveMeasurements(stationid, start)
+        assert len(r) == 2
+        assert r[0]["timestamp"].timestamp() == approx(t1.timestamp(), abs=0.01)
+        assert database.storeMeasurements([]) == 0
+
+    def test_retrieveLastMeasurement_all(self, database):
+        database.names("last-100001", "lastroom1")
+        database.storeMeasurement(Database.Measurement("last-100001", 10, 40))
+        database.storeMeasurement(Database.Measurement("last-100001", 11, 41))
+        database.storeMeasurement(
+            Database.Measurement("last-100002", 15, 45)
+        )  # no name mapping
+        for stationid in (None, "*"):
+            r = database.retrieveLastMeasurement(stationid)
+            stations = [m["stationid"] for m in r]
+            assert len(stations) == len(set(stations))
+            m1 = [m for m in r if m["stationid"] == "last-100001"]
+            assert len(m1) == 1
+            assert m1[0]["name"] == "lastroom1"
+            assert m1[0]["temperature"] == approx(11)
+            m2 = [m for m in r if m["stationid"] == "last-100002"]
+            assert len(m2) == 1
+            assert m2[0]["name"] == "Unknown"
+
+    def test_LatestMeasurement(self, database):
+        stationid = "latest-100001"
+        database.names(stationid, "latestroom")
+        now = datetime.now(tz=tz.UTC)
+        database.storeMeasurements(
+            [
+                Database.Measurement(stationid, 10, 40, now),
+                Database.Measurement(stationid, 5, 30, now.replace(year=now.year - 1)),
+            ]
+        )
+        r = database.retrieveLastMeasurement(stationid)
+        assert len(r) == 1
+        assert r[0]["temperature"] == approx(10)
+        # an older measurement arriving late does not replace the latest one
+        database.storeMeasurements(
+            [Database.Measurement(stationid, 6, 31, now.replace(year=now.year - 1))]
+        )
+        r = database.retrieveLastMeasurement(stationid)
+        assert r[0]["temperature"] == approx(10)
+        database.storeMeasurement(Database.Measurement(stationid, 12, 42))
+        r = database.retrieveLastMeasurement(stationid)
+        assert r[0]["temperature"] == approx(12)
+        # a batch updates every station with its own most recent row
+        later = datetime.now(tz=tz.UTC)
+        database.storeMeasurements(
+            [
+                Database.Measurement("latest-100002", 1, 10, later),
+                Database.Measurement(stationid, 14, 44, later),
+                Database.Measurement(stationid, 13, 43, later - timedelta(seconds=1)),
+            ]
+        )
+        r = {m["stationid"]: m for m in database.retrieveLastMeasurement()}
+        assert r[stationid]["temperature"] == approx(14)
+        assert r["latest-100002"]["temperature"] == approx(1)
+
+    def test_checkIndexUsage(self, database):
+        assert database.schemaversion >= 3
+        with database._cursor() as cursor:
+            cursor.execute("SHOW INDEX FROM Measurements")
+            indexes = {row[2] for row in cursor.fetchall()}
+        assert "si" not in indexes
+        assert {"ts", "stationtime"} <= indexes
+        r = database.checkIndexUsage()
+        assert set(r) == {
+            "retrieveMeasurements",
+            "retrieveDatetimeBefore",
+            "countMeasurements",
+            "retrieveTimeseries(windows)",
+            "retrieveTimeseries",
+            "statistics",
+            "statistics(readings)",
+            "retrieveMeasurements(minute)",
+            "retrieveMeasurements(hour)",
+            "retrieveMeasurements(day)",
+        } | ({"statistics(percentiles)"} if database.sqlpercentiles else set())
+        for method, (keys, ok) in r.items():
+            assert ok, f"{method} uses {keys}"
+
+    def test_selectResolution(self, database):
+        end = datetime.now(tz=tz.UTC)
+        year = end.replace(year=end.year - 1)
+        assert database.selectResolution(year, end, 365) == "day"
+        assert database.selectResolution(year, end, 1000) == "hour"
+        assert database.selectResolution(end.replace(hour=0), end, 10000) == "raw"
+
+    def test_rollups(self, database):
+        stationid = "rollup-100001"
+        now = datetime.now(tz=tz.UTC).replace(second=30)
+        database.storeMeasurements(
+            [
+                Database.Measurement(stationid, 10, 40, now),
+                Database.Measurement(stationid, 20, 60, now.replace(second=31)),
+            ]
+        )
+        database.compactRollups(now.replace(second=0))
+        database.compactRollups(now.replace(second=0))  # idempotent
+        for resolution in ("minute", "hour", "day"):
+            r = database.retrieveMeasurements(
+                stationid, now.replace(second=0), resolution=resolution
+            )
+            assert len(r) == 1
+            m = r[0]
+            assert m["count"] == 2
+            assert m["temperature"] == approx(15)
+            assert m["temperature_min"] == approx(10)
+            assert m["temperature_max"] == approx(20)
+            assert m["humidity"] == approx(50)
+        # a compaction from a given time does not complete the rollups before it
+        database.rolledup = None
+        r = database.retrieveMeasurements(
+            stationid, now - timedelta(days=3), resolution="auto", points=1
+        )
+        assert len(r) == 2
+        assert "count" not in r[0]
+        database.compactRollups()
+        assert database.rolledup is not None
+        r = database.retrieveMeasurements(
+            stationid, now - timedelta(days=3), resolution="auto", points=1
+        )
+        assert len(r) == 1
+        assert r[0]["count"] == 2
+
+    def test_partitions(self, database):
+        assert database.maintainPartitions(ahead=2) == []
+        end = datetime.now(tz=tz.UTC)
+        used = database.partitionsUsed("*", end - timedelta(days=1), end)
+        assert 1 <= len(used) <= 2
+        assert "pfuture" not in used
+        database.storeMeasurement(Database.Measurement("partition-100001", 10, 40))
+        r = database.retrieveLastMeasurement("partition-100001")
+        assert len(r) == 1
@@ -0,0 +1,34 @@
+import math
+
+import pytest
+
+from htcollector import Downsample
+from htcollector.Downsample import lttb
+
+
+def series(n):
+    x = [float(i) for i in range(n)]
+    y = [math.sin(i / 50) for i in range(n)]
+    y[n // 3] = 10.0  # a spike that averaging would smooth away
+    return x, y
+
+
+class TestDownsample:
+    def test_lttb(self):
+        x, y = series(1000)
+        selected = lttb(x, y, 50)
+        assert len(selected) == 50
+        assert selected[0] == 0 and selected[-1] == 999
+        assert selected == sorted(set(selected))
+        assert 1000 // 3 in selected
+
+    def test_short(self):
+        assert lttb([1, 2, 3], [1, 2, 3], 10) == [0, 1, 2]
+        assert lttb([], [], 3) == []
+        with pytest.raises(ValueError):
+            lttb([1, 2, 3], [1, 2, 3], 2)
+
+    def test_numpy(self):
+        pytest.importorskip("numpy")
+        x, y = series(5000)
+        assert Downsample._lttb_numpy(x, y, 100) == Downsample._lttb(x, y, 100)
@@ -0,0 +1,77 @@
+import ast
+import math
+import struct
+
+from htcollector.Export import MAGIC, binaryChunks, csvChunks, npyChunks, npyHeader
+
+
+def chunks(n, start=0):
+    # columnar chunks of n measurements, like iterMeasurements(columns=True)
+    return {
+        "t": list(range(start, start + n)),
+        "stationid": ["abc"] * n,
+        "temperature": [20.5] * n,
+        "humidity": [50.0] * n,
+    }
+
+
+class Closable:
+    def __init__(self, items):
+        self.items = iter(items)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.items)
+
+    def close(self):
+        self.closed = True
+
+
+def parseNpy(data):
+    assert data[:8] == b"\x93NUMPY\x01\x00"
+    length = struct.unpack("<H", data[8:10])[0]
+    assert (10 + length) % 64 == 0
+    header = ast.literal_eval(data[10 : 10 + length].decode())
+    return header, list(struct.iter_unpack("<qff", data[10 + length :]))
+
+
+class TestExport:
+    def test_csv(self):
+        data = b"".join(csvChunks([chunks(2), chunks(1, 2)]))
+        assert data.decode().splitlines() == [
+            "timestamp,stationid,temperature,humidity",
+            "0,abc,20.5,50.0",
+            "1,abc,20.5,50.0",
+            "2,abc,20.5,50.0",
+        ]
+        # the header is there even without measurements
+        assert b"".join(csvChunks([])) == b"timestamp,stationid,temperature,humidity\n"
+
+    def test_binary(self):
+        data = b"".join(binaryChunks([chunks(2), chunks(0)], "abc"))
+        assert data[:8] == MAGIC + b"\x03abc"
+        assert struct.unpack("<I2q2f2f", data[8:44]) == (2, 0, 1, 20.5, 20.5, 50, 50)
+        assert data[44:] == struct.pack("<I", 0)
+
+    def test_npy(self):
+        header, records = parseNpy(b"".join(npyChunks([chunks(2), chunks(2, 2)], 4)))
+        assert header["shape"] == (4,)
+        assert header["fortran_order"] is False
+        assert [r[0] for r in records] == [0, 1, 2, 3]
+        # rows beyond the count are dropped and missing rows are padded
+        header, records = parseNpy(b"".join(npyChunks([chunks(3)], 2)))
+        assert len(records) == 2
+        header, records = parseNpy(b"".join(npyChunks([chunks(1)], 3)))
+        assert len(records) == 3
+        assert math.isnan(records[2][1])
+        assert len(npyHeader(10**12)) % 64 == 0
+
+    def test_close(self):
+        source = Closable([chunks(1), chunks(1)])
+        stream = npyChunks(source, 2)
+        next(stream)
+        stream.close()
+        assert source.closed
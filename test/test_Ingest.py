@@ -0,0 +1,75 @@
+from time import sleep
+from types import SimpleNamespace
+
+import pytest
+
+from htcollector.Ingest import IngestBuffer
+
+
+class FakeDatabase:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def storeMeasurements(self, measurements):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.batches.append(list(measurements))
+        return len(measurements)
+
+
+def measurement(stationid="test-123456"):
+    return SimpleNamespace(stationid=stationid, temperature=20.0, humidity=50.0)
+
+
+class TestIngestBuffer:
+    def test_flush_on_size(self):
+        db = FakeDatabase()
+        buffer = IngestBuffer(db, maxsize=3, maxage=60)
+        for _ in range(3):
+            assert buffer.storeMeasurement(measurement()) == 1
+        sleep(0.2)
+        assert [len(b) for b in db.batches] == [3]
+        assert buffer.depth == 0
+        assert all(m.timestamp is not None for m in db.batches[0])
+        buffer.close()
+
+    def test_flush_on_age(self):
+        db = FakeDatabase()
+        buffer = IngestBuffer(db, maxsize=100, maxage=0.1)
+        buffer.storeMeasurement(measurement())
+        assert buffer.depth == 1
+        sleep(0.5)
+        assert [len(b) for b in db.batches] == [1]
+        stats = buffer.stats()
+        assert stats["flushes"] == 1
+        assert stats["flushed"] == 1
+        assert stats["lastflushlatency"] >= 0
+        buffer.close()
+
+    def test_flush_on_close(self):
+        db = FakeDatabase()
+        buffer = IngestBuffer(db, maxsize=100, maxage=60)
+        buffer.storeMeasurement(measurement())
+        buffer.storeMeasurement(measurement())
+        buffer.close()
+        assert [len(b) for b in db.batches] == [2]
+        with pytest.raises(RuntimeError):
+            buffer.storeMeasurement(measurement())
+
+    def test_requeue_on_failure(self):
+        db = FakeDatabase(fail=True)
+        buffer = IngestBuffer(db, maxsize=100, maxage=60)
+        buffer.storeMeasurement(measurement())
+        assert buffer.flush() == 0
+        assert buffer.depth == 1
+        assert buffer.stats()["failures"] == 1
+        db.fail = False
+        buffer.close()
+        assert [len(b) for b in db.batches] == [1]
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            IngestBuffer(FakeDatabase(), maxsize=0)
+        with pytest.raises(ValueError):
+            IngestBuffer(FakeDatabase(), maxage=0)
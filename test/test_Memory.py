@@ -0,0 +1,56 @@
+import gc
+import tracemalloc
+from time import sleep
+
+import pytest
+
+from htcollector.Memory import GCMonitor, MemoryManager
+
+
+class TestGCMonitor:
+    def test_pauses(self):
+        monitor = GCMonitor()
+        gc.collect()
+        monitor.close()
+        stats = monitor.stats()
+        assert stats["collections"][2] >= 1
+        assert stats["pausetime"][2] > 0
+        assert stats["maxpause"] > 0
+        assert monitor._callback not in gc.callbacks
+
+
+class TestMemoryManager:
+    def test_threshold(self):
+        previous = gc.get_threshold()
+        manager = MemoryManager("threshold", thresholds=(5000, 20, 20))
+        assert gc.get_threshold() == (5000, 20, 20)
+        manager.close()
+        assert gc.get_threshold() == previous
+
+    def test_freeze(self):
+        manager = MemoryManager("freeze")
+        assert gc.get_freeze_count() > 0
+        manager.close()
+        assert gc.get_freeze_count() == 0
+
+    def test_periodic(self):
+        manager = MemoryManager("periodic", interval=0.05)
+        sleep(0.3)
+        manager.close()
+        assert manager.monitor.stats()["collections"][2] >= 2
+
+    def test_trace(self):
+        manager = MemoryManager(trace=True, top=3)
+        leak = [bytearray(1000) for _ in range(1000)]
+        growth = manager.growth()
+        manager.report()
+        manager.close()
+        assert not tracemalloc.is_tracing()
+        assert 0 < len(growth) <= 3
+        assert growth[0].size_diff >= 1000000
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            MemoryManager("sometimes")
+        with pytest.raises(ValueError):
+            MemoryManager("threshold")
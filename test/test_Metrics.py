@@ -0,0 +1,74 @@
+import threading
+
+from htcollector.Metrics import Registry, processCollector, statsCollector
+
+
+class TestMetrics:
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter("requests_total", "Requests.", ("route",))
+        threads = [
+            threading.Thread(target=lambda: [counter.inc("/json") for _ in range(1000)])
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counter.inc("/all", amount=2)
+        assert registry.values() == {
+            ("requests_total", ("/json",)): 8000,
+            ("requests_total", ("/all",)): 2,
+        }
+        # the shards of the finished threads have been folded
+        assert len(registry.shards) == 1
+        text = registry.render()
+        assert "# TYPE requests_total counter" in text
+        assert 'requests_total{route="/json"} 8000' in text
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram("duration_seconds", "D.", ("m",), (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value, "x")
+        lines = registry.render().splitlines()
+        assert 'duration_seconds_bucket{m="x",le="0.1"} 2' in lines
+        assert 'duration_seconds_bucket{m="x",le="1.0"} 3' in lines
+        assert 'duration_seconds_bucket{m="x",le="+Inf"} 4' in lines
+        assert 'duration_seconds_sum{m="x"} 5.65' in lines
+        assert 'duration_seconds_count{m="x"} 4' in lines
+
+    def test_timed(self):
+        registry = Registry()
+        histogram = registry.histogram("method_seconds", "M.", ("method",))
+
+        @histogram.timed()
+        def query():
+            return 42
+
+        @histogram.timed()
+        def rows():
+            yield 1
+            yield 2
+
+        assert query() == 42
+        stream = rows()
+        assert next(stream) == 1
+        stream.close()
+        assert list(rows()) == [1, 2]
+        values = registry.values()
+        assert values["method_seconds", ("query",)][-1] >= 0
+        assert sum(values["method_seconds", ("rows",)][:-1]) == 2
+
+    def test_collectors(self):
+        registry = Registry()
+        registry.addCollector(processCollector)
+        stats = statsCollector(
+            "cache", lambda: {"hits": 3, "pause": [0.5, 1.0], "name": "x"}, "Cache"
+        )
+        text = registry.render([stats])
+        assert "cache_hits 3" in text
+        assert 'cache_pause{generation="1"} 1.0' in text
+        assert "cache_name" not in text
+        assert "process_cpu_seconds_total" in text
+        assert 'python_gc_collections_total{generation="0"}' in text
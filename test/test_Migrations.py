@@ -0,0 +1,117 @@
+import pytest
+
+from htcollector.Migrations import Migration, MIGRATIONS, migrate
+from htcollector.Query import QueryCursor, QueryLog
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = None
+        self.description = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement, params=()):
+        self.db.statements.append(statement)
+        if statement.startswith("SELECT GET_LOCK"):
+            self.result = (1,)
+        elif statement.startswith("SELECT RELEASE_LOCK"):
+            self.result = (1,)
+        elif statement.startswith("SELECT COALESCE(MAX(Version), 0)"):
+            self.result = (max(self.db.versions, default=0),)
+        elif statement.startswith("INSERT INTO SchemaVersion"):
+            self.db.versions.append(params[0])
+        elif statement.startswith("FAIL"):
+            raise RuntimeError("statement failed")
+
+    def fetchone(self):
+        return self.result
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, versions=()):
+        self.versions = list(versions)
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class TestMigrations:
+    def test_versions_ordered_and_unique(self):
+        versions = [m.version for m in MIGRATIONS]
+        assert versions == sorted(set(versions))
+        assert versions[0] == 1
+
+    def test_composite_index(self):
+        assert any(
+            "Measurements(Stationid, Timestamp)" in step for step in MIGRATIONS[0].steps
+        )
+
+    def test_drop_prefix_index(self):
+        steps = [step for m in MIGRATIONS for step in m.steps]
+        drop = steps.index("DROP INDEX IF EXISTS si ON Measurements")
+        assert drop > steps.index(
+            "CREATE INDEX IF NOT EXISTS stationtime ON Measurements(Stationid, Timestamp)"
+        )
+        assert not any("DROP INDEX IF EXISTS ts" in step for step in steps)
+
+    def test_migrate_in_order(self):
+        applied = []
+        migrations = [
+            Migration(2, "second", [lambda cursor: applied.append(2)]),
+            Migration(1, "first", [lambda cursor: applied.append(1), "SELECT 1"]),
+        ]
+        connection = FakeConnection()
+        assert migrate(connection.cursor(), migrations) == 2
+        assert applied == [1, 2]
+        assert connection.versions == [1, 2]
+        assert connection.commits == 2
+        assert "SELECT 1" in connection.statements
+
+    def test_migrate_skips_applied(self):
+        applied = []
+        migrations = [
+            Migration(1, "first", [lambda cursor: applied.append(1)]),
+            Migration(2, "second", [lambda cursor: applied.append(2)]),
+        ]
+        connection = FakeConnection(versions=[1])
+        assert migrate(connection.cursor(), migrations) == 2
+        assert applied == [2]
+        assert migrate(connection.cursor(), migrations) == 2
+        assert applied == [2]
+
+    def test_migrate_releases_lock_on_failure(self):
+        connection = FakeConnection()
+        with pytest.raises(RuntimeError):
+            migrate(connection.cursor(), [Migration(1, "broken", ["FAIL"])])
+        assert connection.versions == []
+        assert connection.statements[-1].startswith("SELECT RELEASE_LOCK")
+
+    def test_migrate_logged(self):
+        log = QueryLog()
+        records = []
+        log.addHook(records.append)
+        connection = FakeConnection()
+        with QueryCursor(connection, connection.cursor(), log) as cursor:
+            migrate(cursor, [Migration(1, "first", ["SELECT 1"])])
+        assert connection.commits == 1
+        statements = [record["statement"] for record in records]
+        assert "SELECT 1" in statements
+        assert statements[-1].startswith("SELECT RELEASE_LOCK")
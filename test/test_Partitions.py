@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from htcollector import Partitions
+
+
+class FakeCursor:
+    def __init__(self, partitions=(), first=None):
+        self.partitions = list(partitions)
+        self.first = first
+        self.statements = []
+        self.result = []
+
+    def execute(self, statement, params=()):
+        self.statements.append(" ".join(statement.split()))
+        if "information_schema.PARTITIONS" in statement:
+            self.result = [(p,) for p in self.partitions]
+        elif statement.startswith("SELECT MIN(Timestamp)"):
+            self.result = [(self.first,)]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+class TestPartitions:
+    def test_addMonths(self):
+        assert Partitions.addMonths(2026, 10, 3) == (2027, 1)
+        assert Partitions.addMonths(2026, 1, -1) == (2025, 12)
+        assert Partitions.addMonths(2026, 12, 0) == (2026, 12)
+
+    def test_partitionDefinition(self):
+        assert (
+            Partitions.partitionDefinition(2026, 12)
+            == "PARTITION p202612 VALUES LESS THAN ('2027-01-01')"
+        )
+        assert Partitions.partitionMonth("p202612") == (2026, 12)
+        assert Partitions.partitionMonth("pfuture") is None
+
+    def test_partition(self):
+        cursor = FakeCursor(first=datetime(2026, 8, 14))
+        assert Partitions.partition(cursor, datetime(2026, 10, 17), ahead=1)
+        alter = cursor.statements[-1]
+        assert alter.startswith(
+            "ALTER TABLE Measurements PARTITION BY RANGE COLUMNS(Timestamp)"
+        )
+        for name in ("p202608", "p202609", "p202610", "p202611", "pfuture"):
+            assert f"PARTITION {name} " in alter
+        assert "p202612" not in alter
+
+    def test_partition_already_partitioned(self):
+        cursor = FakeCursor(partitions=["p202610", "pfuture"])
+        assert not Partitions.partition(cursor, datetime(2026, 10, 17))
+        assert not any(s.startswith("ALTER") for s in cursor.statements)
+
+    def test_createFuturePartitions(self):
+        cursor = FakeCursor(partitions=["p202609", "p202610", "pfuture"])
+        created = Partitions.createFuturePartitions(
+            cursor, datetime(2026, 10, 17), ahead=2
+        )
+        assert created == ["p202611", "p202612"]
+        assert cursor.statements[-1].startswith(
+            "ALTER TABLE Measurements REORGANIZE PARTITION pfuture INTO"
+        )
+        cursor = FakeCursor(partitions=["p202612", "pfuture"])
+        assert (
+            Partitions.createFuturePartitions(cursor, datetime(2026, 10, 17), ahead=2)
+            == []
+        )
+
+    def test_applyRetention(self):
+        cursor = FakeCursor(partitions=["p202607", "p202608", "p202609", "pfuture"])
+        removed = Partitions.applyRetention(cursor, datetime(2026, 10, 17), keep=2)
+        assert removed == ["p202607"]
+        assert (
+            cursor.statements[-1] == "ALTER TABLE Measurements DROP PARTITION p202607"
+        )
+
+    def test_applyRetention_archive(self):
+        cursor = FakeCursor(partitions=["p202607", "p202608", "pfuture"])
+        Partitions.applyRetention(cursor, datetime(2026, 10, 17), keep=2, archive=True)
+        assert (
+            "ALTER TABLE Measurements EXCHANGE PARTITION p202607 WITH TABLE MeasurementsArchive202607"
+            in cursor.statements
+        )
+        assert (
+            cursor.statements[-1] == "ALTER TABLE Measurements DROP PARTITION p202607"
+        )
@@ -0,0 +1,146 @@
+import threading
+from time import sleep
+
+import pytest
+
+from htcollector.Pool import ConnectionPool, PoolExhausted
+
+
+class FakeConnection:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.pings = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def ping(self):
+        self.pings += 1
+        if self.broken:
+            raise ConnectionError("server has gone away")
+
+    def rollback(self):
+        if self.broken:
+            raise ConnectionError("server has gone away")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class Connector:
+    def __init__(self):
+        self.connections = []
+
+    def __call__(self):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+class TestConnectionPool:
+    def test_prewarm(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, size=4, prewarm=2)
+        assert len(connect.connections) == 2
+        stats = pool.stats()
+        assert (stats["open"], stats["idle"], stats["borrowed"]) == (2, 2, 0)
+
+    def test_grow_and_reuse(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, size=2, prewarm=0)
+        with pool.connection() as a:
+            with pool.connection() as b:
+                assert a is not b
+                assert pool.stats()["borrowed"] == 2
+        assert a.rollbacks == 1 and b.rollbacks == 1
+        with pool.connection() as c:
+            assert c in (a, b)
+        assert len(connect.connections) == 2
+        assert pool.stats()["borrows"] == 3
+
+    def test_exhausted(self):
+        pool = ConnectionPool(Connector(), size=1, maxwait=0.05)
+        with pool.connection():
+            with pytest.raises(PoolExhausted):
+                pool.borrow()
+        stats = pool.stats()
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 1
+        # the connection is available again
+        with pool.connection():
+            pass
+
+    def test_wait(self):
+        pool = ConnectionPool(Connector(), size=1, maxwait=5)
+        connection = pool.borrow()
+        threading.Timer(0.1, pool.release, (connection,)).start()
+        assert pool.borrow() is connection
+        stats = pool.stats()
+        assert stats["waits"] == 1
+        assert stats["timeouts"] == 0
+        assert 0.05 < stats["maxwaittime"] < 5
+
+    def test_validate(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, size=2, prewarm=1, validate="always")
+        connect.connections[0].broken = True
+        with pool.connection() as connection:
+            assert connection is connect.connections[1]
+            assert connection.pings == 0  # a new connection is not validated
+        assert connect.connections[0].closed
+        with pool.connection() as connection:
+            assert connection.pings == 1
+        stats = pool.stats()
+        assert stats["validationfailures"] == 1
+        assert stats["discarded"] == 1
+        assert stats["open"] == 1
+
+    def test_validate_idle(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, validate="idle", idletime=0.05)
+        with pool.connection() as connection:
+            pass
+        with pool.connection() as connection:
+            assert connection.pings == 0
+        sleep(0.1)
+        with pool.connection() as connection:
+            assert connection.pings == 1
+
+    def test_broken_on_release(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, size=1)
+        with pool.connection() as connection:
+            connection.broken = True
+        assert connection.closed
+        assert pool.stats()["open"] == 0
+        with pool.connection() as connection:
+            assert connection is connect.connections[1]
+
+    def test_connect_fails(self):
+        def connect():
+            raise ConnectionError("connection refused")
+
+        pool = ConnectionPool(connect, size=1, prewarm=0, maxwait=0.05)
+        with pytest.raises(ConnectionError):
+            pool.borrow()
+        # the reserved slot is given back
+        assert pool.stats()["open"] == 0
+
+    def test_close(self):
+        connect = Connector()
+        pool = ConnectionPool(connect, size=2, prewarm=2)
+        connection = pool.borrow()
+        pool.close()
+        pool.release(connection)
+        assert all(c.closed for c in connect.connections)
+        assert pool.stats()["open"] == 0
+
+    def test_names(self):
+        assert ConnectionPool(Connector()).name != ConnectionPool(Connector()).name
+        assert ConnectionPool(Connector(), name="ingest").name == "ingest"
+
+    def test_arguments(self):
+        with pytest.raises(ValueError):
+            ConnectionPool(Connector(), validate="sometimes")
+        with pytest.raises(ValueError):
+            ConnectionPool(Connector(), size=0)
@@ -0,0 +1,154 @@
+import logging
+
+import pytest
+
+from htcollector.Query import QueryCursor, QueryLog, condense, shape
+
+
+class FakeCursor:
+    def __init__(self, rows=(), rowcount=-1, fail=False):
+        self.rows = list(rows)
+        self.description = [("a",), ("b",)] if rows else None
+        self.rowcount = rowcount
+        self.fail = fail
+        self.closed = False
+
+    def execute(self, statement, parameters=()):
+        if self.fail:
+            raise RuntimeError("lost connection")
+
+    def executemany(self, statement, parameters):
+        pass
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+def cursor(log, **kwargs):
+    return QueryCursor(None, FakeCursor(**kwargs), log)
+
+
+class TestQuery:
+    def test_shape(self):
+        assert shape(()) == 0
+        assert shape(("a", 1, 2)) == 3
+        assert shape([("a", 1), ("b", 2), ("c", 3)], many=True) == (3, 2)
+        assert shape([], many=True) == (0, 0)
+
+    def test_condense(self):
+        assert (
+            condense("SELECT *\n    FROM  Measurements") == "SELECT * FROM Measurements"
+        )
+        assert len(condense("SELECT " + "x, " * 100, width=50)) == 50
+
+    def test_record(self):
+        log = QueryLog()
+        records = []
+        log.addHook(records.append)
+        with cursor(log, rows=[(1, 2), (3, 4), (5, 6)]) as c:
+            c.execute("SELECT a, b FROM t WHERE a > ?", (0,))
+            assert c.fetchone() == (1, 2)
+            assert c.fetchall() == [(3, 4), (5, 6)]
+            assert (
+                records == []
+            )  # reported when the next statement starts or the cursor closes
+        assert c.cursor.closed
+        assert len(records) == 1
+        assert records[0]["statement"] == "SELECT a, b FROM t WHERE a > ?"
+        assert records[0]["parameters"] == 1
+        assert records[0]["rows"] == 3
+        assert records[0]["elapsed"] >= 0
+        assert records[0]["error"] is None
+
+    def test_iterate(self):
+        log = QueryLog()
+        records = []
+        log.addHook(records.append)
+        with cursor(log, rows=[(i, i) for i in range(2500)]) as c:
+            c.execute("SELECT a, b FROM t")
+            assert sum(1 for _ in c) == 2500
+        assert records[0]["rows"] == 2500
+
+    def test_affected(self):
+        log = QueryLog()
+        records = []
+        log.addHook(records.append)
+        with cursor(log, rowcount=2) as c:
+            c.executemany("INSERT INTO t VALUES (?,?)", [(1, 2), (3, 4)])
+            c.execute("DELETE FROM t")
+        assert [(r["parameters"], r["rows"]) for r in records] == [((2, 2), 2), (0, 2)]
+
+    def test_error(self):
+        log = QueryLog()
+        records = []
+        log.addHook(records.append)
+        with pytest.raises(RuntimeError):
+            with cursor(log, fail=True) as c:
+                c.execute("SELECT 1")
+        assert records[0]["error"] == "RuntimeError"
+
+    def test_slow(self, caplog):
+        log = QueryLog(slowquery=0.5)
+        with caplog.at_level(logging.WARNING):
+            log.record(
+                {
+                    "statement": "SELECT *\n FROM Measurements",
+                    "parameters": 2,
+                    "rows": 10,
+                    "elapsed": 0.75,
+                    "error": None,
+                }
+            )
+            log.record(
+                {
+                    "statement": "SELECT 1",
+                    "parameters": 0,
+                    "rows": 1,
+                    "elapsed": 0.1,
+                    "error": None,
+                }
+            )
+        assert len(caplog.records) == 1
+        assert 'statement="SELECT * FROM Measurements"' in caplog.text
+        assert "elapsed=0.750s rows=10 parameters=2" in caplog.text
+        assert caplog.records[0].query["rows"] == 10
+
+    def test_slow_disabled(self, caplog):
+        log = QueryLog(slowquery=0)
+        with caplog.at_level(logging.WARNING):
+            log.record(
+                {
+                    "statement": "",
+                    "parameters": 0,
+                    "rows": 0,
+                    "elapsed": 9.0,
+                    "error": None,
+                }
+            )
+        assert caplog.records == []
+
+    def test_failing_hook(self):
+        log = QueryLog()
+        records = []
+
+        def fail(query):
+            raise ValueError("broken hook")
+
+        log.addHook(fail)
+        log.addHook(records.append)
+        with cursor(log) as c:
+            c.execute("SELECT 1")
+        assert len(records) == 1
+        log.removeHook(fail)
+        assert log.hooks == [records.append]
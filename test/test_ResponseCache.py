@@ -0,0 +1,78 @@
+from time import sleep
+
+from htcollector.ResponseCache import ResponseCache
+
+
+class Renderer:
+    def __init__(self, cacheable=True):
+        self.calls = 0
+        self.cacheable = cacheable
+
+    def __call__(self):
+        self.calls += 1
+        return f"response {self.calls}", self.cacheable
+
+
+class TestResponseCache:
+    def test_hit_miss(self):
+        cache = ResponseCache()
+        render = Renderer()
+        assert cache.get(("json", "a"), render) == "response 1"
+        assert cache.get(("json", "a"), render) == "response 1"
+        assert render.calls == 1
+        assert cache.stats() == {
+            "hits": 1,
+            "misses": 1,
+            "invalidations": 0,
+            "entries": 1,
+        }
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        a, b, everything = Renderer(), Renderer(), Renderer()
+        cache.get(("json", "a"), a)
+        cache.get(("json", "b"), b)
+        cache.get(("all", None), everything)
+        cache.invalidate(["a"])
+        cache.get(("json", "a"), a)
+        cache.get(("json", "b"), b)
+        cache.get(("all", None), everything)
+        assert (a.calls, b.calls, everything.calls) == (2, 1, 2)
+
+    def test_case_insensitive(self):
+        cache = ResponseCache()
+        render = Renderer()
+        assert cache.get(("json", "ShellyHT-AB12"), render) == "response 1"
+        assert cache.get(("json", "shellyht-ab12"), render) == "response 1"
+        cache.invalidate(["shellyht-AB12"])
+        assert cache.get(("json", "SHELLYHT-AB12"), render) == "response 2"
+
+    def test_invalidated_while_computing(self):
+        cache = ResponseCache()
+
+        def render():
+            cache.invalidate(["a"])  # a store that happens while rendering
+            return "stale", True
+
+        cache.get(("json", "a"), render)
+        assert cache.stats()["entries"] == 0
+
+    def test_ttl(self):
+        cache = ResponseCache(ttl=0.05)
+        render = Renderer()
+        cache.get(("json", "a"), render)
+        sleep(0.1)
+        assert cache.get(("json", "a"), render) == "response 2"
+
+    def test_not_cacheable(self):
+        cache = ResponseCache()
+        render = Renderer(cacheable=False)
+        cache.get(("json", "a"), render)
+        cache.get(("json", "a"), render)
+        assert render.calls == 2
+
+    def test_maxentries(self):
+        cache = ResponseCache(maxentries=2)
+        for s in "abc":
+            cache.get(("json", s), Renderer())
+        assert cache.stats()["entries"] == 1
@@ -0,0 +1,41 @@
+from time import sleep
+
+import pytest
+
+from htcollector.Rollup import RollupCompactor
+
+
+class FakeDatabase:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def compactRollups(self, since=None):
+        self.calls.append(since)
+        if self.fail:
+            raise ConnectionError("database unavailable")
+
+
+class TestRollupCompactor:
+    def test_resume_then_incremental(self):
+        db = FakeDatabase()
+        compactor = RollupCompactor(db, interval=0.1, lag=300)
+        sleep(0.35)
+        compactor.close()
+        assert len(db.calls) >= 2
+        assert db.calls[0] is None  # the first run resumes from the rollup tables
+        assert all(since is not None for since in db.calls[1:])
+        assert compactor.runs == len(db.calls)
+
+    def test_failure_does_not_advance(self):
+        db = FakeDatabase(fail=True)
+        compactor = RollupCompactor(db, interval=60)
+        sleep(0.1)
+        compactor.close()
+        assert db.calls == [None]
+        assert compactor.since is None
+        assert compactor.runs == 0
+
+    def test_invalid_interval(self):
+        with pytest.raises(ValueError):
+            RollupCompactor(FakeDatabase(), interval=0)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from pytest import approx
+
+from htcollector.Series import ROLLUP_FIELDS, Series
+from htcollector.Utils import formatTimestamp
+
+start = datetime(2023, 3, 26, 0, 30, 0, 123000)
+
+
+def rows(n):
+    return [
+        (start + timedelta(minutes=10 * i), "abc", 20.0 + i, 50.0) for i in range(n)
+    ]
+
+
+class TestSeries:
+    def test_fromRows(self):
+        series = Series.fromRows(rows(3))
+        assert len(series) == 3
+        assert series.t.tolist()[0] == formatTimestamp(start, "epochms")
+        assert series.values["temperature"].tolist() == approx([20, 21, 22])
+        assert len(Series.fromRows([])) == 0
+        assert Series.fromRows([]).rows() == []
+
+    def test_rows(self):
+        # across a daylight saving time transition in most of Europe
+        data = rows(30)
+        series = Series.fromRows(data)
+        assert [r["timestamp"] for r in series.rows("iso")] == [
+            formatTimestamp(r[0], "iso") for r in data
+        ]
+        local = series.rows()
+        assert [r["timestamp"].isoformat() for r in local] == [
+            formatTimestamp(r[0]).isoformat() for r in data
+        ]
+        assert list(local[0]) == ["timestamp", "stationid", "temperature", "humidity"]
+
+    def test_columns(self):
+        columns = Series.fromRows(rows(2)).columns()
+        assert columns["t"][1] - columns["t"][0] == 600000
+        assert columns["stationid"] == ["abc", "abc"]
+        assert columns["humidity"] == approx([50, 50])
+
+    def test_nulls(self):
+        row = (start, "abc", 20.0, None, 2, None, 21.0, None, None)
+        measurement = Series.fromRows([row], ROLLUP_FIELDS).rows()[0]
+        assert measurement["count"] == 2
+        assert measurement["temperature"] == approx(20)
+        assert measurement["temperature_min"] is None
+        assert measurement["humidity"] is None
+        assert measurement["temperature_max"] == approx(21)
+
+    def test_sorted_take(self):
+        series = Series.fromRows(rows(5)[::-1]).sorted()
+        assert series.values["temperature"].tolist() == approx([20, 21, 22, 23, 24])
+        assert series.sorted() is series
+        subset = series.take([0, 4])
+        assert [r["temperature"] for r in subset.rows()] == approx([20, 24])
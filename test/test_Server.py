@@ -1,3 +1,5 @@
+import gzip
+import zlib
 from time import sleep
 import pytest
 from fixtures import database
@@ -5,9 +7,16 @@ from fixtures import database
 from io import BytesIO as IO
 from unittest import mock
 from datetime import datetime, timedelta
+import json
+
+from dateutil import tz
+from dateutil.parser import isoparse
 import logging
 
-from htcollector.Server import InterceptorHandlerFactory
+from htcollector.Server import InterceptorApp, InterceptorHandlerFactory, Response
+from htcollector.Pool import PoolExhausted
+from htcollector.ResponseCache import ResponseCache
+from htcollector.Series import Series
 from htcollector.Database import MeasurementDatabase, Measurement
 
 logging.basicConfig(format="%(asctime)s %(message)s", level="INFO")
@@ -26,6 +35,9 @@ class MockRequest(object):
     def __init__(self, path):
         self._path = path
 
+    def settimeout(self, timeout):
+        pass
+
     def makefile(self, *args, **kwargs):
         if args[0] == "rb":
             return IO(b"GET %s HTTP/1.0" % self._path)
@@ -42,6 +54,9 @@ class MockPOSTRequest(object):
         self._path = path
         self._body = body
 
+    def settimeout(self, timeout):
+        pass
+
     def makefile(self, *args, **kwargs):
         if args[0] == "rb":
             return IO(b"POST %s HTTP/1.0\r\n\r\n%s" % (self._path, self._body))
@@ -51,6 +66,30 @@ class MockPOSTRequest(object):
             raise ValueError("Unknown file type to make", args, kwargs)
 
 
+class MockRawRequest(MockRequest):
+    """one or more complete requests, sent over the same connection"""
+
+    def makefile(self, *args, **kwargs):
+        if args[0] == "rb":
+            return IO(self._path)
+        return super().makefile(*args, **kwargs)
+
+
+class SocketIO(IO):
+    """reading until the end of a persistent connection would block"""
+
+    def read(self, size=-1):
+        assert size is not None and size >= 0, "read until the client disconnects"
+        return super().read(size)
+
+
+class MockSocketRequest(MockRequest):
+    def makefile(self, *args, **kwargs):
+        if args[0] == "rb":
+            return SocketIO(self._path)
+        return super().makefile(*args, **kwargs)
+
+
 def finish(self):
     # Do not close self.wfile, so we can read its value
     self.wfile.flush()
@@ -92,7 +131,7 @@ class TestInterceptor:
                         print(captured.out)
                         assert (
                             ihinstance.wfile.getvalue()
-                            == b"HTTP/1.0 200 OK\r\nDate: DATETIME\r\n\r\n"
+                            == b"HTTP/1.1 200 OK\r\nDate: DATETIME\r\nContent-Length: 0\r\n\r\n"
                         )
                         database.names(
                             stationid, "testroom1"
@@ -125,7 +164,10 @@ class TestInterceptor:
                         print(captured.out)
                         response = ihinstance.wfile.getvalue()
                         print(response)
-                        assert response == b"HTTP/1.0 403 Forbidden\r\n\r\n"
+                        assert (
+                            response
+                            == b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n"
+                        )
                         database.names(
                             stationid, "testroom1"
                         )  # without a stationid mapping we never get anything back
@@ -159,7 +201,10 @@ class TestInterceptor:
                         print(captured.out)
                         response = ihinstance.wfile.getvalue()
                         print(response)
-                        assert response == b"HTTP/1.0 500 Internal Server Error\r\n\r\n"
+                        assert (
+                            response
+                            == b"HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n\r\n"
+                        )
                         database.names(
                             stationid, "testroom1"
                         )  # without a stationid mapping we never get anything back
@@ -191,7 +236,7 @@ class TestInterceptor:
                         )
                         captured = capsys.readouterr()
                         print(captured.out)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_GET_HTML_fail(self, database, capsys):
         stationid = "htmlid-666666"
@@ -221,7 +266,7 @@ class TestInterceptor:
                         print(captured.out)
                         assert (
                             ihinstance.wfile.getvalue()[:22]
-                            == b"HTTP/1.0 403 Forbidden"
+                            == b"HTTP/1.1 403 Forbidden"
                         )
 
     def test_GET_JSON_all(self, database, capsys):
@@ -248,7 +293,7 @@ class TestInterceptor:
                         )
                         captured = capsys.readouterr()
                         print(captured.out)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_GET_JSON_specific(self, database, capsys):
         stationid = "jsonid-333333"
@@ -276,7 +321,7 @@ class TestInterceptor:
                         )
                         captured = capsys.readouterr()
                         print(captured.out)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_GET_JSON24_specific(self, database, capsys):
         stationid = "jsonid-242424"
@@ -306,7 +351,7 @@ class TestInterceptor:
                         )
                         captured = capsys.readouterr()
                         print(captured.out)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_GET_JSON_fail(self, database, capsys):
         stationid = "jsonid-666"
@@ -336,7 +381,7 @@ class TestInterceptor:
                         print(captured.out)
                         assert (
                             ihinstance.wfile.getvalue()[:22]
-                            == b"HTTP/1.0 403 Forbidden"
+                            == b"HTTP/1.1 403 Forbidden"
                         )
 
     def test_POST_NAME(self, database, capsys):
@@ -364,7 +409,7 @@ class TestInterceptor:
                         captured = capsys.readouterr()
                         print(captured.out)
                         print(captured.err)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
         interceptorhandler = InterceptorHandlerFactory.getHandler(database, "./static")
         with mock.patch.object(interceptorhandler, "finish", finish):
@@ -382,7 +427,7 @@ class TestInterceptor:
                         )
                         captured = capsys.readouterr()
                         print(captured.out)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_POST_NAME_fail_extra(self, database, capsys):
         stationid = "newname-123456"
@@ -411,7 +456,7 @@ class TestInterceptor:
                         print(captured.err)
                         assert (
                             ihinstance.wfile.getvalue()[:24]
-                            == b"HTTP/1.0 400 Bad Request"
+                            == b"HTTP/1.1 400 Bad Request"
                         )
 
     def test_POST_NAME_fail_missing(self, database, capsys):
@@ -441,7 +486,7 @@ class TestInterceptor:
                         print(captured.err)
                         assert (
                             ihinstance.wfile.getvalue()[:24]
-                            == b"HTTP/1.0 400 Bad Request"
+                            == b"HTTP/1.1 400 Bad Request"
                         )
 
     def test_GET_STATIC_fail(self, database, capsys):
@@ -464,7 +509,7 @@ class TestInterceptor:
                         print(captured.err)
                         assert (
                             ihinstance.wfile.getvalue()[:22]
-                            == b"HTTP/1.0 404 Not Found"
+                            == b"HTTP/1.1 404 Not Found"
                         )
 
     def test_GET_STATIC_fail_relative(self, database, capsys):
@@ -487,7 +532,7 @@ class TestInterceptor:
                         print(captured.err)
                         assert (
                             ihinstance.wfile.getvalue()[:22]
-                            == b"HTTP/1.0 403 Forbidden"
+                            == b"HTTP/1.1 403 Forbidden"
                         )
 
     def test_GET_STATIC_stylesheet(self, database, capsys):
@@ -508,7 +553,7 @@ class TestInterceptor:
                         captured = capsys.readouterr()
                         print(captured.out)
                         print(captured.err)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
 
     def test_GET_STATIC_favicon(self, database, capsys):
         interceptorhandler = InterceptorHandlerFactory.getHandler(database, "./static")
@@ -528,4 +573,470 @@ class TestInterceptor:
                         captured = capsys.readouterr()
                         print(captured.out)
                         print(captured.err)
-                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.0 200 OK"
+                        assert ihinstance.wfile.getvalue()[:15] == b"HTTP/1.1 200 OK"
+
+    def test_keepalive(self, capsys):
+        interceptorhandler = InterceptorHandlerFactory.getHandler(None, "./static")
+
+        with mock.patch.object(interceptorhandler, "finish", finish):
+            with mock.patch.object(
+                interceptorhandler, "date_time_string", date_time_string
+            ):
+                with mock.patch.object(interceptorhandler, "wbufsize", lambda: 1):
+                    request = MockRawRequest(
+                        b"GET /favicon.ico HTTP/1.1\r\nHost: x\r\n\r\n"
+                        b"GET /static/unknown.resource HTTP/1.1\r\nHost: x\r\n\r\n"
+                        b"GET /html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+                    )
+                    ihinstance = interceptorhandler(
+                        request, ("127.0.0.1", 12345), "testserver.example.org"
+                    )
+                    response = ihinstance.wfile.getvalue()
+                    # all three pipelined requests are answered on one connection
+                    assert response.startswith(b"HTTP/1.1 200 OK")
+                    assert (
+                        b"HTTP/1.1 404 Not Found\r\nDate: DATETIME\r\nContent-Length: 0\r\n\r\n"
+                        in response
+                    )
+                    assert response.endswith(
+                        b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n"
+                    )
+
+    def test_keepalive_maxrequests(self, capsys):
+        interceptorhandler = InterceptorHandlerFactory.getHandler(
+            None, "./static", maxrequests=2
+        )
+
+        with mock.patch.object(interceptorhandler, "finish", finish):
+            with mock.patch.object(
+                interceptorhandler, "date_time_string", date_time_string
+            ):
+                with mock.patch.object(interceptorhandler, "wbufsize", lambda: 1):
+                    request = MockRawRequest(
+                        b"GET /html HTTP/1.1\r\nHost: x\r\n\r\n" * 3
+                    )
+                    ihinstance = interceptorhandler(
+                        request, ("127.0.0.1", 12345), "testserver.example.org"
+                    )
+                    response = ihinstance.wfile.getvalue()
+                    assert response.count(b"HTTP/1.1 403 Forbidden") == 2
+                    assert response.endswith(b"Connection: close\r\n\r\n")
+
+    @pytest.mark.parametrize("length", [b"-1", b"abc"])
+    def test_POST_bad_length(self, capsys, length):
+        interceptorhandler = InterceptorHandlerFactory.getHandler(None, "./static")
+
+        with mock.patch.object(interceptorhandler, "finish", finish):
+            with mock.patch.object(
+                interceptorhandler, "date_time_string", date_time_string
+            ):
+                with mock.patch.object(interceptorhandler, "wbufsize", lambda: 1):
+                    request = MockSocketRequest(
+                        b"POST /name HTTP/1.1\r\nHost: x\r\nContent-Length: %s\r\n\r\n"
+                        b"GET /html HTTP/1.1\r\nHost: x\r\n\r\n" % length
+                    )
+                    ihinstance = interceptorhandler(
+                        request, ("127.0.0.1", 12345), "testserver.example.org"
+                    )
+                    response = ihinstance.wfile.getvalue()
+                    # the connection is closed after the 400
+                    assert response.startswith(b"HTTP/1.1 400 Bad Request")
+                    assert b"403" not in response
+
+
+class TestRouter:
+    def test_route(self):
+        app = InterceptorApp(None, "./static")
+        assert app.route("GET", "/sensorlog?hum=1&temp=2&id=x") == (
+            app.sensorlogRoute,
+            "hum=1&temp=2&id=x",
+        )
+        assert app.route("GET", "/JSON/24?id=x") == (app.jsonRoute, "id=x")
+        assert app.route("GET", "/static/css/stylesheet.css")[0] == app.staticRoute
+        assert app.route("GET", "/")[0] == app.staticRoute
+        assert app.route("POST", "/name")[0] == app.updatenameRoute
+        # no query string allowed, unknown paths and methods
+        assert app.route("GET", "/all?x=1") is None
+        assert app.route("GET", "/html") is None
+        assert app.route("GET", "/staticfile") is None
+        assert app.route("POST", "/sensorlog?hum=1&temp=2&id=x") is None
+
+    def test_addRoute(self):
+        app = InterceptorApp(None, "./static")
+        app.addRoute("GET", "/api/", lambda *args: Response(200), prefix=True)
+        assert app.handle("GET", "/api/anything", {}).status == 200
+        with pytest.raises(ValueError):
+            app.addRoute("GET", "/api", None, prefix=True)
+        with pytest.raises(ValueError):
+            app.addRoute("GET", "/api/v1/", None, prefix=True)
+
+    def test_static_outside(self):
+        app = InterceptorApp(None, "./static")
+        for path in ("/static//etc/passwd", "/static//etc/"):
+            assert app.handle("GET", path, {}).status == 403
+        assert app.handle("GET", "/static/css/stylesheet.css", {}).status == 200
+        # a cached file is not resolved again
+        with mock.patch.object(
+            app.static, "contains", side_effect=AssertionError("resolved")
+        ):
+            assert app.handle("GET", "/static/css/stylesheet.css", {}).status == 200
+
+    def test_pool_exhausted(self):
+        class BusyDatabase:
+            def names(self, stationid, name=None):
+                raise PoolExhausted("pool-1: all 5 connections in use for 5.0s")
+
+        app = InterceptorApp(BusyDatabase(), "./static")
+        response = app.handle("GET", "/names", {})
+        assert response.status == 503
+        assert ("Retry-After", "1") in response.headers
+
+    def test_static_conditional(self):
+        app = InterceptorApp(None, "./static")
+        response = app.handle(
+            "GET", "/static/css/stylesheet.css", {"Accept-Encoding": "gzip"}
+        )
+        assert response.status == 200
+        headers = dict(response.headers)
+        assert headers["Content-Encoding"] == "gzip"
+        response = app.handle(
+            "GET", "/static/css/stylesheet.css", {"If-None-Match": headers["ETag"]}
+        )
+        assert response.status == 304
+        assert response.body is None
+        response = app.handle(
+            "GET",
+            "/favicon.ico",
+            {"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"},
+        )
+        assert response.status == 200
+
+    def test_cached(self):
+        class CountingDatabase:
+            calls = 0
+
+            def retrieveLastMeasurement(self, stationid=None):
+                self.calls += 1
+                return []
+
+        db = CountingDatabase()
+        cache = ResponseCache()
+        app = InterceptorApp(db, "./static", cache=cache)
+        for _ in range(3):
+            assert app.handle("GET", "/json?id=abc", {}).status == 200
+        assert db.calls == 1
+        cache.invalidate(["abc"])
+        app.handle("GET", "/json?id=abc", {})
+        assert db.calls == 2
+        assert cache.stats()["hits"] == 2
+
+    def test_compression(self):
+        class Database:
+            def retrieveLastMeasurement(self, stationid=None):
+                return [
+                    {"stationid": f"station-{i}", "temperature": 20} for i in range(100)
+                ]
+
+        cache = ResponseCache()
+        app = InterceptorApp(Database(), "./static", cache=cache, compressmin=100)
+        plain = app.handle("GET", "/json", {})
+        assert ("Vary", "Accept-Encoding") in plain.headers
+        gzipped = app.handle("GET", "/json", {"Accept-Encoding": "gzip, deflate"})
+        assert ("Content-Encoding", "gzip") in gzipped.headers
+        assert gzip.decompress(gzipped.body) == plain.body
+        deflated = app.handle("GET", "/json", {"Accept-Encoding": "deflate"})
+        assert zlib.decompress(deflated.body) == plain.body
+        # the compressed form is kept with the cached response
+        again = app.handle("GET", "/json", {"Accept-Encoding": "gzip"})
+        assert again.body is gzipped.body
+        # small responses are sent as is
+        app = InterceptorApp(Database(), "./static", compressmin=100000)
+        response = app.handle("GET", "/json", {"Accept-Encoding": "gzip"})
+        assert response.body == plain.body
+
+    def test_json_columns(self):
+        class Database:
+            def retrieveTimeseries(
+                self,
+                stationids,
+                starttime,
+                endtime=None,
+                timeformat=None,
+                columns=False,
+            ):
+                self.args = (timeformat, columns)
+                return {
+                    s: {"stationid": s, "t": [0], "temperature": [20], "humidity": [50]}
+                    for s in stationids
+                }
+
+        db = Database()
+        cache = ResponseCache()
+        app = InterceptorApp(db, "./static", cache=cache)
+        response = app.handle("GET", "/json/24?id=abc&format=columns", {})
+        assert response.status == 200
+        assert json.loads(response.body) == {
+            "stationid": "abc",
+            "t": [0],
+            "temperature": [20],
+            "humidity": [50],
+        }
+        assert db.args == ("epochms", True)
+        # the rows and columns forms are cached separately
+        assert ("json/24/columns", "abc") in cache.entries
+        assert app.handle("GET", "/json/24?format=columns", {}).status == 200
+        assert app.handle("GET", "/json?format=columns", {}).status == 403
+        assert app.handle("GET", "/json/24?id=abc&format=csv", {}).status == 403
+
+    def test_json_range(self):
+        class Database:
+            def retrieveMeasurements(
+                self,
+                stationid,
+                starttime,
+                endtime=None,
+                resolution=None,
+                points=500,
+                asarrays=False,
+            ):
+                self.args = (
+                    stationid,
+                    starttime,
+                    endtime,
+                    resolution,
+                    points,
+                    asarrays,
+                )
+                t = datetime(2023, 2, 1)
+                return Series.fromRows(
+                    [
+                        (
+                            t + timedelta(minutes=i),
+                            stationid,
+                            30 if i == 500 else 20,
+                            50,
+                        )
+                        for i in reversed(range(1000))
+                    ]
+                )
+
+        db = Database()
+        app = InterceptorApp(db, "./static")
+        response = app.handle(
+            "GET", "/json?id=abc&from=2023-02-01T00:00:00Z&points=10", {}
+        )
+        assert response.status == 200
+        measurements = json.loads(response.body)
+        assert len(measurements) == 10
+        assert isoparse(measurements[0]["timestamp"]) == datetime(
+            2023, 2, 1, tzinfo=tz.UTC
+        )
+        assert 30 in [m["temperature"] for m in measurements]
+        assert db.args[3:] == ("auto", 10, True)
+        for query in (
+            "id=*&from=2023-02-01",
+            "id=abc&from=2023-02-01&points=2",
+            "id=abc&from=2023-02-01&points=ten",
+            "id=abc&from=2023-02-01&points=1000000",
+        ):
+            assert app.handle("GET", f"/json?{query}", {}).status == 403
+        assert app.handle("GET", "/json/24?id=abc&from=2023-02-01", {}).status == 403
+
+    def test_stats(self):
+        class Database:
+            ROLLUPS = {"hour": None}
+
+            def statistics(
+                self, stationids, starttime, endtime=None, bucket=None, timeformat=None
+            ):
+                self.args = (stationids, bucket, timeformat)
+                return [{"stationid": "abc", "count": 2}]
+
+        db = Database()
+        app = InterceptorApp(db, "./static")
+        response = app.handle("GET", "/stats?id=*&from=2023-02-01&bucket=hour", {})
+        assert response.status == 200
+        assert json.loads(response.body) == [{"stationid": "abc", "count": 2}]
+        assert db.args == (None, "hour", "iso")
+        app.handle("GET", "/stats?id=abc&from=2023-02-01", {})
+        assert db.args == (["abc"], None, "iso")
+        for query in ("id=abc", "id=abc&from=2023-02-01&bucket=week"):
+            assert app.handle("GET", f"/stats?{query}", {}).status == 403
+
+    def test_metrics(self):
+        class Database:
+            def storeMeasurement(self, measurement):
+                return 1
+
+        cache = ResponseCache()
+        app = InterceptorApp(Database(), "./static", cache=cache)
+        app.handle("GET", "/sensorlog?hum=50&temp=20&id=metrics-1", {})
+        app.handle("GET", "/static/css/stylesheet.css", {})
+        app.handle("GET", "/nothing", {})
+        response = app.handle("GET", "/metrics", {})
+        assert response.status == 200
+        text = response.body.decode()
+        assert (
+            'htcollector_http_requests_total{method="GET",route="/sensorlog",status="200"}'
+            in text
+        )
+        assert (
+            'htcollector_http_request_duration_seconds_count{route="/static/"}' in text
+        )
+        assert 'route="none",status="403"' in text
+        assert (
+            'htcollector_measurements_received_total{stationid="metrics-1"} 1' in text
+        )
+        assert "htcollector_static_cache_hits" in text
+        assert "htcollector_response_cache_misses 0" in text
+        assert "process_cpu_seconds_total" in text
+
+    def test_series(self):
+        class Database:
+            def iterMeasurements(
+                self, stationid, starttime, endtime=None, timeformat=None
+            ):
+                self.args = (stationid, starttime, endtime)
+                yield [{"stationid": stationid, "temperature": 20}]
+                yield [{"stationid": stationid, "temperature": 21}] * 2
+
+        db = Database()
+        app = InterceptorApp(db, "./static")
+        response = app.handle(
+            "GET", "/series?id=abc&from=2023-02-01T00:00:00%2B01:00", {}
+        )
+        assert response.status == 200
+        assert json.loads(b"".join(response.chunks)) == [
+            {"stationid": "abc", "temperature": 20},
+            {"stationid": "abc", "temperature": 21},
+            {"stationid": "abc", "temperature": 21},
+        ]
+        assert db.args[1] == datetime(2023, 2, 1, tzinfo=tz.tzoffset(None, 3600))
+        assert db.args[2] is None
+        for query in (
+            "id=abc",
+            "from=2023-02-01",
+            "id=a%20b&from=2023-02-01",
+            "id=abc&from=yesterday",
+            "id=abc&from=2023-02-01&format=csv",
+            "id=abc&id=def&from=2023-02-01",
+        ):
+            assert app.handle("GET", f"/series?{query}", {}).status == 403
+
+    def test_series_errors(self):
+        class Database:
+            error = None
+
+            def iterMeasurements(
+                self, stationid, starttime, endtime=None, timeformat=None
+            ):
+                if self.error is not None:
+                    raise self.error
+                yield [{"stationid": stationid, "temperature": 20}]
+
+        db = Database()
+        app = InterceptorApp(db, "./static", maxstreams=1)
+        path = "/series?id=abc&from=2023-02-01"
+        # the query runs before the response is sent, so failures get a status code
+        db.error = PoolExhausted("pool-1: all 5 connections in use for 5.0s")
+        assert app.handle("GET", path, {}).status == 503
+        db.error = RuntimeError("lost connection")
+        assert app.handle("GET", path, {}).status == 500
+        db.error = None
+        # at most maxstreams streams at a time
+        first = app.handle("GET", path, {})
+        assert first.status == 200
+        busy = app.handle("GET", path, {})
+        assert busy.status == 503
+        assert ("Retry-After", "1") in busy.headers
+        assert json.loads(b"".join(first.chunks))[0]["temperature"] == 20
+        second = app.handle("GET", path, {})
+        assert second.status == 200
+        # a stream that is closed early gives its slot back as well
+        second.chunks.close()
+        assert app.handle("GET", path, {}).status == 200
+
+    def test_export(self):
+        class Database:
+            def countMeasurements(self, stationid, starttime, endtime):
+                self.count = (stationid, starttime, endtime)
+                return 2
+
+            def iterMeasurements(
+                self,
+                stationid,
+                starttime,
+                endtime=None,
+                timeformat=None,
+                columns=False,
+            ):
+                self.args = (stationid, starttime, endtime, timeformat, columns)
+                yield {
+                    "t": [1, 2],
+                    "stationid": [stationid] * 2,
+                    "temperature": [20, 21],
+                    "humidity": [50, 51],
+                }
+
+        db = Database()
+        app = InterceptorApp(db, "./static")
+        response = app.handle("GET", "/export?id=*&from=2023-02-01T00:00:00Z", {})
+        assert response.status == 200
+        assert ("Content-Disposition", 'attachment; filename="all.csv"') in (
+            response.headers
+        )
+        assert b"".join(response.chunks).splitlines()[1] == b"1,*,20,50"
+        assert db.args[3:] == ("iso", True)
+        response = app.handle(
+            "GET", "/export?id=abc&from=2023-02-01T00:00:00Z&format=npy", {}
+        )
+        assert response.status == 200
+        assert b"".join(response.chunks).startswith(b"\x93NUMPY")
+        # the count and the rows cover the same range
+        assert db.count[2] == db.args[2] is not None
+        assert db.args[3] == "epochms"
+        for query in (
+            "id=abc&from=2023-02-01&format=xml",
+            "id=*&from=2023-02-01&format=bin",
+            "id=abc&format=csv",
+        ):
+            assert app.handle("GET", f"/export?{query}", {}).status == 403
+
+    def test_export_pool_exhausted(self):
+        class Database:
+            def iterMeasurements(self, *args, **kwargs):
+                raise PoolExhausted("pool-1: all 5 connections in use for 5.0s")
+                yield
+
+        app = InterceptorApp(Database(), "./static")
+        response = app.handle("GET", "/export?id=abc&from=2023-02-01", {})
+        assert response.status == 503
+
+    def test_series_chunked(self):
+        class Database:
+            def iterMeasurements(
+                self, stationid, starttime, endtime=None, timeformat=None
+            ):
+                yield [{"temperature": 20}]
+
+        interceptorhandler = InterceptorHandlerFactory.getHandler(
+            Database(), "./static"
+        )
+        with mock.patch.object(interceptorhandler, "finish", finish):
+            with mock.patch.object(
+                interceptorhandler, "date_time_string", date_time_string
+            ):
+                with mock.patch.object(interceptorhandler, "wbufsize", lambda: 1):
+                    request = MockRawRequest(
+                        b"GET /series?id=abc&from=2023-02-01 HTTP/1.1\r\n\r\n"
+                        b"GET /html HTTP/1.1\r\nConnection: close\r\n\r\n"
+                    )
+                    ihinstance = interceptorhandler(
+                        request, ("127.0.0.1", 12345), "testserver.example.org"
+                    )
+                    response = ihinstance.wfile.getvalue()
+                    assert b"Transfer-Encoding: chunked\r\n" in response
+                    assert (
+                        b'\r\n\r\n13\r\n[{"temperature":20}\r\n1\r\n]\r\n0\r\n\r\nHTTP/1.1 403'
+                        in response
+                    )
@@ -0,0 +1,84 @@
+import gzip
+import os
+from email.utils import formatdate
+
+from htcollector.StaticCache import StaticCache
+
+
+def write(path, content, mtime=None):
+    path.write_bytes(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+class TestStaticCache:
+    def test_get(self, tmp_path):
+        write(tmp_path / "style.css", b"body { color: red; }\n" * 100)
+        write(tmp_path / "tiny.txt", b"x")
+        cache = StaticCache(tmp_path)
+        assert cache.preload() == 2
+        entry = cache.get(tmp_path / "style.css")
+        assert entry.mime_type == "text/css"
+        assert gzip.decompress(entry.gzipped) == entry.body
+        assert cache.get(tmp_path / "tiny.txt").gzipped is None  # too small
+        assert cache.get(tmp_path / "missing.css") is None
+        assert cache.loads == 2 and cache.hits == 2
+
+    def test_outside(self, tmp_path):
+        (tmp_path / "static").mkdir()
+        write(tmp_path / "secret.txt", b"secret")
+        cache = StaticCache(tmp_path / "static")
+        assert cache.get(tmp_path / "static" / ".." / "secret.txt") is None
+        assert cache.get(tmp_path / "static" / "/etc/passwd") is None
+        assert cache.entries == {}
+        assert cache.contains(tmp_path / "static" / "a" / ".." / "b.css")
+
+    def test_reload_on_change(self, tmp_path):
+        write(tmp_path / "a.html", b"old", 1000000000)
+        cache = StaticCache(tmp_path)
+        old = cache.get(tmp_path / "a.html")
+        write(tmp_path / "a.html", b"new", 1000000100)
+        new = cache.get(tmp_path / "a.html")
+        assert new.body == b"new"
+        assert new.etag != old.etag
+        os.remove(tmp_path / "a.html")
+        assert cache.get(tmp_path / "a.html") is None
+
+    def test_precompressed(self, tmp_path):
+        write(tmp_path / "a.js", b"var a = 1;\n" * 100, 1000000000)
+        write(tmp_path / "a.js.gz", b"stored", 1000000000)
+        cache = StaticCache(tmp_path)
+        assert cache.preload() == 1
+        assert cache.get(tmp_path / "a.js").gzipped == b"stored"
+
+    def test_variant(self, tmp_path):
+        write(tmp_path / "a.js", b"var a = 1;\n" * 100)
+        entry = StaticCache(tmp_path).get(tmp_path / "a.js")
+        body, etag, encoding = entry.variant("gzip, deflate, br")
+        assert (body, encoding) == (entry.gzipped, "gzip")
+        assert etag != entry.etag
+        assert entry.variant("gzip;q=0") == (entry.body, entry.etag, None)
+        assert entry.variant(None) == (entry.body, entry.etag, None)
+
+    def test_notModified(self, tmp_path):
+        write(tmp_path / "a.js", b"var a = 1;\n" * 100, 1000000000)
+        entry = StaticCache(tmp_path).get(tmp_path / "a.js")
+        gzetag = entry.variant("gzip")[1]
+        assert entry.notModified({"If-None-Match": entry.etag})
+        assert entry.notModified({"If-None-Match": f'"other", W/{gzetag}'})
+        assert not entry.notModified({"If-None-Match": '"other"'})
+        assert entry.notModified(
+            {"If-Modified-Since": formatdate(1000000000, usegmt=True)}
+        )
+        assert not entry.notModified(
+            {"If-Modified-Since": formatdate(999999999, usegmt=True)}
+        )
+        assert not entry.notModified({"If-Modified-Since": "yesterday"})
+        # If-None-Match takes precedence
+        assert not entry.notModified(
+            {
+                "If-None-Match": '"other"',
+                "If-Modified-Since": formatdate(1000000000, usegmt=True),
+            }
+        )
+        assert not entry.notModified({})
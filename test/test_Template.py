@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from htcollector.Template import FileTemplate, Template
+
+
+class TestTemplate:
+    def test_render(self):
+        t = Template("<p>{a}</p>{ b }<style>p { color: red; }</style>{a}")
+        assert t.slots == ["a", "b", "a"]
+        assert t.render(a="1", b="2") == "<p>1</p>2<style>p { color: red; }</style>1"
+        with pytest.raises(KeyError):
+            t.render(a="1")
+
+    def test_no_slots(self):
+        assert Template("plain").render() == "plain"
+
+    def test_reload(self, tmp_path):
+        path = tmp_path / "page.html"
+        path.write_text("v1 {x}")
+        os.utime(path, (1000000000, 1000000000))
+        t = FileTemplate(path)
+        first = t.get()
+        assert t.render(x="a") == "v1 a"
+        assert t.get() is first  # not recompiled
+        path.write_text("v2 {x}")
+        os.utime(path, (1000000100, 1000000100))
+        assert t.render(x="a") == "v2 a"
+        os.remove(path)
+        with pytest.raises(FileNotFoundError):
+            t.get()
@@ -1,7 +1,7 @@
 import json
 import pytest
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from htcollector import Utils
 
@@ -22,3 +22,55 @@ class TestUtils:
 
         with pytest.raises(TypeError):
             json.dumps(..., cls=Utils.DatetimeEncoder)
+
+    def test_acceptsEncoding(self):
+        assert Utils.acceptsEncoding("gzip, deflate, br", "gzip")
+        assert Utils.acceptsEncoding("deflate;q=0.5, *", "gzip")
+        assert not Utils.acceptsEncoding("gzip;q=0", "gzip")
+        assert not Utils.acceptsEncoding("*;q=0", "gzip")
+        assert not Utils.acceptsEncoding("deflate", "gzip")
+        assert not Utils.acceptsEncoding(None, "gzip")
+
+    def test_chooseEncoding(self):
+        assert Utils.chooseEncoding("gzip, deflate") == "gzip"
+        assert Utils.chooseEncoding("gzip;q=0.5, deflate") == "deflate"
+        assert Utils.chooseEncoding("br, *;q=0.1") == "gzip"
+        assert Utils.chooseEncoding("identity") is None
+        assert Utils.chooseEncoding(None) is None
+
+    def test_dumpb(self):
+        d = datetime(2000, 10, 9, 12, 0, 0, 500000, tzinfo=timezone.utc)
+        obj = {"t": d, "dt": timedelta(0.5), "x": [1, 2.5, None, "é"]}
+        expected = json.dumps(
+            obj, cls=Utils.DatetimeEncoder, separators=(",", ":"), ensure_ascii=False
+        )
+        assert json.loads(Utils.dumpb(obj)) == json.loads(expected)
+        assert Utils.dumpb(obj) == expected.encode()
+        with pytest.raises(TypeError):
+            Utils.dumpb(...)
+
+    def test_dumpb_fallback(self, monkeypatch):
+        monkeypatch.setattr(Utils, "orjson", None)
+        assert (
+            Utils.dumpb({"t": datetime(2000, 10, 9, 12)})
+            == b'{"t":"2000-10-09T12:00:00"}'
+        )
+
+    def test_formatTimestamp(self):
+        t = datetime(
+            2000, 10, 9, 12, 0, 0, 123000
+        )  # naive UTC as returned by the database
+        local = Utils.formatTimestamp(t)
+        assert local.utcoffset() is not None
+        assert local == t.replace(tzinfo=timezone.utc)
+        assert Utils.formatTimestamp(t, "iso") == local.isoformat()
+        assert Utils.formatTimestamp(t, "epochms") == 971092800123
+
+    def test_percentiles(self, monkeypatch):
+        values = [3, None, 1, 4, 1, 5, 9, 2, 6]
+        expected = [1.0, 3.5, 9.0, 6.9]
+        assert Utils.percentiles(values, [0, 50, 100, 90]) == pytest.approx(expected)
+        assert Utils.percentiles([None], [50]) == [None]
+        monkeypatch.setattr(Utils, "np", None)
+        assert Utils.percentiles(values, [0, 50, 100, 90]) == pytest.approx(expected)
+        assert Utils.percentiles([7], [5, 95]) == [7, 7]
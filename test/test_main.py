@@ -23,3 +23,37 @@ class TestMain:
         captured = capsys.readouterr()
         out = captured.out
         #assert out == help_msg
+
+    def test_get_args_pool(self, monkeypatch):
+        monkeypatch.setenv("POOLSIZE", "12")
+        args = get_args(["--poolvalidate", "always"])
+        assert args.poolsize == 12
+        assert args.poolprewarm == 1
+        assert args.poolvalidate == "always"
+        assert args.poolmaxwait == 5.0
+        assert args.workers == 12
+        assert get_args(["--poolsize", "3"]).workers == 3
+        monkeypatch.setenv("WORKERS", "4")
+        assert get_args([]).workers == 4
+        with pytest.raises(SystemExit):
+            get_args(["--poolvalidate", "sometimes"])
+
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            ("1", True),
+            ("true", True),
+            ("Yes", True),
+            ("0", False),
+            ("false", False),
+            ("", False),
+        ],
+    )
+    def test_get_args_flags(self, monkeypatch, value, expected):
+        monkeypatch.setenv("PARTITION", value)
+        monkeypatch.setenv("ARCHIVE", value)
+        monkeypatch.setenv("TRACEMALLOC", value)
+        args = get_args([])
+        assert args.partition is expected
+        assert args.archive is expected
+        assert args.tracemalloc is expected
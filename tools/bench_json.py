@@ -0,0 +1,84 @@
+# Benchmark the json serialization of measurement rows.
+#
+# Compares the former path, rows with datetime objects serialized with
+# json.dumps(cls=DatetimeEncoder), with Utils.dumpb() on rows whose timestamps
+# are formatted while the rows are materialized. Both start from the naive UTC
+# tuples the database returns. dumpb() uses orjson if it is installed, run with
+# --no-orjson to time the standard library fallback.
+#
+# usage: python tools/bench_json.py --rows 10000 1000000
+
+import argparse
+import json
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from dateutil import tz
+
+from htcollector import Utils
+from htcollector.Utils import DatetimeEncoder, dumpb, formatTimestamp
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--rows", type=int, nargs="+", default=[10000, 1000000], help="payload sizes"
+)
+parser.add_argument(
+    "--no-orjson", action="store_true", help="use the standard library fallback"
+)
+args = parser.parse_args()
+
+if args.no_orjson:
+    Utils.orjson = None
+
+
+def measurement(row, timeformat=None):
+    return {
+        "timestamp": formatTimestamp(row[0], timeformat),
+        "stationid": row[1],
+        "temperature": row[2],
+        "humidity": row[3],
+    }
+
+
+def former(rows):
+    # what retrieveMeasurements and the handlers did before
+    return bytes(
+        json.dumps(
+            [
+                {
+                    "timestamp": row[0].replace(tzinfo=tz.UTC).astimezone(tz.tzlocal()),
+                    "stationid": row[1],
+                    "temperature": row[2],
+                    "humidity": row[3],
+                }
+                for row in rows
+            ],
+            cls=DatetimeEncoder,
+        ),
+        "UTF-8",
+    )
+
+
+def iso(rows):
+    return dumpb([measurement(row, "iso") for row in rows])
+
+
+def epochms(rows):
+    return dumpb([measurement(row, "epochms") for row in rows])
+
+
+print(f"json backend: {'orjson' if Utils.orjson is not None else 'json'}")
+print(f"{'rows':>9} {'serializer':>12} {'time [s]':>9} {'rows/s':>11} {'MB':>7}")
+start = datetime(2023, 1, 1)
+for n in args.rows:
+    rows = [
+        (start + timedelta(seconds=30 * i), "shellyht-1a2b3c", 20.5 + i % 7, 55.0)
+        for i in range(n)
+    ]
+    for name, serializer in (("former", former), ("iso", iso), ("epochms", epochms)):
+        t0 = perf_counter()
+        out = serializer(rows)
+        elapsed = perf_counter() - t0
+        print(
+            f"{n:9d} {name:>12} {elapsed:9.3f} {n / elapsed:11.0f} {len(out) / 1e6:7.1f}"
+        )
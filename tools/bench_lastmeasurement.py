@@ -0,0 +1,128 @@
+# Benchmark retrieveLastMeasurement() against the former N+1 query implementation.
+#
+# The benchmark adds stations named bench-NNNN to the database and removes them
+# again afterwards, so point it at a scratch database, for example the one
+# started by tox (see tox.ini).
+#
+# usage: DBUSER=test-user DBPASSWORD=test_secret python tools/bench_lastmeasurement.py
+
+import argparse
+from datetime import datetime, timedelta
+from os import environ
+from time import perf_counter
+
+from dateutil import tz
+
+from htcollector.Database import Measurement, MeasurementDatabase
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--database",
+    type=str,
+    default="shellyht",
+    help="database schema",
+)
+parser.add_argument(
+    "--dbhost",
+    type=str,
+    default="127.0.0.1",
+    help="database host",
+)
+parser.add_argument(
+    "--dbport",
+    type=str,
+    default="3306",
+    help="database port",
+)
+parser.add_argument(
+    "--stations",
+    type=int,
+    nargs="+",
+    default=[10, 100, 1000],
+    help="station counts to benchmark",
+)
+parser.add_argument(
+    "--readings", type=int, default=100, help="measurements per station"
+)
+parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+args = parser.parse_args()
+
+db = MeasurementDatabase(
+    args.database, args.dbhost, args.dbport, environ["DBUSER"], environ["DBPASSWORD"]
+)
+
+
+def legacy(db):
+    """the pre-groupwise-max implementation: one query per station"""
+    names = db.names("*")
+    rows = []
+    for stationid in db.uniqueStations():
+        with db.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """SELECT Timestamp, Stationid, Temperature, Humidity
+                        FROM Measurements
+                        WHERE Stationid = ? ORDER BY timestamp DESC LIMIT 1;""",
+                    (stationid,),
+                )
+                rows.extend(
+                    {"stationid": row[1], "name": names.get(row[1], "unknown")}
+                    for row in cursor.fetchall()
+                )
+    return rows
+
+
+def timeit(f):
+    best = None
+    for _ in range(args.repeat):
+        start = perf_counter()
+        f()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def populate(first, last):
+    now = datetime.now(tz=tz.UTC)
+    for i in range(first, last):
+        db.storeMeasurements(
+            [
+                Measurement(
+                    f"bench-{i:04d}", 20.0, 50.0, now - timedelta(minutes=5 * r)
+                )
+                for r in range(args.readings)
+            ]
+        )
+
+
+def statements(f):
+    """the number of statements f() executes through the query layer, and the rows they return"""
+    records = []
+    db.addQueryHook(records.append)
+    try:
+        f()
+    finally:
+        db.removeQueryHook(records.append)
+    return len(records), sum(r["rows"] for r in records)
+
+
+try:
+    populated = 0
+    print(
+        f"{'stations':>8} {'N+1 [ms]':>10} {'single [ms]':>12} {'speedup':>8} {'queries':>8} {'rows':>6}"
+    )
+    for n in sorted(args.stations):
+        populate(populated, n)
+        populated = n
+        assert len(db.retrieveLastMeasurement()) >= n
+        t_legacy = timeit(lambda: legacy(db))
+        t_single = timeit(lambda: db.retrieveLastMeasurement())
+        queries, rows = statements(lambda: db.retrieveLastMeasurement())
+        print(
+            f"{n:8d} {t_legacy * 1000:10.2f} {t_single * 1000:12.2f} {t_legacy / t_single:8.1f} {queries:8d} {rows:6d}"
+        )
+finally:
+    with db.pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM Measurements WHERE Stationid LIKE 'bench-%'")
+            connection.commit()
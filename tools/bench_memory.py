@@ -0,0 +1,100 @@
+# Check that the request handling does not leak without a gc.collect() per request.
+#
+# Drives the routes of the InterceptorApp directly, with a stand-in for the
+# database that keeps nothing, and reports the traced memory after every
+# round together with the collections and pauses of the garbage collector.
+# If memory keeps growing from round to round, something is leaking.
+#
+# usage: python tools/bench_memory.py --gc none --rounds 10
+
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from htcollector.Memory import POLICIES, GCMonitor
+from htcollector.Server import InterceptorApp
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--gc", type=str, choices=POLICIES + ("collect",), default="none")
+parser.add_argument("--rounds", type=int, default=10, help="number of rounds")
+parser.add_argument("--requests", type=int, default=2000, help="requests per round")
+parser.add_argument(
+    "--resourcedir", type=str, default="./static", help="static resources"
+)
+args = parser.parse_args()
+
+
+class NullDatabase:
+    def storeMeasurement(self, measurement):
+        return 1
+
+    def retrieveLastMeasurement(self, stationid=None):
+        now = datetime.now()
+        return [
+            {
+                "time": now,
+                "deltat": timedelta(0),
+                "stationid": f"bench-{i}",
+                "name": "Unknown",
+                "temperature": 20.0,
+                "humidity": 50.0,
+            }
+            for i in range(5)
+        ]
+
+    def retrieveDatetimeBefore(self, stationid, t):
+        return None
+
+    def retrieveMeasurements(self, stationid, starttime, endtime=None, **kwargs):
+        return [
+            {
+                "timestamp": starttime + timedelta(minutes=i),
+                "stationid": stationid,
+                "temperature": 20.0,
+                "humidity": 50.0,
+            }
+            for i in range(100)
+        ]
+
+    def retrieveTimeseries(self, stationids, starttime, endtime=None, **kwargs):
+        return {s: self.retrieveMeasurements(s, starttime) for s in stationids}
+
+    def names(self, stationid, name=None):
+        return {"bench-1": "Bench"}
+
+
+paths = [
+    "/sensorlog?hum=50&temp=20.5&id=bench-1",
+    "/json",
+    "/json/24?id=bench-1",
+    "/all",
+    "/names",
+    "/static/css/stylesheet.css",
+]
+
+app = InterceptorApp(NullDatabase(), args.resourcedir)
+if args.gc == "freeze":
+    gc.collect()
+    gc.freeze()
+monitor = GCMonitor()
+tracemalloc.start()
+
+print(
+    f"{'round':>5} {'req/s':>7} {'traced [KiB]':>13} {'collections':>16} {'max pause [ms]':>15}"
+)
+for r in range(args.rounds):
+    start = perf_counter()
+    for i in range(args.requests):
+        app.handle("GET", paths[i % len(paths)], {})
+        if args.gc == "collect":
+            gc.collect()  # what do_GET used to do
+    if args.gc == "periodic":
+        gc.collect()
+    elapsed = perf_counter() - start
+    stats = monitor.stats()
+    current, peak = tracemalloc.get_traced_memory()
+    print(
+        f"{r:5d} {args.requests / elapsed:7.0f} {current / 1024:13.0f} {str(stats['collections']):>16} {stats['maxpause'] * 1000:15.2f}"
+    )
@@ -0,0 +1,72 @@
+# Microbenchmark of the routing cost per request type.
+#
+# Compares the route lookup of the InterceptorApp with the sequential chain of
+# regular expressions that do_GET used before. Only the routing is timed, the
+# handlers themselves are not called, so no database is needed.
+#
+# usage: python tools/bench_router.py
+
+import argparse
+import re
+from timeit import repeat
+
+from htcollector.Server import InterceptorApp
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--number", type=int, default=100000, help="lookups per measurement"
+)
+args = parser.parse_args()
+
+# the former patterns, in the order do_GET tried them
+chain = [
+    re.compile(r"^/favicon.ico$"),
+    re.compile(
+        r"^/sensorlog\?hum=(?P<humidity>\d+(\.\d+)?)\&temp=(?P<temperature>-?\d+(\.\d+)?)\&id=(?P<stationid>[a-z01-9-]+)$",
+        re.IGNORECASE,
+    ),
+    re.compile(r"^/all$", re.IGNORECASE),
+    re.compile(
+        r"^/json(?P<p24>/24)?(\?id=(?P<stationid>[a-z01-9-]+))?$", re.IGNORECASE
+    ),
+    re.compile(r"^/names$", re.IGNORECASE),
+    re.compile(r"^(/static/(?P<resource>.*))|/$", re.IGNORECASE),
+]
+
+
+def regexchain(path):
+    for pattern in chain:
+        if m := re.match(pattern, path):
+            return m
+    return None
+
+
+app = InterceptorApp(None, "./static")
+
+
+def router(path):
+    handler, query = app.route("GET", path)
+    # the sensorlog handler still has to parse its query string
+    if handler == app.sensorlogRoute:
+        return re.match(app.sensorlogquery, query)
+    return handler
+
+
+paths = {
+    "sensorlog": "/sensorlog?hum=57&temp=21.3&id=shellyht-1a2b3c",
+    "json": "/json?id=shellyht-1a2b3c",
+    "json24": "/json/24?id=shellyht-1a2b3c",
+    "all": "/all",
+    "names": "/names",
+    "static": "/static/css/stylesheet.css",
+    "favicon": "/favicon.ico",
+}
+
+print(f"{'request':>10} {'regex [ns]':>11} {'router [ns]':>12} {'speedup':>8}")
+for name, path in paths.items():
+    assert regexchain(path) and router(path), path
+    old = min(repeat(lambda: regexchain(path), number=args.number, repeat=5))
+    new = min(repeat(lambda: router(path), number=args.number, repeat=5))
+    print(
+        f"{name:>10} {old / args.number * 1e9:11.0f} {new / args.number * 1e9:12.0f} {old / new:8.1f}"
+    )
@@ -0,0 +1,190 @@
+# Compare the threading and the asyncio server under many concurrent clients.
+#
+# Both servers are started in-process on a free port and serve the same routes.
+# By default they are backed by a small in-memory stand-in for the database so
+# that the benchmark measures the HTTP handling, use --dbhost etc. to run
+# against MariaDB instead (DBUSER and DBPASSWORD are read from the environment).
+#
+# Thousands of concurrent connections need a generous file descriptor limit:
+#
+# ulimit -n 65536
+# python tools/bench_server.py --clients 1000 2000 5000 2>/dev/null
+
+import argparse
+import asyncio
+import socket
+import threading
+from datetime import datetime, timedelta
+from os import environ
+from time import perf_counter, sleep
+
+from dateutil import tz
+
+from htcollector.AsyncServer import AsyncInterceptor
+from htcollector.Server import Interceptor
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--database", type=str, default=None, help="database schema")
+parser.add_argument("--dbhost", type=str, default="127.0.0.1", help="database host")
+parser.add_argument("--dbport", type=str, default="3306", help="database port")
+parser.add_argument(
+    "--clients",
+    type=int,
+    nargs="+",
+    default=[100, 1000, 2000],
+    help="numbers of concurrent clients",
+)
+parser.add_argument(
+    "--requests", type=int, default=5, help="requests per client, one per connection"
+)
+parser.add_argument(
+    "--path",
+    type=str,
+    default="/sensorlog?hum=50&temp=20.5&id=bench-0001",
+    help="request path",
+)
+parser.add_argument(
+    "--workers", type=int, default=8, help="worker threads of the asyncio server"
+)
+parser.add_argument(
+    "--resourcedir", type=str, default="./static", help="static resources"
+)
+args = parser.parse_args()
+
+
+class MemoryDatabase:
+    """just enough of a MeasurementDatabase to serve all routes"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.measurements = []
+
+    def storeMeasurement(self, measurement):
+        with self.lock:
+            self.measurements.append((datetime.now(tz=tz.UTC), measurement))
+        return 1
+
+    def retrieveLastMeasurement(self, stationid=None):
+        latest = {}
+        for t, m in self.measurements[-1000:]:
+            latest[m.stationid] = {
+                "time": t,
+                "deltat": timedelta(0),
+                "stationid": m.stationid,
+                "name": "Unknown",
+                "temperature": m.temperature,
+                "humidity": m.humidity,
+            }
+        return [v for k, v in latest.items() if stationid in (None, "*", k)]
+
+    def retrieveDatetimeBefore(self, stationid, t):
+        return None
+
+    def retrieveMeasurements(self, stationid, starttime, endtime=None, **kwargs):
+        return [
+            {
+                "timestamp": t,
+                "stationid": m.stationid,
+                "temperature": m.temperature,
+                "humidity": m.humidity,
+            }
+            for t, m in self.measurements[-1000:]
+            if stationid in ("*", m.stationid)
+        ]
+
+    def retrieveTimeseries(
+        self, stationids, starttime, endtime=None, columns=False, **kwargs
+    ):
+        series = {s: self.retrieveMeasurements(s, starttime) for s in stationids}
+        if columns:
+            return {
+                s: {
+                    "stationid": s,
+                    "t": [int(m["timestamp"].timestamp() * 1000) for m in rows],
+                    "temperature": [m["temperature"] for m in rows],
+                    "humidity": [m["humidity"] for m in rows],
+                }
+                for s, rows in series.items()
+            }
+        return series
+
+    def names(self, stationid, name=None):
+        return {}
+
+
+class BenchInterceptor(Interceptor):
+    # the default listen backlog of 5 would make the comparison about SYN retries
+    request_queue_size = 1024
+
+
+def freeport():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(mode, db):
+    port = freeport()
+    if mode == "threading":
+        server = BenchInterceptor(("127.0.0.1", port), db, args.resourcedir)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server = AsyncInterceptor(
+            ("127.0.0.1", port), db, args.resourcedir, workers=args.workers
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    sleep(0.5)
+    return port
+
+
+async def client(port, latencies, errors):
+    request = f"GET {args.path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode()
+    for _ in range(args.requests):
+        start = perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            if not response.startswith(b"HTTP/1.1 200") and not response.startswith(
+                b"HTTP/1.0 200"
+            ):
+                errors.append(response[:40])
+        except OSError as e:
+            errors.append(e)
+        latencies.append(perf_counter() - start)
+
+
+async def run(port, clients):
+    latencies, errors = [], []
+    start = perf_counter()
+    await asyncio.gather(*(client(port, latencies, errors) for _ in range(clients)))
+    return perf_counter() - start, sorted(latencies), errors
+
+
+if args.database:
+    from htcollector.Database import MeasurementDatabase
+
+    db = MeasurementDatabase(
+        args.database,
+        args.dbhost,
+        args.dbport,
+        environ["DBUSER"],
+        environ["DBPASSWORD"],
+    )
+else:
+    db = MemoryDatabase()
+
+ports = {mode: start(mode, db) for mode in ("threading", "asyncio")}
+
+print(
+    f"{'server':>10} {'clients':>8} {'req/s':>9} {'p50 [ms]':>9} {'p99 [ms]':>9} {'errors':>7}"
+)
+for clients in args.clients:
+    for mode, port in ports.items():
+        elapsed, latencies, errors = asyncio.run(run(port, clients))
+        n = len(latencies)
+        print(
+            f"{mode:>10} {clients:8d} {n / elapsed:9.0f} {latencies[n // 2] * 1000:9.1f} {latencies[int(n * 0.99)] * 1000:9.1f} {len(errors):7d}"
+        )